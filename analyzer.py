@@ -0,0 +1,395 @@
+"""错题分析引擎
+
+并发调用 DeepSeek 分析错题：
+- 进程内共享一个有界线程池，同时在途的请求数不超过 max_in_flight
+- 短题目按 token 预算打包进同一个 prompt，减少往返次数
+- 调用方拿到全部结果后再统一写库（一次事务）
+- 按规范化后的题目内容缓存分析结果，相同题目只调用一次模型
+- 结果按完成顺序逐题产出，可以选择流式返回模型的增量输出（SSE 接口使用）
+"""
+import hashlib
+import json
+import queue
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from sqlalchemy import select
+
+from http_client import HttpClient
+from metrics import stage_timer
+
+SYSTEM_PROMPT = """
+你是一个教育专家。请分析题目并提取知识点，以 JSON 格式输出。输出应包含以下字段：
+- tags: 知识点标签数组
+- analysis: 详细分析
+"""
+
+BATCH_SYSTEM_PROMPT = """
+你是一个教育专家。用户会一次给出多道题目，每道题目以【题目 id=编号】开头。
+请逐题分析并提取知识点，以 JSON 格式输出：{"results": [{"id": 编号, "tags": 知识点标签数组, "analysis": 详细分析}]}
+每道题目都必须在 results 中出现一次，id 与输入保持一致。
+"""
+
+# 修改 prompt、输出格式或 normalize_content 时递增，旧的缓存结果随之失效
+PROMPT_VERSION = 2
+
+# 每道题目在输出中大约需要的 token 数，用于估算 max_tokens
+OUTPUT_TOKENS_PER_ITEM = 2000
+MAX_OUTPUT_TOKENS = 8000
+
+_CJK_RE = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+
+
+class AnalysisError(Exception):
+    """模型调用或响应解析失败"""
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文约一字一个 token，其他字符约四个一个 token"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+# 在算式里有含义的标点（负号、小数点、分数、括号和区间、坐标的逗号、比例、百分号、阶乘），规范化时保留
+MATH_PUNCTUATION = frozenset('-./()[]{},:%!')
+
+
+def normalize_content(text):
+    """规范化题目内容：全角转半角、统一大小写，去掉空白和除 MATH_PUNCTUATION 以外的标点"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ''.join(ch for ch in text
+                   if not ch.isspace()
+                   and (ch in MATH_PUNCTUATION or not unicodedata.category(ch).startswith('P')))
+
+
+class AnalysisCacheStore:
+    """把分析结果缓存在数据库表里，所有进程共享；写入随调用方的事务一起提交
+
+    读取用单独的短连接，查完立即归还连接池，之后等待模型的几秒里不占用连接
+    """
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    def get_many(self, keys):
+        table = self.model.__table__
+        with self.db.engine.connect() as connection:
+            rows = connection.execute(
+                select(table.c.key, table.c.tags, table.c.analysis).where(table.c.key.in_(keys))
+            ).fetchall()
+        return {key: {'tags': json.loads(tags), 'analysis': analysis} for key, tags, analysis in rows}
+
+    def set_many(self, results, replace=False):
+        table = self.model.__table__
+        if replace:
+            self.db.session.execute(table.delete().where(table.c.key.in_(list(results))))
+        # 其他进程可能同时写入同一个键，忽略主键冲突，避免整个事务失败
+        insert = table.insert() \
+            .prefix_with('IGNORE', dialect='mysql') \
+            .prefix_with('OR IGNORE', dialect='sqlite')
+        now = datetime.now()
+        self.db.session.execute(insert, [{
+            'key': key,
+            'tags': json.dumps(result['tags'], ensure_ascii=False),
+            'analysis': result['analysis'],
+            'created_at': now
+        } for key, result in results.items()])
+
+
+class AnalysisEngine:
+    def __init__(self, api_url, api_key, model='deepseek-chat', max_in_flight=4,
+                 batch_token_budget=1500, batch_max_items=4, timeout=(5, 120), cache=None, http=None):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.max_in_flight = max_in_flight
+        self.batch_token_budget = batch_token_budget
+        self.batch_max_items = batch_max_items
+        self.timeout = timeout
+        self.cache = cache
+
+        # 正在分析的缓存键 -> Future，同一道题的并发请求共用一次调用
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        # 线程池大小即在途请求上限，所有请求共享
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight,
+                                            thread_name_prefix='analyze')
+        # 连接复用、重试、熔断和限速由 HttpClient 负责
+        self.http = http or HttpClient('deepseek', pool_maxsize=max_in_flight, timeout=timeout)
+
+    def pack(self, items):
+        """把 (key, content) 列表按 token 预算打包成若干批次，超出预算的长题目单独成批"""
+        batches = []
+        current, current_tokens = [], 0
+        for item in items:
+            tokens = estimate_tokens(item[1])
+            if tokens >= self.batch_token_budget:
+                batches.append([item])
+                continue
+            if current and (current_tokens + tokens > self.batch_token_budget
+                            or len(current) >= self.batch_max_items):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(item)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def cache_key(self, content):
+        return hashlib.sha256(
+            f'{self.model}:{PROMPT_VERSION}:{normalize_content(content)}'.encode('utf-8')
+        ).hexdigest()
+
+    def iter_events(self, items, refresh=False, stream_tokens=False, heartbeat=None):
+        """并发分析，按完成顺序逐题产出 (事件, mistake_id, 数据)
+
+        事件：
+        - result：数据是 {'tags', 'analysis'}
+        - error：数据是错误信息
+        - token：数据是模型输出的增量文本，只在 stream_tokens=True 时产出
+        - heartbeat：等待超过 heartbeat 秒没有任何事件时产出，mistake_id 和数据为 None
+
+        内容相同（规范化后）的题目只分析一次；命中缓存的直接返回；
+        其他请求正在分析的同一道题不再重复调用，等待那次调用的结果。
+        refresh=True 时跳过缓存，强制重新分析。
+        stream_tokens=True 时每道题单独调用并流式返回模型输出，不打包。
+        """
+        groups = OrderedDict()  # key -> [mistake_id, ...]
+        contents = {}
+        for mistake_id, content in items:
+            key = self.cache_key(content)
+            groups.setdefault(key, []).append(mistake_id)
+            contents.setdefault(key, content)
+
+        cached = {}
+        if not refresh and self.cache is not None and groups:
+            cached = self.cache.get_many(list(groups))
+        for key, result in cached.items():
+            for mistake_id in groups[key]:
+                yield 'result', mistake_id, result
+
+        key_futures, owned = {}, []
+        with self._lock:
+            for key in groups:
+                if key in cached:
+                    continue
+                existing = self._inflight.get(key)
+                if existing is not None and not refresh:
+                    key_futures[key] = existing
+                    continue
+                future = Future()
+                key_futures[key] = future
+                owned.append((key, contents[key]))
+                if existing is None:
+                    self._inflight[key] = future
+
+        if groups:
+            print(f"分析 {len(items)} 道题目：去重后 {len(groups)} 道，缓存命中 {len(cached)}，"
+                  f"等待进行中的请求 {len(key_futures) - len(owned)}，新调用 {len(owned)}")
+
+        # 分析线程通过队列把完成和增量输出通知给调用方线程
+        events = queue.Queue()
+        if stream_tokens:
+            for key, content in owned:
+                on_token = lambda delta, key=key: events.put(('token', key, delta))
+                self._executor.submit(self._run_batch, [(key, content)], {key: key_futures[key]}, on_token)
+        else:
+            for batch in self.pack(owned):
+                self._executor.submit(self._run_batch, batch, {key: key_futures[key] for key, _ in batch})
+        for key, future in key_futures.items():
+            future.add_done_callback(lambda future, key=key: events.put(('done', key, future)))
+
+        fresh = {}
+        owned_keys = {key for key, _ in owned}
+        remaining = len(key_futures)
+        while remaining:
+            try:
+                kind, key, value = events.get(timeout=heartbeat)
+            except queue.Empty:
+                yield 'heartbeat', None, None
+                continue
+            if kind == 'token':
+                for mistake_id in groups[key]:
+                    yield 'token', mistake_id, value
+                continue
+
+            remaining -= 1
+            try:
+                result = value.result()
+            except Exception as e:
+                for mistake_id in groups[key]:
+                    yield 'error', mistake_id, str(e)
+                continue
+            if key in owned_keys:
+                fresh[key] = result
+            for mistake_id in groups[key]:
+                yield 'result', mistake_id, result
+
+        # 在调用方线程里写缓存，和调用方的数据库事务一起提交
+        if fresh and self.cache is not None:
+            self.cache.set_many(fresh, replace=refresh)
+
+    def iter_results(self, items, refresh=False):
+        """并发分析，按完成顺序逐题产出 (mistake_id, result, error)"""
+        for event, mistake_id, data in self.iter_events(items, refresh=refresh):
+            if event == 'result':
+                yield mistake_id, data, None
+            elif event == 'error':
+                yield mistake_id, None, data
+
+    def analyze(self, items, refresh=False):
+        """分析全部题目，返回 ({id: {'tags', 'analysis'}}, {id: 错误信息})"""
+        results, errors = {}, {}
+        for mistake_id, result, error in self.iter_results(items, refresh=refresh):
+            if error is None:
+                results[mistake_id] = result
+            else:
+                errors[mistake_id] = error
+        return results, errors
+
+    def _run_batch(self, batch, futures, on_token=None):
+        try:
+            results = self._analyze_batch(batch, on_token)
+        except Exception as e:
+            for key, _ in batch:
+                futures[key].set_exception(e)
+        else:
+            for key, _ in batch:
+                futures[key].set_result(results[key])
+        finally:
+            with self._lock:
+                for key, _ in batch:
+                    if self._inflight.get(key) is futures[key]:
+                        del self._inflight[key]
+
+    def _analyze_batch(self, batch, on_token=None):
+        """batch 是 (key, content) 列表，返回 {key: result}"""
+        if len(batch) == 1:
+            key, content = batch[0]
+            return {key: self._analyze_one(content, on_token)}
+
+        # prompt 里用批次内的序号标识题目
+        user_content = '请分别分析以下 {} 道题目：\n\n{}'.format(
+            len(batch),
+            '\n\n'.join(f'【题目 id={number}】\n{content}'
+                         for number, (_, content) in enumerate(batch, 1))
+        )
+        parsed = self._chat(BATCH_SYSTEM_PROMPT, user_content,
+                            max_tokens=min(MAX_OUTPUT_TOKENS, OUTPUT_TOKENS_PER_ITEM * len(batch)))
+
+        numbered = {}
+        for entry in parsed.get('results') or []:
+            try:
+                numbered[int(entry['id'])] = {'tags': entry['tags'], 'analysis': entry['analysis']}
+            except (KeyError, TypeError, ValueError):
+                continue
+
+        # 模型漏掉或写坏的题目单独补分析
+        results = {}
+        for number, (key, content) in enumerate(batch, 1):
+            if number in numbered:
+                results[key] = numbered[number]
+            else:
+                print(f"批量结果缺少第 {number} 题，改为单独分析")
+                results[key] = self._analyze_one(content)
+        return results
+
+    def _analyze_one(self, content, on_token=None):
+        user_content = f'请分析以下题目：\n{content}'
+        if on_token is None:
+            parsed = self._chat(SYSTEM_PROMPT, user_content, max_tokens=OUTPUT_TOKENS_PER_ITEM)
+        else:
+            parsed = self._chat_stream(SYSTEM_PROMPT, user_content, OUTPUT_TOKENS_PER_ITEM, on_token)
+        try:
+            return {'tags': parsed['tags'], 'analysis': parsed['analysis']}
+        except KeyError as e:
+            raise AnalysisError(f"模型响应缺少字段: {e}")
+
+    def _post(self, system_prompt, user_content, max_tokens, stream=False):
+        payload = {
+            'model': self.model,
+            'messages': [
+                {'role': 'system', 'content': system_prompt.strip()},
+                {'role': 'user', 'content': user_content.strip()}
+            ],
+            'temperature': 0.7,
+            'response_format': {'type': 'json_object'},
+            'max_tokens': max_tokens  # 防止 JSON 被截断
+        }
+        if stream:
+            payload['stream'] = True
+        response = self.http.post(
+            self.api_url,
+            headers={
+                'Authorization': f'Bearer {self.api_key}',
+                'Content-Type': 'application/json'
+            },
+            json=payload,
+            timeout=self.timeout,
+            stream=stream
+        )
+        print(f"DeepSeek 响应状态码: {response.status_code}")
+        if response.status_code >= 400 and 'json' not in response.headers.get('Content-Type', ''):
+            raise AnalysisError(f"API 返回 {response.status_code}: {response.text[:200]}")
+        return response
+
+    @staticmethod
+    def _parse_content(content):
+        if not content:
+            raise AnalysisError("API 返回了空的内容")
+        try:
+            return json.loads(content)
+        except ValueError as e:
+            raise AnalysisError(f"解析模型响应失败: {e}")
+
+    def _chat(self, system_prompt, user_content, max_tokens):
+        with stage_timer('llm'):
+            response = self._post(system_prompt, user_content, max_tokens)
+        try:
+            result = response.json()
+        except ValueError:
+            raise AnalysisError(f"无法解析模型响应: {response.text[:200]}")
+
+        if 'error' in result:
+            raise AnalysisError(f"API 错误: {result['error']}")
+        if not result.get('choices'):
+            raise AnalysisError(f"未知的响应格式: {result}")
+
+        return self._parse_content(result['choices'][0].get('message', {}).get('content', ''))
+
+    def _chat_stream(self, system_prompt, user_content, max_tokens, on_token):
+        """流式调用（SSE），每收到一段输出就调用 on_token(增量文本)，返回解析后的完整 JSON"""
+        parts = []
+        # 计时包括读取整个流，而不只是等到响应头
+        with stage_timer('llm'):
+            with self._post(system_prompt, user_content, max_tokens, stream=True) as response:
+                if response.status_code >= 400:
+                    try:
+                        raise AnalysisError(f"API 错误: {response.json().get('error')}")
+                    except ValueError:
+                        raise AnalysisError(f"API 返回 {response.status_code}")
+                response.encoding = 'utf-8'  # text/event-stream 没有声明编码时 requests 默认按 ISO-8859-1 解码
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        raise AnalysisError(f"无法解析模型响应: {data[:200]}")
+                    if 'error' in chunk:
+                        raise AnalysisError(f"API 错误: {chunk['error']}")
+                    delta = (chunk.get('choices') or [{}])[0].get('delta', {}).get('content')
+                    if delta:
+                        parts.append(delta)
+                        on_token(delta)
+        return self._parse_content(''.join(parts))
@@ -1,27 +1,100 @@
-from flask import Flask, request, jsonify, render_template, make_response, send_file
+from flask import Flask, Request, Response, g, has_request_context, make_response, request, jsonify, render_template, send_file, stream_with_context, url_for
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified, parse_accept_header
 from flask_sqlalchemy import SQLAlchemy
-from aip import AipOcr
+from sqlalchemy import and_, bindparam, or_
+from sqlalchemy.orm import load_only
 import os
+import re
+import uuid
+import hashlib
 from config import Config
+from analyzer import AnalysisEngine, AnalysisCacheStore
+from baidu_ocr import BaiduOcrClient
+from http_client import HttpClient
+from jobs import JobQueue
+from ocr_cache import OcrCache
+from search import MistakeSearch, make_snippet, query_terms
+from similarity import SimilarityIndex
+from tag_stats import TagStats
+from export import PdfExporter, stream_file
+from http_cache import VersionTracker, compress_response
+from bulk import LoadError, MistakeTransfer
+from concurrency import gevent_active, run_blocking
+from imaging import FORMATS, ImagePipeline, PipelineReport, remove_handwriting, segment_questions, sniff_format
+from metrics import REGISTRY, REQUEST_QUERIES, REQUEST_SECONDS, observe_stage, profile_summary, start_profile, track_queries
 import json
 import traceback  # 添加到文件顶部
-import requests
-from PIL import Image, ImageDraw
-import pillow_heif  # 需要添加这个库来支持 HEIF 格式
 import io
-from datetime import datetime
-import pdfkit
-from jinja2 import Template
-import cv2
-import numpy as np
+import base64
+from datetime import date, datetime, timedelta, timezone
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+class AppRequest(Request):
+    @property
+    def max_content_length(self):
+        # 整页拆题一次上传多张照片，单独放宽请求体上限
+        if self.endpoint == 'segment_mistakes':
+            return app.config['SEGMENT_MAX_CONTENT_LENGTH']
+        return super().max_content_length
 
 app = Flask(__name__)
+app.request_class = AppRequest
 app.config.from_object(Config)
 
 # 确保上传目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-db = SQLAlchemy(app)
+def count_query(verb, elapsed):
+    """按请求累计查询数和查询耗时"""
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        g.query_seconds = g.get('query_seconds', 0) + elapsed
+
+def count_commit():
+    if has_request_context():
+        g.commit_count = g.get('commit_count', 0) + 1
+
+# 提交后不让对象过期：请求结束时会话就会丢弃，提交后再读取 id 等字段不需要重新查询
+db = SQLAlchemy(app, session_options={'expire_on_commit': False})
+track_queries(db.engine, on_query=count_query, on_commit=count_commit)
+if gevent_active() and db.engine.dialect.driver == 'mysqldb':
+    print("警告: mysqlclient 在 gevent worker 下会阻塞整个进程，请设置 MYSQL_DRIVER=pymysql")
+
+# 错题与知识点标签的多对多关联，按标签查错题走 (tag_id, mistake_id) 索引
+mistake_tags = db.Table(
+    'mistake_tags',
+    db.Column('mistake_id', db.Integer, db.ForeignKey('mistake.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_mistake_tags_tag_id_mistake_id', 'tag_id', 'mistake_id')
+)
+
+# 定义知识点标签模型
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # MySQL 默认的排序规则不区分大小写和重音，"X轴" 和 "x轴" 会被唯一索引当成同一个标签；
+    # 用二进制排序规则，和 SQLite 一样按原样比较，ensure_tags 才能查回每个写入的标签名
+    name = db.Column(db.String(100).with_variant(db.String(100, collation='utf8mb4_bin'), 'mysql'),
+                     nullable=False, unique=True, index=True)
+    # 以下统计随标签索引增量更新，见 tag_stats.py
+    mistake_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_seen = db.Column(db.Date)  # 关联的错题里最近的记录日期
+
+# 每个标签每天记录的错题数，用于计算最近几天的趋势
+class TagDaily(db.Model):
+    __tablename__ = 'tag_daily'
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    mistake_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        # 统计接口只读取最近两个窗口内的行
+        db.Index('ix_tag_daily_day_tag_id', 'day', 'tag_id'),
+    )
 
 # 定义错题模型
 class Mistake(db.Model):
@@ -29,18 +102,315 @@ class Mistake(db.Model):
     content = db.Column(db.Text, nullable=False)
     image_path = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, server_default=db.func.now())
-    tags = db.Column(db.Text)  # 存储JSON格式的标签列表
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)  # 导出时用于判断缓存的片段是否过期
+    tags = db.Column(db.Text)  # 存储JSON格式的标签列表（保留顺序，用于展示）
     analysis = db.Column(db.Text)  # 存储分析结果
+    
+    # 标签索引，只读；写入统一通过 write_tag_index()
+    tag_index = db.relationship('Tag', secondary=mistake_tags, viewonly=True)
+    
+    __table_args__ = (
+        # 列表按 (created_at, id) 倒序分页，日期范围筛选也走这个索引
+        db.Index('ix_mistake_created_at_id', 'created_at', 'id'),
+    )
+
+# 定义分析结果缓存模型（按规范化后的题目内容 + 模型 + prompt 版本寻址）
+class AnalysisCacheEntry(db.Model):
+    __tablename__ = 'analysis_cache'
+    key = db.Column(db.String(64), primary_key=True)
+    tags = db.Column(db.Text, nullable=False)  # JSON 格式的标签列表
+    analysis = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+# 相似题向量（见 similarity.py），seq 自增，删除错题时写入 vector 为空的删除标记
+class MistakeEmbedding(db.Model):
+    __tablename__ = 'mistake_embedding'
+    seq = db.Column(db.Integer, primary_key=True)
+    mistake_id = db.Column(db.Integer, nullable=False, unique=True, index=True)
+    vector = db.Column(db.LargeBinary)
+    
+    # 各进程按 seq 增量同步，SQLite 也要保证 seq 不复用已删除的值
+    __table_args__ = {'sqlite_autoincrement': True}
+
+# 数据版本号（见 http_cache.py），错题、标签和统计有改动的事务提交时加一，读接口据此生成 ETag
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)  # UTC，用作 Last-Modified
+
+# 定义后台任务模型
+class Job(db.Model):
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    kind = db.Column(db.String(32), nullable=False)  # ocr / analyze / export
+    status = db.Column(db.String(16), nullable=False, index=True)  # pending / running / done / failed
+    payload = db.Column(db.Text)  # JSON 格式的任务参数
+    result = db.Column(db.Text)  # JSON 格式的任务结果
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+# 全文检索（MySQL FULLTEXT ngram / SQLite FTS5）
+mistake_search = MistakeSearch(db, Mistake)
+mistake_search.register_events()
+
+# 相似题检索和重复题检测（题目内容的哈希 n-gram 向量，每个进程在内存里保存一份矩阵）
+mistake_index = SimilarityIndex(db, Mistake, MistakeEmbedding, dim=app.config['SIMILARITY_DIM'])
+mistake_index.register_events()
+
+# 知识点统计（错题数、最近出现日期、每天的数量），随标签索引增量更新
+tag_stats = TagStats(db, Tag, TagDaily, Mistake, mistake_tags)
+
+# 数据版本号：ORM 改动错题时自动标记，标签索引等批量写入在 write_tag_index/remove_from_tag_index 里标记
+data_version = VersionTracker(db, DataVersion)
+data_version.register_events((Mistake,))
+
+def ensure_tags(names):
+    """确保标签存在，返回 {标签名: tag_id}"""
+    if not names:
+        return {}
+    # 多个进程可能同时创建同一个标签，忽略唯一键冲突后再查 id
+    insert = Tag.__table__.insert() \
+        .prefix_with('IGNORE', dialect='mysql') \
+        .prefix_with('OR IGNORE', dialect='sqlite')
+    db.session.execute(insert, [{'name': name} for name in names])
+    rows = db.session.query(Tag.id, Tag.name).filter(Tag.name.in_(names)).all()
+    return {name: tag_id for tag_id, name in rows}
+
+def normalize_tags(tags):
+    """去掉空标签和重复标签，保留顺序"""
+    if isinstance(tags, str):
+        tags = [tags]
+    names = []
+    for tag in tags or []:
+        name = str(tag).strip()[:100]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def set_mistake_tags(tag_map):
+    """批量设置错题标签：{mistake: [标签, ...]}，同时更新 JSON 字段和标签索引"""
+    if not tag_map:
+        return
+    names_by_id = {}
+    for mistake, tags in tag_map.items():
+        names = normalize_tags(tags)
+        mistake.tags = json.dumps(names, ensure_ascii=False)
+        names_by_id[mistake.id] = names
+    write_tag_index(names_by_id)
+
+def write_tag_index(names_by_id, replace=True):
+    """写入标签索引：{mistake_id: [标签, ...]}，标签需已经过 normalize_tags；新插入的错题可以不删除旧关联
+
+    只增删有变化的关联，并按差量更新知识点统计
+    """
+    tag_ids = ensure_tags(sorted({name for names in names_by_id.values() for name in names}))
+    links, days = tag_stats.current(list(names_by_id))
+    wanted = {(mistake_id, tag_ids[name]) for mistake_id, names in names_by_id.items() for name in names}
+    removed = links - wanted if replace else set()
+    added = wanted - links
+    if removed:
+        db.session.execute(
+            mistake_tags.delete().where(and_(mistake_tags.c.mistake_id == bindparam('link_mistake_id'),
+                                             mistake_tags.c.tag_id == bindparam('link_tag_id'))),
+            [{'link_mistake_id': mistake_id, 'link_tag_id': tag_id} for mistake_id, tag_id in removed]
+        )
+    if added:
+        db.session.execute(mistake_tags.insert(),
+                           [{'mistake_id': mistake_id, 'tag_id': tag_id} for mistake_id, tag_id in added])
+    tag_stats.apply(added, removed, days)
+    data_version.mark()
+
+def remove_from_tag_index(mistake_ids):
+    """删除错题时清理标签关联，并从知识点统计中减去"""
+    links, days = tag_stats.current(mistake_ids)
+    if links:
+        db.session.execute(mistake_tags.delete().where(mistake_tags.c.mistake_id.in_(mistake_ids)))
+    tag_stats.apply(set(), links, days)
+    data_version.mark()
+
+# 错题批量导入导出（NDJSON）
+mistake_transfer = MistakeTransfer(db, Mistake, write_tag_index, [mistake_search, mistake_index], normalize_tags)
+
+def make_http_client(name, qps, timeout, pool_maxsize=10):
+    return HttpClient(
+        name, qps=qps, pool_maxsize=pool_maxsize, timeout=timeout,
+        max_retries=app.config['HTTP_MAX_RETRIES'],
+        backoff_base=app.config['HTTP_BACKOFF_BASE'],
+        backoff_max=app.config['HTTP_BACKOFF_MAX'],
+        failure_threshold=app.config['CIRCUIT_FAILURE_THRESHOLD'],
+        reset_timeout=app.config['CIRCUIT_RESET_TIMEOUT']
+    )
+
+# 对外调用的 HTTP 客户端：连接池、重试、熔断、限速，每个上游一个
+ocr_http = make_http_client('baidu-ocr', app.config['BAIDU_OCR_QPS'],
+                            (app.config['BAIDU_OCR_CONNECT_TIMEOUT'], app.config['BAIDU_OCR_READ_TIMEOUT']))
+deepseek_http = make_http_client('deepseek', app.config['DEEPSEEK_QPS'],
+                                 (app.config['DEEPSEEK_CONNECT_TIMEOUT'], app.config['DEEPSEEK_READ_TIMEOUT']),
+                                 pool_maxsize=app.config['ANALYZE_MAX_IN_FLIGHT'])
 
 # 初始化百度OCR客户端
-ocr_client = AipOcr(app.config['BAIDU_APP_ID'],
-                    app.config['BAIDU_API_KEY'],
-                    app.config['BAIDU_SECRET_KEY'])
+ocr_client = BaiduOcrClient(app.config['BAIDU_API_KEY'],
+                            app.config['BAIDU_SECRET_KEY'],
+                            ocr_http,
+                            base_url=app.config['BAIDU_OCR_BASE_URL'])
+
+# OCR 结果缓存：同一张图片重复上传时不再调用百度 OCR
+ocr_cache = OcrCache(app.config['OCR_CACHE_FOLDER'],
+                     max_entries=app.config['OCR_CACHE_MAX_ENTRIES'],
+                     ttl=app.config['OCR_CACHE_TTL'],
+                     max_files=app.config['OCR_CACHE_MAX_FILES'])
+
+image_pipeline = ImagePipeline(
+    stages=app.config['IMAGE_PIPELINE'],
+    max_side=app.config['IMAGE_MAX_SIDE'],
+    max_skew=app.config['IMAGE_MAX_SKEW'],
+    ocr_quality=app.config['OCR_JPEG_QUALITY'],
+    jpeg_quality=app.config['IMAGE_JPEG_QUALITY'],
+    webp_quality=app.config['IMAGE_WEBP_QUALITY']
+)
+
+# 整页拆题时各页并发识别（进程内共享，并发数同时受百度 OCR 的 QPS 限制）
+segment_executor = ThreadPoolExecutor(max_workers=app.config['SEGMENT_MAX_WORKERS'])
+
+# 初始化错题分析引擎（进程内共享线程池）
+analysis_engine = AnalysisEngine(
+    api_url=app.config['DEEPSEEK_API_URL'],
+    api_key=app.config['DEEPSEEK_API_KEY'],
+    model=app.config['DEEPSEEK_MODEL'],
+    max_in_flight=app.config['ANALYZE_MAX_IN_FLIGHT'],
+    batch_token_budget=app.config['ANALYZE_BATCH_TOKEN_BUDGET'],
+    batch_max_items=app.config['ANALYZE_BATCH_MAX_ITEMS'],
+    timeout=(app.config['DEEPSEEK_CONNECT_TIMEOUT'], app.config['DEEPSEEK_READ_TIMEOUT']),
+    cache=AnalysisCacheStore(db, AnalysisCacheEntry),
+    http=deepseek_http
+)
+
+# PDF 导出（模板只编译一次，错题 HTML 片段按 id + updated_at 缓存）
+os.makedirs(app.config['EXPORT_FOLDER'], exist_ok=True)
+pdf_exporter = PdfExporter(cache_size=app.config['EXPORT_FRAGMENT_CACHE_SIZE'])
+
+# 后台任务队列（任务存放在数据库中，由 worker.py 执行）
+os.makedirs(app.config['JOB_FOLDER'], exist_ok=True)
+job_queue = JobQueue(db, Job,
+                     timeout=app.config['JOB_TIMEOUT'],
+                     max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+                     folder=app.config['JOB_FOLDER'],
+                     retention=app.config['JOB_RETENTION'])
+
+# 高精度文字识别的参数
+OCR_OPTIONS = {
+    "detect_direction": "true",
+    "probability": "true",       # 返回置信度
+    "vertexes_location": "true"  # 返回文字位置
+}
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    # 请求带 X-Profile 头时用 cProfile 记录这个请求，返回性能摘要代替原来的响应
+    if app.config['PROFILE_ENABLED'] and request.headers.get('X-Profile'):
+        g.profiler = start_profile()
+
+@app.after_request
+def compress(response):
+    # after_request 按注册的倒序执行，压缩在记录指标和替换成性能摘要之后
+    if not app.config['COMPRESS_ENABLED']:
+        return response
+    return compress_response(response, request.accept_encodings,
+                             min_size=app.config['COMPRESS_MIN_SIZE'],
+                             gzip_level=app.config['COMPRESS_GZIP_LEVEL'],
+                             brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'])
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_start,
+                            endpoint=endpoint, method=request.method, status=response.status_code)
+    # 流式响应（SSE、NDJSON 导出）在这之后才执行的查询不计入
+    REQUEST_QUERIES.observe(g.get('query_count', 0), endpoint=endpoint, method=request.method)
+    if app.config['QUERY_STATS_HEADERS']:
+        response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+        response.headers['X-Query-Time'] = f"{g.get('query_seconds', 0) * 1000:.1f}"  # 毫秒
+        response.headers['X-Commit-Count'] = str(g.get('commit_count', 0))
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        summary = profile_summary(profiler, limit=app.config['PROFILE_LIMIT'])
+        profiled = Response(summary, mimetype='text/plain')
+        profiled.headers['X-Profile-Status'] = str(response.status_code)
+        return profiled
+    return response
+
+@app.errorhandler(413)
+def request_too_large(e):
+    limit = request.max_content_length
+    return jsonify({'error': '上传的文件太大', 'detail': f'一次上传的总大小不能超过 {limit // (1024 * 1024)} MB'}), 413
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 格式的指标（本进程）"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def versioned(view):
+    """只读接口的条件请求：ETag/Last-Modified 来自数据版本号，没有变化时返回 304，不执行接口本身
+
+    ETag 里带上日期，统计接口的趋势窗口跨天时也会重新计算；压缩前后内容相同，用弱 ETag
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version, updated_at = data_version.current()
+        etag = f'W/"{version}-{date.today():%Y%m%d}"'
+        # 版本号的修改时间是 UTC；不早于今天零点，和 ETag 一样跨天后失效
+        today = datetime.combine(date.today(), datetime.min.time()).astimezone(timezone.utc).replace(tzinfo=None)
+        last_modified = updated_at and max(updated_at, today)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.headers['ETag'] = etag
+        if last_modified:
+            response.last_modified = last_modified
+        # 浏览器每次都带上 ETag 回来验证，内容只缓存在本机
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+# 按内容哈希保存的图片文件名（save_upload），可以通过 /images/<文件名> 访问
+IMAGE_NAME = re.compile(r'[0-9a-f]{64}\.[a-z0-9]{2,5}')
+
+def image_url(path):
+    """按内容哈希保存的图片的访问地址，内容不会变化，可以长期缓存；其他路径返回 None"""
+    name = os.path.basename(path or '')
+    return url_for('get_image', name=name) if IMAGE_NAME.fullmatch(name) else None
+
+def save_upload(image):
+    """按内容哈希保存图片（上传的原图、处理后的图片），同一张图片只保存一次，返回相对路径"""
+    digest = hashlib.sha256(image).hexdigest()
+    path = os.path.join(app.config['UPLOAD_FOLDER'], digest[:2], f'{digest}.{sniff_format(image)}')
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(image)
+        os.replace(tmp_path, path)
+    return path
+
+def find_duplicates(texts):
+    """保存新错题前查找内容几乎相同的已有错题，对每段内容返回 [{'id', 'score', 'content'}, ...]"""
+    hits = mistake_index.similar_to_texts(texts, limit=3, min_score=app.config['DUPLICATE_THRESHOLD'])
+    ids = {mistake_id for found in hits for mistake_id, _ in found}
+    contents = dict(db.session.query(Mistake.id, Mistake.content).filter(Mistake.id.in_(ids))) if ids else {}
+    return [[{'id': mistake_id, 'score': round(score, 4), 'content': contents[mistake_id]}
+             for mistake_id, score in found if mistake_id in contents] for found in hits]
+
 @app.route('/api/upload', methods=['POST'])
 def upload_image():
     try:
@@ -52,13 +422,15 @@ def upload_image():
                 return jsonify({'error': '文本内容为空'}), 400
                 
             # 保存到数据库
+            duplicates = find_duplicates([text])[0]
             mistake = Mistake(content=text)
             db.session.add(mistake)
             db.session.commit()
             
             return jsonify({
                 'success': True,
-                'id': mistake.id
+                'id': mistake.id,
+                'duplicates': duplicates
             })
         
         # 处理图片上传的情况
@@ -70,91 +442,235 @@ def upload_image():
             return jsonify({'error': '没有选择文件', 'detail': 'No filename'}), 400
         
         if file:
-            # 获取文件扩展名
-            file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-            
-            # 保存文件
-            filename = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-            file.save(filename)
-            
-            # 如果是 HEIF/HEIC 格式，转换为 JPEG
-            if file_ext in ['heif', 'heic']:
-                try:
-                    # 读取 HEIF 图片
-                    heif_file = pillow_heif.read_heif(filename)
-                    # 转换为 PIL Image
-                    image = Image.frombytes(
-                        heif_file.mode, 
-                        heif_file.size, 
-                        heif_file.data,
-                        "raw",
-                    )
-                    # 转换为 JPEG 并保存
-                    jpeg_filename = filename.rsplit('.', 1)[0] + '.jpg'
-                    image.save(jpeg_filename, 'JPEG')
-                    filename = jpeg_filename  # 更新文件名为转换后的 JPEG 文件
-                except Exception as e:
-                    return jsonify({'error': 'HEIF 转换失败', 'detail': str(e)}), 500
+            # 直接在内存里处理（HEIC 也在内存里解码），不落盘
+            image = file.read()
+            report = PipelineReport()
+            _, data, mimetype = recognize_image(
+                image, negotiate_image_format(request.headers.get('Accept')), report)
             
-            # 使用高精度文字识别
-            options = {
-                "detect_direction": "true",
-                "probability": "true",       # 返回置信度
-                "vertexes_location": "true"  # 返回文字位置
-            }
-            
-            print("开始调用百度 OCR...")
-            result = ocr_client.accurate(filename, options)
-            print("OCR 返回结果:", result)
-            
-            if 'error_code' in result:
-                raise Exception(result.get('error_msg', '识别失败'))
-            
-            # 处理识别结果
-            img = Image.open(filename).convert('RGB')
-            draw = ImageDraw.Draw(img)
-            
-            # 用白色填充低置信度的区域（可能是手写）
-            for word_info in result['words_result']:
-                probability = float(word_info['probability']['average'])
-                if probability < 0.85:  # 低置信度可能是手写
-                    # 获取文字区域坐标
-                    location = word_info['location']
-                    # 用白色填充
-                    draw.rectangle([
-                        location['left'], location['top'],
-                        location['left'] + location['width'],
-                        location['top'] + location['height']
-                    ], fill='white')
-                    print(f"移除低置信度文字: {word_info['words']}, 置信度: {probability}")
-            
-            # 保存到内存
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            return send_file(
-                io.BytesIO(img_byte_arr),
-                mimetype='image/png',
-                as_attachment=False
-            )
+            # 只有要求保存时才写盘（原图和处理后的图片），文件名用内容哈希
+            response = image_response(data, mimetype, report, save=wants_save())
+            if wants_save():
+                # 只返回公开的访问地址，不暴露服务器上的文件路径
+                response.headers['X-Original-Image-Url'] = image_url(save_upload(image))
+            return response
     
+    except HTTPException:
+        raise  # 请求体过大（413）等交给 errorhandler 返回
     except Exception as e:
         return jsonify({'error': '处理失败', 'detail': str(e)}), 500
     
     return jsonify({'error': '未知错误'}), 500
 
+# 错题可以返回的字段，列表接口可以用 fields= 只取其中一部分
+MISTAKE_FIELDS = ('id', 'content', 'image_path', 'created_at', 'tags', 'analysis')
+
+def mistake_to_dict(m, fields=MISTAKE_FIELDS):
+    data = {'id': m.id}
+    if 'content' in fields:
+        data['content'] = m.content
+    if 'image_path' in fields:
+        data['image_path'] = m.image_path
+        data['image_url'] = image_url(m.image_path)
+    if 'created_at' in fields:
+        data['created_at'] = m.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    if 'tags' in fields:
+        data['tags'] = json.loads(m.tags) if m.tags else []  # 添加标签
+    if 'analysis' in fields:
+        data['analysis'] = m.analysis  # 添加分析结果
+    return data
+
+def encode_cursor(m):
+    raw = json.dumps([m.created_at.isoformat(), m.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    created_at, mistake_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(created_at), int(mistake_id)
+
 @app.route('/api/mistakes', methods=['GET'])
-def get_mistakes():
-    mistakes = Mistake.query.order_by(Mistake.created_at.desc()).all()
-    return jsonify([{
-        'id': m.id,
-        'content': m.content,
-        'image_path': m.image_path,
-        'created_at': m.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        'tags': json.loads(m.tags) if m.tags else [],  # 添加标签
-        'analysis': m.analysis  # 添加分析结果
-    } for m in mistakes])
+@app.route('/api/tags/<path:tag>/mistakes', methods=['GET'])
+@versioned
+def get_mistakes(tag=None):
+    """分页获取错题列表
+    
+    参数：limit（默认 20，最大 100）、cursor（上一页返回的 next_cursor）、
+    fields（逗号分隔的字段列表）、tag（知识点标签）、start/end（日期，YYYY-MM-DD，包含两端）、
+    with_total=1（第一页返回总数；默认不统计，total 为 null，是否还有下一页看 next_cursor）
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        fields = MISTAKE_FIELDS
+        if request.args.get('fields'):
+            fields = tuple(f for f in request.args['fields'].split(',') if f in MISTAKE_FIELDS)
+        
+        query = Mistake.query
+        
+        # 只加载需要的列，列表不需要时就不读 analysis 这样的大字段
+        columns = {'id', 'created_at'} | set(fields)
+        query = query.options(load_only(*[getattr(Mistake, c) for c in MISTAKE_FIELDS if c in columns]))
+        
+        tag = tag or request.args.get('tag')
+        if tag:
+            # 通过标签索引筛选，不需要解析每一行的 JSON
+            query = query.join(mistake_tags, mistake_tags.c.mistake_id == Mistake.id) \
+                .join(Tag, Tag.id == mistake_tags.c.tag_id) \
+                .filter(Tag.name == tag)
+        if request.args.get('start'):
+            query = query.filter(Mistake.created_at >= datetime.strptime(request.args['start'], '%Y-%m-%d'))
+        if request.args.get('end'):
+            end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1)
+            query = query.filter(Mistake.created_at < end)
+        
+        cursor = request.args.get('cursor')
+        filtered_by_date = bool(request.args.get('start') or request.args.get('end'))
+        total = None
+        if cursor:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+            query = query.filter(or_(
+                Mistake.created_at < cursor_created_at,
+                and_(Mistake.created_at == cursor_created_at, Mistake.id < cursor_id)
+            ))
+        elif request.args.get('with_total', '').lower() in ('1', 'true', 'yes'):
+            # 统计总数要扫描全部符合条件的行，只在第一页按需统计；只按标签筛选时直接用标签上的计数
+            if tag and not filtered_by_date:
+                total = db.session.query(Tag.mistake_count).filter(Tag.name == tag).scalar() or 0
+            else:
+                total = query.order_by(None).count()
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+    
+    # 多取一条判断是否还有下一页
+    mistakes = query.order_by(Mistake.created_at.desc(), Mistake.id.desc()).limit(limit + 1).all()
+    has_more = len(mistakes) > limit
+    mistakes = mistakes[:limit]
+    
+    return jsonify({
+        'items': [mistake_to_dict(m, fields) for m in mistakes],
+        'next_cursor': encode_cursor(mistakes[-1]) if has_more else None,
+        'total': total
+    })
+
+@app.route('/api/tags', methods=['GET'])
+@versioned
+def get_tags():
+    """各知识点标签的错题数，按数量倒序"""
+    rows = db.session.query(Tag.name, Tag.mistake_count) \
+        .filter(Tag.mistake_count > 0) \
+        .order_by(Tag.mistake_count.desc(), Tag.name) \
+        .all()
+    return jsonify([{'name': name, 'count': n} for name, n in rows])
+
+# 知识点统计可以按这些字段倒序排列
+TAG_STATS_SORTS = ('count', 'recent', 'change', 'last_seen')
+
+@app.route('/api/stats/tags', methods=['GET'])
+@versioned
+def get_tag_stats():
+    """薄弱知识点统计：各标签的错题数、最近出现日期和最近的变化趋势
+    
+    参数：days（趋势窗口天数，默认 TAG_STATS_WINDOW_DAYS，最大 90）、sort（count/recent/change/last_seen）、
+    limit（默认 50，最大 500）。recent 是最近 days 天新增的错题数，previous 是之前 days 天的，change 为两者之差
+    """
+    try:
+        days = min(max(int(request.args.get('days', app.config['TAG_STATS_WINDOW_DAYS'])), 1), 90)
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError as e:
+        return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+    sort = request.args.get('sort', 'count')
+    if sort not in TAG_STATS_SORTS:
+        return jsonify({'error': '参数错误', 'detail': f'sort 只能是 {", ".join(TAG_STATS_SORTS)}'}), 400
+    
+    stats = tag_stats.summary(window_days=days)
+    if sort == 'last_seen':
+        stats.sort(key=lambda item: (item['last_seen'] or '', item['count']), reverse=True)
+    else:
+        stats.sort(key=lambda item: (item[sort], item['count']), reverse=True)
+    return jsonify({
+        'days': days,
+        'total_tags': len(stats),
+        'items': stats[:limit]
+    })
+
+@app.route('/api/mistakes/search', methods=['GET'])
+@versioned
+def search_mistakes():
+    """全文检索错题内容和分析结果，按相关度排序，返回高亮摘要
+    
+    参数：q（空格分隔多个关键词，需全部命中）、page（从 1 开始）、limit（默认 20，最大 100）
+    """
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'error': '搜索内容不能为空'}), 400
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError as e:
+        return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+    
+    total, hits, capped = mistake_search.search(q, limit=limit, offset=(page - 1) * limit)
+    mistakes = {m.id: m for m in Mistake.query.filter(Mistake.id.in_([mistake_id for mistake_id, _ in hits]))}
+    terms = query_terms(q)
+    
+    items = []
+    for mistake_id, score in hits:
+        m = mistakes.get(mistake_id)
+        if m is None:
+            continue
+        items.append({
+            'id': m.id,
+            'created_at': m.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'tags': json.loads(m.tags) if m.tags else [],
+            'score': round(score, 4),
+            'content_snippet': make_snippet(m.content, terms),
+            'analysis_snippet': make_snippet(m.analysis, terms)
+        })
+    
+    return jsonify({
+        'items': items,
+        'total': total,
+        'total_capped': capped,  # 为 true 时 total 是截断后的数量
+        'page': page,
+        'limit': limit
+    })
+
+@app.route('/api/mistakes/<int:mistake_id>', methods=['GET'])
+@versioned
+def get_mistake(mistake_id):
+    mistake = Mistake.query.get_or_404(mistake_id)
+    return jsonify(mistake_to_dict(mistake))
+
+@app.route('/api/mistakes/<int:mistake_id>/similar', methods=['GET'])
+@versioned
+def similar_mistakes(mistake_id):
+    """与指定错题内容相似的其他错题，按相似度倒序
+    
+    参数：limit（默认 10，最大 50）、min_score（默认 SIMILAR_MIN_SCORE）；
+    相似度不低于 DUPLICATE_THRESHOLD 的标记 duplicate 为 true
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+        min_score = float(request.args.get('min_score', app.config['SIMILAR_MIN_SCORE']))
+    except ValueError as e:
+        return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+    
+    mistake = Mistake.query.options(load_only(Mistake.id, Mistake.content)).get_or_404(mistake_id)
+    hits = mistake_index.similar_to(mistake.id, mistake.content, limit=limit, min_score=min_score)
+    fields = ('id', 'content', 'created_at', 'tags')
+    mistakes = {m.id: m for m in Mistake.query.options(load_only(*[getattr(Mistake, f) for f in fields]))
+                .filter(Mistake.id.in_([similar_id for similar_id, _ in hits]))} if hits else {}
+    
+    items = []
+    for similar_id, score in hits:
+        m = mistakes.get(similar_id)
+        if m is None:
+            continue
+        item = mistake_to_dict(m, fields)
+        item['score'] = round(score, 4)
+        item['duplicate'] = score >= app.config['DUPLICATE_THRESHOLD']
+        items.append(item)
+    
+    return jsonify({'id': mistake_id, 'items': items})
 
 @app.route('/api/mistakes/<int:mistake_id>', methods=['PUT'])
 def update_mistake(mistake_id):
@@ -171,6 +687,8 @@ def update_mistake(mistake_id):
                 'created_at': mistake.created_at.strftime('%Y-%m-%d %H:%M:%S')
             }
         })
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({'error': '更新失败', 'detail': str(e)}), 500
 
@@ -178,111 +696,86 @@ def update_mistake(mistake_id):
 def delete_mistake(mistake_id):
     try:
         mistake = Mistake.query.get_or_404(mistake_id)
+        remove_from_tag_index([mistake.id])
         db.session.delete(mistake)
         db.session.commit()
         return jsonify({'success': True})
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({'error': '删除失败', 'detail': str(e)}), 500
 
+def load_for_analysis(mistake_ids, refresh=False):
+    """读取要分析的错题，返回 (全部行, 需要调用模型的行)
+
+    只读取需要的列，读完立即结束只读事务，等待模型期间不占用连接池里的连接
+    """
+    rows = db.session.query(Mistake.id, Mistake.content, Mistake.tags, Mistake.analysis) \
+        .filter(Mistake.id.in_(mistake_ids)).all()
+    db.session.rollback()
+    # 已经有分析结果且不需要刷新的直接返回
+    return rows, [row for row in rows if refresh or not (row.analysis and row.tags)]
+
+def save_analysis(analyzed, contents):
+    """保存分析结果 {mistake_id: {'tags', 'analysis'}}，返回规范化后的标签 {mistake_id: [标签, ...]}
+
+    所有错题用一条批量 UPDATE 写入，同时更新标签索引和全文索引（contents 为 {mistake_id: 题目内容}），不提交
+    """
+    if not analyzed:
+        return {}
+    names_by_id = {mistake_id: normalize_tags(result['tags']) for mistake_id, result in analyzed.items()}
+    table = Mistake.__table__
+    db.session.execute(
+        table.update().where(table.c.id == bindparam('mistake_id'))
+        .values(tags=bindparam('tags_json'), analysis=bindparam('analysis_text'), updated_at=datetime.now()),
+        [{'mistake_id': mistake_id,
+          'tags_json': json.dumps(names_by_id[mistake_id], ensure_ascii=False),
+          'analysis_text': result['analysis']} for mistake_id, result in analyzed.items()]
+    )
+    write_tag_index(names_by_id)
+    mistake_search.index_rows([(mistake_id, contents[mistake_id], result['analysis'])
+                               for mistake_id, result in analyzed.items()])
+    return names_by_id
+
+def analyze_mistake_ids(mistake_ids, refresh=False):
+    """分析指定的错题并在一个事务里保存结果，返回 (结果列表, 失败列表)"""
+    rows, pending = load_for_analysis(mistake_ids, refresh)
+    print(f"待分析 {len(pending)} 道题目，共选中 {len(rows)} 道")
+    analyzed, errors = analysis_engine.analyze([(row.id, row.content) for row in pending], refresh=refresh)
+    
+    # 所有结果在一个事务里提交
+    names_by_id = save_analysis(analyzed, {row.id: row.content for row in pending})
+    db.session.commit()
+    
+    results = []
+    for row in rows:
+        if row.id in errors:
+            continue
+        if row.id in analyzed:
+            results.append({'id': row.id, 'tags': names_by_id[row.id], 'analysis': analyzed[row.id]['analysis']})
+        else:
+            results.append({'id': row.id, 'tags': json.loads(row.tags), 'analysis': row.analysis})
+    
+    if errors and not analyzed:
+        raise Exception('; '.join(f'{mistake_id}: {error}' for mistake_id, error in errors.items()))
+    
+    return results, [{'id': mistake_id, 'detail': error} for mistake_id, error in errors.items()]
+
 @app.route('/api/mistakes/analyze', methods=['POST'])
 def analyze_mistakes():
     try:
         data = request.get_json()
-        mistake_ids = data.get('mistake_ids', [])
-        
-        mistakes = Mistake.query.filter(Mistake.id.in_(mistake_ids)).all()
-        results = []
-        
-        for mistake in mistakes:
-            # 如果已经有分析结果且不需要刷新，直接返回
-            if mistake.analysis and mistake.tags and not data.get('refresh', False):
-                results.append({
-                    'id': mistake.id,
-                    'tags': json.loads(mistake.tags),
-                    'analysis': mistake.analysis
-                })
-                continue
-                
-            # 调用 API 进行分析
-            system_prompt = """
-            你是一个教育专家。请分析题目并提取知识点，以 JSON 格式输出。输出应包含以下字段：
-            - tags: 知识点标签数组
-            - analysis: 详细分析
-            """
-            
-            messages = [
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': f'请分析以下题目：\n{mistake.content}'}
-            ]
-            
-            response = requests.post(
-                'https://api.deepseek.com/v1/chat/completions',
-                headers={
-                    'Authorization': f'Bearer {app.config["DEEPSEEK_API_KEY"]}',
-                    'Content-Type': 'application/json'
-                },
-                json={
-                    'model': 'deepseek-chat',
-                    'messages': [{
-                        'role': msg['role'],
-                        'content': msg['content'].strip()
-                    } for msg in messages],
-                    'temperature': 0.7,
-                    'response_format': {'type': 'json_object'},
-                    'max_tokens': 2000  # 防止 JSON 被截断
-                }
-            )
-            
-            # 把日志移到这里
-            print(f"请求 URL: {response.request.url}")
-            print(f"请求头: {response.request.headers}")
-            print(f"请求体: {response.request.body}")
-            print(f"响应状态码: {response.status_code}")
-            print(f"模型返回的原始响应: {response.text}")
-            
-            try:
-                result = response.json()
-                print(f"解析后的结果: {result}")
-                
-                if 'error' in result:
-                    raise ValueError(f"API 错误: {result['error']}")
-                
-                if 'choices' in result and len(result['choices']) > 0:
-                    content = result['choices'][0].get('message', {}).get('content', '')
-                    if not content:
-                        raise ValueError("API 返回了空的内容")
-                    
-                    # 解析 JSON 响应
-                    parsed = json.loads(content)
-                    analysis = parsed['analysis']
-                    tags = parsed['tags']
-                else:
-                    print(f"未知的响应格式: {result}")
-                    raise ValueError(f"未知的响应格式: {result}")
-                
-                print(f"成功提取分析结果: {analysis}")
-                print(f"提取的标签: {tags}")
-                
-                # 保存分析结果到数据库
-                mistake.analysis = analysis
-                mistake.tags = json.dumps(tags, ensure_ascii=False)
-                results.append({
-                    'id': mistake.id,
-                    'tags': tags,
-                    'analysis': analysis
-                })
-            except Exception as e:
-                print(f"解析响应失败: {str(e)}")
-                raise Exception(f"解析模型响应失败: {str(e)}")
-
-            db.session.commit()
+        results, errors = analyze_mistake_ids(data.get('mistake_ids', []), data.get('refresh', False))
         
         return jsonify({
             'success': True,
-            'message': f'成功分析 {len(mistakes)} 道题目',
-            'results': results  # 只返回分析结果
+            'message': f'成功分析 {len(results)} 道题目',
+            'results': results,  # 只返回分析结果
+            'errors': errors
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_detail = str(e)
         print(f"分析错误: {error_detail}")
@@ -292,6 +785,64 @@ def analyze_mistakes():
             'traceback': traceback.format_exc()
         }), 500
 
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+@app.route('/api/mistakes/analyze/stream', methods=['POST'])
+def analyze_mistakes_stream():
+    """以 Server-Sent Events 逐题返回分析结果，每道题完成后立即保存并推送
+
+    事件：start（总数）、result（一道题的标签和分析）、error（一道题失败）、
+    token（stream_tokens 为真时模型的增量输出）、done（汇总）
+    """
+    data = request.get_json() or {}
+    mistake_ids = data.get('mistake_ids', [])
+    refresh = data.get('refresh', False)
+    stream_tokens = data.get('stream_tokens', False)
+    
+    def generate():
+        succeeded = failed = 0
+        try:
+            rows, pending = load_for_analysis(mistake_ids, refresh)
+            contents = {row.id: row.content for row in pending}
+            yield sse_event('start', {'total': len(rows), 'pending': len(pending)})
+            
+            # 已经有分析结果的直接推送
+            for row in rows:
+                if row.id not in contents:
+                    succeeded += 1
+                    yield sse_event('result', {'id': row.id, 'tags': json.loads(row.tags), 'analysis': row.analysis})
+            
+            for event, mistake_id, result in analysis_engine.iter_events(
+                    list(contents.items()), refresh=refresh, stream_tokens=stream_tokens,
+                    heartbeat=app.config['ANALYZE_STREAM_HEARTBEAT']):
+                if event == 'heartbeat':
+                    yield ': keep-alive\n\n'
+                elif event == 'token':
+                    yield sse_event('token', {'id': mistake_id, 'delta': result})
+                elif event == 'error':
+                    failed += 1
+                    yield sse_event('error', {'id': mistake_id, 'detail': result})
+                else:
+                    # 每道题单独提交，连接中途断开时已完成的结果不会丢
+                    names_by_id = save_analysis({mistake_id: result}, contents)
+                    db.session.commit()
+                    succeeded += 1
+                    yield sse_event('result', {'id': mistake_id, 'tags': names_by_id[mistake_id],
+                                               'analysis': result['analysis']})
+            # 提交分析引擎最后写入的缓存
+            db.session.commit()
+            yield sse_event('done', {'succeeded': succeeded, 'failed': failed})
+        except Exception as e:
+            db.session.rollback()
+            print(f"流式分析错误: {str(e)}")
+            yield sse_event('error', {'detail': str(e)})
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 让 nginx 不缓冲，事件立即发给浏览器
+    return response
+
 @app.route('/api/mistakes', methods=['POST'])
 def create_mistake():
     try:
@@ -302,6 +853,7 @@ def create_mistake():
             return jsonify({'error': '内容不能为空'}), 400
             
         # 保存到数据库
+        duplicates = find_duplicates([content])[0]
         mistake = Mistake(content=content)
         db.session.add(mistake)
         db.session.commit()
@@ -309,9 +861,12 @@ def create_mistake():
         return jsonify({
             'success': True,
             'id': mistake.id,
-            'message': '保存成功'
+            'message': '保存成功',
+            'duplicates': duplicates  # 内容几乎相同的已有错题，只提示，不阻止保存
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"创建错题失败: {str(e)}")  # 添加日志
         return jsonify({
@@ -340,6 +895,9 @@ def batch_delete_mistakes():
             return jsonify({'error': '没有选择要删除的错题'}), 400
             
         # 批量删除
+        remove_from_tag_index(mistake_ids)
+        mistake_search.remove(mistake_ids)
+        mistake_index.remove(mistake_ids)
         Mistake.query.filter(Mistake.id.in_(mistake_ids)).delete(synchronize_session=False)
         db.session.commit()
         
@@ -348,6 +906,8 @@ def batch_delete_mistakes():
             'message': f'成功删除 {len(mistake_ids)} 条记录'
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"批量删除失败: {str(e)}")
         return jsonify({
@@ -355,6 +915,51 @@ def batch_delete_mistakes():
             'detail': str(e)
         }), 500
 
+@app.route('/api/mistakes/dump', methods=['GET'])
+def dump_mistakes():
+    """流式导出全部错题，NDJSON 格式（每行一道错题）"""
+    response = Response(stream_with_context(mistake_transfer.dump(app.config['BULK_BATCH_SIZE'])),
+                        mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename=mistakes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.ndjson'
+    return response
+
+@app.route('/api/mistakes/load', methods=['POST'])
+def load_mistakes():
+    """从请求体按行读取 NDJSON 导入错题；keep_ids=1 时沿用文件里的 id（恢复备份）"""
+    keep_ids = request.args.get('keep_ids', '').lower() in ('1', 'true', 'yes')
+    try:
+        loaded = mistake_transfer.load(request.stream, app.config['BULK_BATCH_SIZE'], keep_ids=keep_ids)
+    except LoadError as e:
+        print(f"导入错题失败: {str(e)}")
+        return jsonify({
+            'error': '导入失败',
+            'detail': str(e),
+            'line': e.line,
+            'loaded': e.loaded  # 出错前已经提交的行数
+        }), 400
+    return jsonify({
+        'success': True,
+        'loaded': loaded,
+        'message': f'成功导入 {loaded} 道错题'
+    })
+
+def iter_export_chunks(mistake_ids):
+    """按 EXPORT_CHUNK_SIZE 分块加载要导出的错题，产出 (错题列表, 标签列表)"""
+    ids = sorted({int(mistake_id) for mistake_id in mistake_ids})
+    chunk_size = app.config['EXPORT_CHUNK_SIZE']
+    for start in range(0, len(ids), chunk_size):
+        mistakes = Mistake.query.filter(Mistake.id.in_(ids[start:start + chunk_size])) \
+            .order_by(Mistake.id).all()
+        yield mistakes, [json.loads(m.tags) if m.tags else [] for m in mistakes]
+        # 渲染完的块从会话中移除，内存占用不随导出数量增长
+        for m in mistakes:
+            db.session.expunge(m)
+
+def export_pdf(mistake_ids, export_type, output_path):
+    """把指定的错题渲染成 PDF 写入 output_path"""
+    pdf_exporter.export(iter_export_chunks(mistake_ids), export_type, output_path,
+                        export_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
 @app.route('/api/mistakes/export', methods=['POST'])
 def export_mistakes():
     try:
@@ -365,72 +970,23 @@ def export_mistakes():
         if not mistake_ids:
             return jsonify({'error': '没有选择要导出的错题'}), 400
             
-        mistakes = Mistake.query.filter(Mistake.id.in_(mistake_ids)).all()
-        
-        # 准备 HTML 模板
-        html_template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                body { font-family: Arial, sans-serif; }
-                .mistake { margin-bottom: 30px; page-break-inside: avoid; }
-                .content { white-space: pre-wrap; margin: 10px 0; }
-                .analysis { margin-top: 10px; background: #f5f5f5; padding: 10px; }
-                .tags { margin-top: 10px; }
-                .tag { display: inline-block; margin: 2px; padding: 2px 8px; background: #eee; border-radius: 12px; }
-            </style>
-        </head>
-        <body>
-            <h1>错题集</h1>
-            <p>导出时间：{{ export_time }}</p>
-            {% for mistake in mistakes %}
-            <div class="mistake">
-                <h3>错题 {{ loop.index }}</h3>
-                <div class="content">{{ mistake.content }}</div>
-                {% if export_type == 'full' and mistake.analysis %}
-                <div class="analysis">
-                    <h4>分析结果：</h4>
-                    <div>{{ mistake.analysis }}</div>
-                    {% if mistake.tags %}
-                    <div class="tags">
-                        <h4>知识点标签：</h4>
-                        {% for tag in tags[loop.index0] %}
-                        <span class="tag">{{ tag }}</span>
-                        {% endfor %}
-                    </div>
-                    {% endif %}
-                </div>
-                {% endif %}
-            </div>
-            {% endfor %}
-        </body>
-        </html>
-        """
-        
-        # 准备模板数据
-        template_data = {
-            'mistakes': mistakes,
-            'export_type': export_type,
-            'export_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'tags': [json.loads(m.tags) if m.tags else [] for m in mistakes]
-        }
-        
-        # 渲染 HTML
-        template = Template(html_template)
-        html_content = template.render(**template_data)
-        
-        # 生成 PDF
-        pdf = pdfkit.from_string(html_content, False)
+        fd, output = tempfile.mkstemp(suffix='.pdf', dir=app.config['EXPORT_FOLDER'])
+        os.close(fd)
+        try:
+            export_pdf(mistake_ids, export_type, output)
+        except Exception:
+            os.remove(output)
+            raise
         
-        # 准备响应
-        response = make_response(pdf)
-        response.headers['Content-Type'] = 'application/pdf'
+        # 流式返回，发送完成后删除临时文件
+        response = Response(stream_file(output), mimetype='application/pdf', direct_passthrough=True)
+        response.headers['Content-Length'] = str(os.path.getsize(output))
         response.headers['Content-Disposition'] = f'attachment; filename=mistakes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
         
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"导出错误: {str(e)}")
         return jsonify({
@@ -438,6 +994,173 @@ def export_mistakes():
             'detail': str(e)
         }), 500
 
+def negotiate_image_format(accept=None):
+    """根据 Accept 头选择返回的图片格式，没有明确偏好时使用 IMAGE_OUTPUT_FORMAT"""
+    default = app.config['IMAGE_OUTPUT_FORMAT']
+    offers = [FORMATS[default][1]] + [mimetype for name, (_, mimetype) in FORMATS.items() if name != default]
+    best = parse_accept_header(accept, MIMEAccept).best_match(offers) if accept else None
+    return next((name for name, (_, mimetype) in FORMATS.items() if mimetype == best), default)
+
+def ocr_page(image, report):
+    """预处理图片、识别文字并擦除手写区域，返回 (擦除后的图片数组, OCR 结果)"""
+    # 图片计算在 gevent 下交给原生线程，不阻塞其他请求
+    img, ocr_image, ocr_pixels = run_blocking(image_pipeline.prepare, image, report)
+    
+    with report.stage('ocr'):
+        result = ocr_cache.get_or_recognize(ocr_image, OCR_OPTIONS, ocr_client.accurate, pixels=ocr_pixels)
+    
+    if 'error_code' in result:
+        print(f"百度 OCR 返回错误: {result}", flush=True)
+        raise Exception(result.get('error_msg', '识别失败'))
+        
+    # 擦除手写区域（低置信度文字和/或蓝、红色笔迹）
+    try:
+        with report.stage('mask'):
+            img, erased = run_blocking(
+                remove_handwriting, img, result['words_result'],
+                mode=app.config['HANDWRITING_MODE'], threshold=app.config['HANDWRITING_CONFIDENCE_THRESHOLD'])
+        print(f"擦除手写区域 {erased} 像素", flush=True)
+    except Exception as e:
+        print(f"图像处理过程出错: {str(e)}", flush=True)
+        raise
+    return img, result
+
+def recognize_image(image, image_format=None, report=None):
+    """预处理图片、识别文字并擦除手写区域，返回 (识别文本, 图片字节, MIME 类型)
+
+    report 为 PipelineReport 时记录各阶段耗时和字节数
+    """
+    report = report or PipelineReport()
+    img, result = ocr_page(image, report)
+    
+    data, mimetype = run_blocking(image_pipeline.encode, img, image_format or app.config['IMAGE_OUTPUT_FORMAT'], report)
+    for stage, ms in report.timings:
+        observe_stage(stage, ms / 1000)
+    print(f"识别 {len(result['words_result'])} 行文字；图片处理耗时: {report.server_timing()}; "
+          f"字节数: {report.byte_summary()}", flush=True)
+    text = '\n'.join(word_info['words'] for word_info in result['words_result'])
+    return text, data, mimetype
+
+def segment_page(image):
+    """识别一页图片并按题目拆分，每道题的区域图片按内容哈希保存，返回 ([题目], PipelineReport)"""
+    report = PipelineReport()
+    img, result = ocr_page(image, report)
+    with report.stage('segment'):
+        regions = run_blocking(segment_questions, img, result['words_result'],
+                               gap_factor=app.config['SEGMENT_GAP_FACTOR'])
+    with report.stage('crop'):
+        for region in regions:
+            x0, y0, x1, y1 = region['box']
+            data, _ = run_blocking(image_pipeline.encode, img[y0:y1, x0:x1],
+                                   app.config['IMAGE_OUTPUT_FORMAT'], PipelineReport())
+            region['image_path'] = save_upload(data)
+    for stage, ms in report.timings:
+        observe_stage(stage, ms / 1000)
+    print(f"拆分出 {len(regions)} 道题目；图片处理耗时: {report.server_timing()}", flush=True)
+    return regions, report
+
+def wants_save():
+    """请求要求保存图片（表单字段 save=1）"""
+    return request.form.get('save', '').lower() in ('1', 'true', 'yes')
+
+def image_response(data, mimetype, report, save=False):
+    """返回处理后的图片，ETag 为内容哈希；save 为真时按内容哈希保存，X-Image-Url 是可以长期缓存的地址
+
+    只预览不保存时不写盘
+    """
+    response = send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=False)
+    if save:
+        path = save_upload(data)
+        response.headers['X-Image-Url'] = image_url(path)
+    response.set_etag(hashlib.sha256(data).hexdigest())
+    response.headers['Server-Timing'] = report.server_timing()
+    response.headers['X-Image-Bytes'] = report.byte_summary()
+    return response
+
+@app.route('/images/<name>', methods=['GET'])
+def get_image(name):
+    """按内容哈希寻址的图片（保存的原图和处理后的图片、拆题的区域图片），内容不会变化，浏览器和 CDN 可以一直缓存"""
+    if not IMAGE_NAME.fullmatch(name):
+        return jsonify({'error': '图片不存在'}), 404
+    path = os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], name[:2], name))
+    if not os.path.exists(path):
+        return jsonify({'error': '图片不存在'}), 404
+    # 文件名就是内容哈希，直接用作 ETag；带 If-None-Match 的请求返回 304
+    response = send_file(path, etag=name.split('.')[0], max_age=app.config['IMAGE_CACHE_MAX_AGE'])
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/ocr-cache/stats', methods=['GET'])
+def get_ocr_cache_stats():
+    return jsonify(ocr_cache.stats())
+
+@app.route('/api/upstream/stats', methods=['GET'])
+def get_upstream_stats():
+    """对外调用的请求、重试、失败次数和熔断状态"""
+    return jsonify([ocr_http.stats(), deepseek_http.stats()])
+
+def _try_segment(image):
+    try:
+        regions, report = segment_page(image)
+        return regions, report, None
+    except Exception as e:
+        print(f"拆题失败: {str(e)}", flush=True)
+        return None, None, str(e)
+
+@app.route('/api/mistakes/segment', methods=['POST'])
+def segment_mistakes():
+    """上传一张或多张整页图片（字段名 image，可重复），按题目拆分后批量保存为错题
+
+    各页并发识别，全部完成后在一个事务里插入；某一页失败不影响其他页，失败的页在 errors 里返回
+    """
+    files = [f for f in request.files.getlist('image') if f.filename]
+    if not files:
+        return jsonify({'error': '没有上传文件'}), 400
+    if len(files) > app.config['SEGMENT_MAX_PAGES']:
+        return jsonify({'error': f"一次最多上传 {app.config['SEGMENT_MAX_PAGES']} 张图片，"
+                                 f"总大小不超过 {app.config['SEGMENT_MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB"}), 400
+    
+    images = [f.read() for f in files]
+    pages = list(segment_executor.map(_try_segment, images))
+    
+    items, errors, reports = [], [], []
+    try:
+        mistakes = []
+        for index, (file, (regions, report, error)) in enumerate(zip(files, pages)):
+            if error:
+                errors.append({'page': index + 1, 'filename': file.filename, 'detail': error})
+                continue
+            reports.append({'page': index + 1, 'filename': file.filename, 'questions': len(regions),
+                            'report': report.to_dict()})
+            for region in regions:
+                mistake = Mistake(content=region['text'], image_path=region['image_path'])
+                mistakes.append(mistake)
+                items.append((index + 1, region, mistake))
+        duplicates = find_duplicates([mistake.content for mistake in mistakes])
+        db.session.add_all(mistakes)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"保存拆分的错题失败: {str(e)}")
+        return jsonify({'error': '保存失败', 'detail': str(e)}), 500
+    
+    return jsonify({
+        'success': bool(items) or not errors,
+        'message': f'从 {len(reports)} 张图片中拆分出 {len(items)} 道题目',
+        'items': [{
+            'id': mistake.id,
+            'page': page,
+            'number': region['number'],
+            'content': mistake.content,
+            'image_path': mistake.image_path,
+            'image_url': image_url(mistake.image_path),
+            'box': region['box'],
+            'duplicates': found
+        } for (page, region, mistake), found in zip(items, duplicates)],
+        'pages': reports,
+        'errors': errors
+    })
+
 @app.route('/api/process-image', methods=['POST'])
 def process_image():
     try:
@@ -445,60 +1168,14 @@ def process_image():
             return jsonify({'error': '没有上传文件'}), 400
             
         file = request.files['image']
-        image = file.read()
-        
-        # 使用高精度文字识别
-        options = {
-            "detect_direction": "true",
-            "probability": "true",       # 返回置信度
-            "vertexes_location": "true"  # 返回文字位置
-        }
+        report = PipelineReport()
+        _, data, mimetype = recognize_image(
+            file.read(), negotiate_image_format(request.headers.get('Accept')), report)
         
-        print("开始调用百度 OCR...", flush=True)
-        print(f"使用的配置: APP_ID={app.config['BAIDU_APP_ID']}", flush=True)
-        result = ocr_client.accurate(image, options)
-        print("OCR 返回结果:", result, flush=True)
-        
-        if 'error_code' in result:
-            print(f"百度 OCR 返回错误: {result}", flush=True)
-            raise Exception(result.get('error_msg', '识别失败'))
-            
-        # 处理识别结果
-        try:
-            img = Image.open(io.BytesIO(image)).convert('RGB')
-            draw = ImageDraw.Draw(img)
-            
-            # 用白色填充低置信度的区域（可能是手写）
-            for word_info in result['words_result']:
-                try:
-                    probability = float(word_info['probability']['average'])
-                    if probability < 0.85:  # 低置信度可能是手写
-                        location = word_info['location']
-                        draw.rectangle([
-                            location['left'], location['top'],
-                            location['left'] + location['width'],
-                            location['top'] + location['height']
-                        ], fill='white')
-                        print(f"移除低置信度文字: {word_info['words']}, 置信度: {probability}", flush=True)
-                except Exception as e:
-                    print(f"处理单个文字区域时出错: {str(e)}", flush=True)
-                    continue
-                    
-        except Exception as e:
-            print(f"图像处理过程出错: {str(e)}", flush=True)
-            raise
-        
-        # 保存到内存
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        
-        return send_file(
-            io.BytesIO(img_byte_arr),
-            mimetype='image/png',
-            as_attachment=False
-        )
+        return image_response(data, mimetype, report, save=wants_save())
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"图像处理错误: {str(e)}", flush=True)
         print(f"错误详情: {traceback.format_exc()}", flush=True)
@@ -508,7 +1185,135 @@ def process_image():
             'traceback': traceback.format_exc()
         }), 500
 
+# 任务输入图片的扩展名来自 sniff_format，不接受其他字符，拼出的路径不会跑到 JOB_FOLDER 之外
+JOB_INPUT_FORMAT = re.compile(r'[a-z0-9]{1,8}')
+
+def job_input_path(job_id, input_format):
+    """OCR 任务的输入图片路径，只由服务端生成的任务 id 和识别出的格式拼成"""
+    if not JOB_INPUT_FORMAT.fullmatch(input_format or ''):
+        raise ValueError(f'不支持的图片格式: {input_format}')
+    return os.path.join(app.config['JOB_FOLDER'], f'{job_id}.input.{input_format}')
+
+@job_queue.handler('ocr')
+def ocr_job(job_id, payload):
+    image_path = job_input_path(job_id, payload.get('format'))
+    image_format = negotiate_image_format(payload.get('accept'))
+    report = PipelineReport()
+    with open(image_path, 'rb') as f:
+        text, data, mimetype = recognize_image(f.read(), image_format, report)
+    
+    output = os.path.join(app.config['JOB_FOLDER'], f'{job_id}{FORMATS[image_format][0]}')
+    with open(output, 'wb') as f:
+        f.write(data)
+    os.remove(image_path)  # 输入图片只用于在进程间交接，成功后不再需要
+    return {'text': text, 'file': os.path.basename(output), 'mimetype': mimetype, 'report': report.to_dict()}
+
+@job_queue.handler('analyze')
+def analyze_job(job_id, payload):
+    results, errors = analyze_mistake_ids(payload.get('mistake_ids', []), payload.get('refresh', False))
+    return {'results': results, 'errors': errors}
+
+@job_queue.handler('export')
+def export_job(job_id, payload):
+    output = os.path.join(app.config['JOB_FOLDER'], f'{job_id}.pdf')
+    export_pdf(payload.get('mistake_ids', []), payload.get('export_type', 'questions'), output)
+    return {
+        'file': os.path.basename(output),
+        'mimetype': 'application/pdf',
+        'filename': f'mistakes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+    }
+
+def job_to_dict(job):
+    result = json.loads(job.result) if job.result else None
+    now = datetime.now()
+    # 排队太久没有被领取，或执行超时（worker 崩溃后也没有其他 worker 接手），前端据此停止轮询并提示
+    queued_seconds = (now - job.created_at).total_seconds() if job.status == 'pending' else None
+    stale = (queued_seconds is not None and queued_seconds > app.config['JOB_STALE_AFTER']) or \
+        (job.status == 'running' and (now - job.updated_at).total_seconds() > app.config['JOB_TIMEOUT'])
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'queued_seconds': queued_seconds and round(queued_seconds, 1),
+        'stale': stale,
+        'result': result,
+        'result_url': f'/api/jobs/{job.id}/result' if result and 'file' in result else None,
+        'error': job.error,
+        'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'updated_at': job.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    try:
+        job_id = uuid.uuid4().hex
+        
+        # 图片识别任务用表单上传图片，其余任务用 JSON 传参数
+        if request.is_json:
+            data = request.get_json()
+            kind = data.get('kind')
+            payload = data.get('payload', {})
+            # 图片识别任务的输入文件由服务端保存，不能通过 JSON 指定路径
+            if kind == 'ocr':
+                return jsonify({'error': '图片识别任务需要用表单上传图片'}), 400
+        else:
+            kind = request.form.get('kind', 'ocr')
+            if kind != 'ocr':
+                return jsonify({'error': f'表单上传只支持图片识别任务: {kind}'}), 400
+            if 'image' not in request.files:
+                return jsonify({'error': '没有上传文件'}), 400
+            image = request.files['image'].read()
+            # 扩展名按文件内容判断，不使用客户端的文件名
+            input_format = sniff_format(image)
+            with open(job_input_path(job_id, input_format), 'wb') as f:
+                f.write(image)
+            # 任务结果的图片格式按提交任务时的 Accept 协商
+            payload = {'format': input_format, 'accept': request.headers.get('Accept')}
+        
+        if kind not in job_queue.handlers:
+            return jsonify({'error': f'未知的任务类型: {kind}'}), 400
+        
+        job = job_queue.submit(kind, payload, job_id=job_id)
+        return jsonify({
+            'success': True,
+            'id': job.id,
+            'status': job.status
+        }), 202
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"创建任务失败: {str(e)}")
+        return jsonify({
+            'error': '创建任务失败',
+            'detail': str(e)
+        }), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    return jsonify(job_to_dict(job))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = Job.query.get_or_404(job_id)
+    result = json.loads(job.result) if job.result else {}
+    if job.status != 'done' or 'file' not in result:
+        return jsonify({'error': '任务结果不存在', 'status': job.status}), 404
+    
+    return send_file(
+        os.path.abspath(os.path.join(app.config['JOB_FOLDER'], result['file'])),
+        mimetype=result['mimetype'],
+        as_attachment='filename' in result,
+        download_name=result.get('filename')
+    )
+
+# 开发环境下可以在 Web 进程内直接执行后台任务
+if app.config['JOB_INLINE_WORKER']:
+    job_queue.start_inline_worker(app, app.config['JOB_POLL_INTERVAL'])
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        mistake_search.setup()
     app.run(host='0.0.0.0', port=8000, debug=True) 
\ No newline at end of file
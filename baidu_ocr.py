@@ -0,0 +1,83 @@
+"""百度 OCR REST 客户端
+
+直接调用百度的 REST 接口，替代 baidu-aip SDK：SDK 每次请求都用模块级的 requests.post 新建连接，
+也没有重试和限速。这里所有请求走共享的 HttpClient，返回值与 SDK 的 AipOcr.accurate 相同。
+"""
+import base64
+import threading
+import time
+
+from http_client import UpstreamError
+
+# access_token 无效或过期，刷新后重试一次
+TOKEN_ERRORS = {110, 111}
+# QPS 超限：百度用 HTTP 200 + error_code 返回，按可重试处理
+QPS_ERRORS = {18}
+
+
+def _qps_limited(response):
+    # 只在响应开头出现 error_code 时才解析，正常的识别结果不用多解析一次
+    if b'"error_code"' not in response.content[:100]:
+        return False
+    try:
+        return response.json().get('error_code') in QPS_ERRORS
+    except ValueError:
+        return False
+
+
+class BaiduOcrClient:
+    TOKEN_PATH = '/oauth/2.0/token'
+    ACCURATE_PATH = '/rest/2.0/ocr/v1/accurate'
+
+    def __init__(self, api_key, secret_key, http, base_url='https://aip.baidubce.com'):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.http = http
+        self.base_url = base_url.rstrip('/')
+        self._token = None
+        self._token_expires_at = 0
+        self._lock = threading.Lock()
+
+    def access_token(self, refresh=False):
+        """获取 access_token（有效期 30 天），过期前 1 分钟刷新"""
+        with self._lock:
+            if not refresh and self._token and time.time() < self._token_expires_at - 60:
+                return self._token
+            response = self.http.post(self.base_url + self.TOKEN_PATH, params={
+                'grant_type': 'client_credentials',
+                'client_id': self.api_key,
+                'client_secret': self.secret_key
+            }, idempotent=True)
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+            if 'access_token' not in data:
+                raise UpstreamError(f"获取百度 access_token 失败: {data.get('error_description') or response.status_code}")
+            self._token = data['access_token']
+            self._token_expires_at = time.time() + int(data.get('expires_in', 0))
+            return self._token
+
+    def accurate(self, image, options=None):
+        """通用文字识别（高精度含位置版），image 为图片字节"""
+        data = dict(options or {})
+        data['image'] = base64.b64encode(image).decode()
+        result = None
+        for refresh in (False, True):
+            response = self.http.post(
+                self.base_url + self.ACCURATE_PATH,
+                params={'access_token': self.access_token(refresh)},
+                data=data,
+                retry_if=_qps_limited,
+                idempotent=True  # 识别接口只读，超时后重试不会产生副作用
+            )
+            if response.status_code >= 400:
+                # 与 SDK 一样用 error_code 表示失败，调用方只需要检查这一个字段
+                return {'error_code': f'HTTP{response.status_code}', 'error_msg': response.text[:200]}
+            try:
+                result = response.json()
+            except ValueError:
+                return {'error_code': 'INVALID_RESPONSE', 'error_msg': response.text[:200]}
+            if result.get('error_code') not in TOKEN_ERRORS:
+                return result
+        return result
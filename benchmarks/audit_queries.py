@@ -0,0 +1,194 @@
+"""检查每个接口的数据库查询数和提交数
+
+用 loadtest 的方式启动应用（QUERY_STATS_HEADERS=1，响应头带 X-Query-Count / X-Commit-Count），
+每个接口分别用少量和大量数据（默认 5 和 40：列表的 limit、分析和删除的题数，整页拆题的页数按 1/10 计）各请求一次：
+- 查询数随数据量增长：有 N+1 查询
+- 查询数超过 BUDGETS 里的上限，或一个请求提交了不止一次
+出现以上情况时以非零状态退出。接口改动后查询数合理变化时同步修改 BUDGETS。
+
+流式接口（SSE 分析、NDJSON 导出）的查询发生在响应头发出之后，不在这里检查；导出 PDF 需要 wkhtmltopdf，也不检查。
+
+用法：python -m benchmarks.audit_queries
+"""
+import argparse
+import random
+import sys
+
+import requests
+
+from benchmarks.bench_imaging import synthetic_worksheet
+from benchmarks.loadtest import app_server
+
+# 接口 -> (查询数上限, 提交数上限)。按 SQLite 计：写错题时多一两条同步 FTS 表的语句，MySQL 上更少。
+# 读接口都先查一次数据版本号（条件请求），写接口提交前更新一次版本号；新建错题时先清理同 id 的旧向量行
+BUDGETS = {
+    'tags': (2, 0),
+    'tag_stats': (3, 0),
+    'list': (2, 0),
+    'list_with_total': (3, 0),  # with_total=1 时第一页多一条统计总数的查询
+    'list_not_modified': (1, 0),  # 带 If-None-Match 且数据没有变化：只查版本号，返回 304
+    'list_by_tag': (2, 0),
+    'list_next_page': (2, 0),
+    'search': (4, 0),
+    'get': (2, 0),
+    'similar': (4, 0),
+    'update': (7, 1),
+    'create': (7, 1),  # 有疑似重复题时多一条读取其内容的查询
+    'create_after_delete': (7, 1),  # 删除最新的题后再新建：SQLite 复用 id，不能和删除标记冲突
+    'upload_text': (6, 1),
+    'analyze': (15, 1),
+    'analyze_cached': (1, 1),
+    'batch_delete': (10, 1),
+    'delete': (11, 1),
+    'segment': (6, 1),  # 不含每道题的 INSERT，见 PER_ITEM
+    'job': (1, 1),
+    'job_status': (1, 0),
+}
+
+# 每条新记录一条 INSERT 的接口：自增 id 要逐行取回，并发写入时不能自己分配 id；检查时减去新建的题数
+PER_ITEM = {'segment'}
+LARGE_FIRST = {'segment'}
+
+
+class Checks:
+    def __init__(self, base_url, rows, images):
+        self.base_url = base_url
+        self.rows = rows
+        self.images = images
+        self.session = requests.Session()
+        self.next_delete = rows  # 删除从最大的 id 往前取，不影响其他检查用到的错题
+        self.next_analyze = 1
+        self.next_image = 0  # 每次拆题用没上传过的图片，两次请求查重的结果相同
+
+    def _take(self, n):
+        ids = list(range(self.next_delete - n + 1, self.next_delete + 1))
+        self.next_delete -= n
+        return ids
+
+    def tags(self, n):
+        return self.session.get(self.base_url + '/api/tags')
+
+    def tag_stats(self, n):
+        return self.session.get(self.base_url + '/api/stats/tags', params={'limit': n})
+
+    def list(self, n):
+        return self.session.get(self.base_url + '/api/mistakes', params={'limit': n})
+
+    def list_with_total(self, n):
+        return self.session.get(self.base_url + '/api/mistakes', params={'limit': n, 'with_total': 1})
+
+    def list_not_modified(self, n):
+        etag = self.session.get(self.base_url + '/api/mistakes', params={'limit': n}).headers['ETag']
+        response = self.session.get(self.base_url + '/api/mistakes', params={'limit': n},
+                                    headers={'If-None-Match': etag})
+        if response.status_code != 304:
+            response.status_code = 500  # 按错误报告
+        return response
+
+    def list_by_tag(self, n):
+        return self.session.get(self.base_url + '/api/mistakes', params={'limit': n, 'tag': '函数'})
+
+    def list_next_page(self, n):
+        first = self.session.get(self.base_url + '/api/mistakes', params={'limit': 5}).json()
+        return self.session.get(self.base_url + '/api/mistakes',
+                                params={'limit': n, 'cursor': first['next_cursor']})
+
+    def search(self, n):
+        return self.session.get(self.base_url + '/api/mistakes/search', params={'q': '函数', 'limit': n})
+
+    def get(self, n):
+        return self.session.get(f'{self.base_url}/api/mistakes/{n}')
+
+    def similar(self, n):
+        return self.session.get(f'{self.base_url}/api/mistakes/{n}/similar', params={'limit': n})
+
+    def update(self, n):
+        return self.session.put(f'{self.base_url}/api/mistakes/{n}', json={'content': f'修改后的题目 {n}'})
+
+    def create(self, n):
+        return self.session.post(self.base_url + '/api/mistakes', json={'content': f'新题目 {n}'})
+
+    def create_after_delete(self, n):
+        response = self.create(n)
+        if response.status_code >= 400:
+            return response
+        self.session.delete(f"{self.base_url}/api/mistakes/{response.json()['id']}")
+        return self.create(n)
+
+    def upload_text(self, n):
+        return self.session.post(self.base_url + '/api/upload', json={'text': f'识别的题目 {n}'})
+
+    def analyze(self, n):
+        # 两次分析不同的题，都要写入新的标签
+        ids = list(range(self.next_analyze, self.next_analyze + n))
+        self.next_analyze += n
+        return self.session.post(self.base_url + '/api/mistakes/analyze', json={'mistake_ids': ids, 'refresh': True})
+
+    def analyze_cached(self, n):
+        return self.session.post(self.base_url + '/api/mistakes/analyze',
+                                 json={'mistake_ids': list(range(1, n + 1))})
+
+    def batch_delete(self, n):
+        return self.session.post(self.base_url + '/api/mistakes/batch-delete', json={'mistake_ids': self._take(n)})
+
+    def delete(self, n):
+        return self.session.delete(f'{self.base_url}/api/mistakes/{self._take(1)[0]}')
+
+    def segment(self, n):
+        pages = max(n // 10, 1)
+        files = [('image', (f'page{i}.png', self.images[self.next_image + i], 'image/png')) for i in range(pages)]
+        self.next_image += pages
+        return self.session.post(self.base_url + '/api/mistakes/segment', files=files)
+
+    def job(self, n):
+        return self.session.post(self.base_url + '/api/jobs',
+                                 json={'kind': 'analyze', 'payload': {'mistake_ids': list(range(1, n + 1))}})
+
+    def job_status(self, n):
+        job_id = self.job(n).json()['id']
+        return self.session.get(f'{self.base_url}/api/jobs/{job_id}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--small', type=int, default=5)
+    parser.add_argument('--large', type=int, default=40)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    images = [synthetic_worksheet(rng, width=1240, height=1754) for _ in range((args.small + args.large) // 10 + 2)]
+    problems = []
+    print(f"{'接口':<16}{'查询(少)':>10}{'查询(多)':>10}{'提交':>6}{'上限':>8}")
+    with app_server(args.rows, ocr_latency=0, llm_latency=0, workers=1,
+                    extra_env={'QUERY_STATS_HEADERS': '1'}) as suite:
+        checks = Checks(suite.base_url, args.rows, images)
+        for name, (max_queries, max_commits) in BUDGETS.items():
+            counts = {}
+            # 拆题时后一次请求可能查到前一次写入的重复题而多一条查询，先请求大的，避免误判成 N+1
+            for n in ((args.large, args.small) if name in LARGE_FIRST else (args.small, args.large)):
+                response = getattr(checks, name)(n)
+                if response.status_code >= 400:
+                    problems.append(f'{name}: HTTP {response.status_code} {response.text[:200]}')
+                queries = int(response.headers.get('X-Query-Count', -1))
+                if name in PER_ITEM and response.status_code < 400:
+                    queries -= len(response.json()['items'])
+                counts[n] = (queries, int(response.headers.get('X-Commit-Count', -1)))
+            (small, commits_small), (large, commits_large) = counts[args.small], counts[args.large]
+            commits = max(commits_small, commits_large)
+            print(f"{name:<16}{small:>10}{large:>10}{commits:>6}{f'{max_queries}/{max_commits}':>8}")
+            if large > small:
+                problems.append(f'{name}: 查询数随数据量增长 {small} -> {large}')
+            if max(small, large) > max_queries:
+                problems.append(f'{name}: 查询数 {max(small, large)} 超过上限 {max_queries}')
+            if commits > max_commits:
+                problems.append(f'{name}: 提交 {commits} 次，上限 {max_commits}')
+
+    if problems:
+        print('\n' + '\n'.join(problems))
+        sys.exit(1)
+    print('\n全部接口的查询数固定，每个请求最多提交一次')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""分析引擎基准测试：对比逐题串行调用与并发 + 打包调用
+
+用法：python -m benchmarks.bench_analyze --count 50 --latency 0.5
+"""
+import argparse
+import time
+
+from analyzer import AnalysisEngine
+from benchmarks.stubs import StubLLMServer
+
+
+def run(label, server, items, **engine_options):
+    engine = AnalysisEngine(api_url=server.url, api_key='bench', **engine_options)
+    server.request_count = 0
+    start = time.perf_counter()
+    results, errors = engine.analyze(items)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} 题目 {len(results):>4}  失败 {len(errors):>3}  "
+          f"上游请求 {server.request_count:>4}  耗时 {elapsed:7.2f}s  "
+          f"{len(items) / elapsed:7.2f} 题/s  {server.request_count / elapsed:7.2f} 请求/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=50, help='题目数量')
+    parser.add_argument('--latency', type=float, default=0.5, help='桩服务每次请求的延迟（秒）')
+    parser.add_argument('--in-flight', type=int, default=4, help='并发在途请求数')
+    args = parser.parse_args()
+
+    items = [(i, f'已知二次函数 y = x^2 - {i}x + 3，求其顶点坐标。') for i in range(1, args.count + 1)]
+
+    with StubLLMServer(latency=args.latency) as server:
+        # 与改造前的行为一致：一次一题、没有并发
+        run('串行（改造前）', server, items, max_in_flight=1, batch_max_items=1)
+        run(f'并发 x{args.in_flight}', server, items, max_in_flight=args.in_flight, batch_max_items=1)
+        run(f'并发 x{args.in_flight} + 打包', server, items, max_in_flight=args.in_flight)
+
+
+if __name__ == '__main__':
+    main()
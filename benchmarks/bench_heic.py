@@ -0,0 +1,126 @@
+"""HEIC 上传基准测试：对比原来的落盘转换流程和内存解码流程的耗时与内存峰值
+
+原流程：上传文件写盘 → read_heif → Image.frombytes → 另存 JPEG → 重新读取 JPEG → 预处理
+新流程：上传字节直接交给 ImagePipeline，HEIC 在内存里解码一次
+
+两种流程都只测到得到送给 OCR 的图片为止，不含 OCR 调用。每种流程在单独的子进程里运行，
+内存峰值取子进程的 VmHWM（Linux）减去导入完成后的基线。
+
+用法：python -m benchmarks.bench_heic --image IMG_0001.HEIC --repeat 5
+      （不指定 --image 时生成一张 4032x3024 的合成作业照片）
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def legacy_path(data, workdir, pipeline, report):
+    """原来 upload_image 里的实现：落盘、转换、再读回"""
+    from PIL import Image
+    import pillow_heif
+
+    filename = os.path.join(workdir, 'upload.heic')
+    with open(filename, 'wb') as f:
+        f.write(data)
+    heif_file = pillow_heif.read_heif(filename)
+    image = Image.frombytes(heif_file.mode, heif_file.size, heif_file.data, 'raw')
+    jpeg_filename = filename.rsplit('.', 1)[0] + '.jpg'
+    image.save(jpeg_filename, 'JPEG')
+    with open(jpeg_filename, 'rb') as f:
+        return pipeline.prepare(f.read(), report)
+
+
+def memory_path(data, workdir, pipeline, report):
+    return pipeline.prepare(data, report)
+
+
+def peak_rss_kb():
+    """进程的内存峰值；ru_maxrss 在 Linux 上会从父进程继承，优先读 /proc 里的 VmHWM"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(path_name, image_path, repeat):
+    """子进程入口：运行指定流程，输出 JSON 结果"""
+    from imaging import ImagePipeline, PipelineReport
+
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    pipeline = ImagePipeline()
+    run = {'legacy': legacy_path, 'memory': memory_path}[path_name]
+    workdir = tempfile.mkdtemp()
+    baseline = peak_rss_kb()
+    timings = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(data, workdir, pipeline, PipelineReport())
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        shutil.rmtree(workdir)
+    peak = peak_rss_kb()
+    print(json.dumps({'timings': timings, 'peak_kb': peak - baseline}))
+
+
+def make_sample(path):
+    """生成 4032x3024（iPhone 原图尺寸）的合成作业照片并编码成 HEIC"""
+    import cv2
+    import numpy as np
+    import pillow_heif
+
+    rng = random.Random(42)
+    img = np.full((3024, 4032, 3), 235, np.uint8)
+    for top in range(120, 3000, 80):
+        cv2.putText(img, 'Solve x^2 - %d x + %d = 0' % (rng.randint(1, 9), rng.randint(1, 20)),
+                    (100, top), cv2.FONT_HERSHEY_SIMPLEX, 2, (20, 20, 20), 4)
+    noise = np.random.default_rng(42).normal(0, 4, img.shape)  # 模拟相机噪点
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+    heif = pillow_heif.from_bytes('RGB', (4032, 3024), cv2.cvtColor(img, cv2.COLOR_BGR2RGB).tobytes())
+    heif.save(path, quality=85)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image', help='HEIC 图片路径')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', choices=['legacy', 'memory'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.image, args.repeat)
+        return
+
+    image_path = args.image
+    if not image_path:
+        image_path = os.path.join(tempfile.mkdtemp(), 'sample.heic')
+        make_sample(image_path)
+    print(f"图片 {image_path}（{os.path.getsize(image_path)} 字节），每种流程运行 {args.repeat} 次")
+
+    print(f"{'流程':<10}{'p50(ms)':>10}{'max(ms)':>10}{'内存峰值(MB)':>16}")
+    for path_name in ('legacy', 'memory'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_heic', '--child', path_name,
+             '--image', image_path, '--repeat', str(args.repeat)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{path_name:<10}{statistics.median(result['timings']):>10.1f}{max(result['timings']):>10.1f}"
+              f"{result['peak_kb'] / 1024:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
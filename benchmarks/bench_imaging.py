@@ -0,0 +1,171 @@
+"""图片处理基准测试
+
+- 手写擦除：对比逐个矩形绘制（原实现）和 imaging 模块的向量化掩码
+- 预处理流水线：每个阶段的耗时，以及原图、送给 OCR、返回给前端的字节数
+
+--corpus 指向一个样例作业图片目录；同名的 .json 文件（百度 OCR 的返回结果）会作为 words_result 使用，
+没有的话按网格生成模拟的文字框。不指定 --corpus 时生成带黑色印刷体和蓝色笔迹的合成图片。
+
+用法：python -m benchmarks.bench_imaging --corpus samples/ --repeat 20
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw
+
+from imaging import STAGES, ImagePipeline, PipelineReport, decode_image, encode_image, remove_handwriting
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def fake_words_result(width, height, rng, line_height=40, box_width=160):
+    """按行列网格生成文字框，约三分之一的置信度低于 0.85"""
+    words = []
+    for top in range(10, height - line_height, line_height):
+        for left in range(10, width - box_width, box_width + 10):
+            words.append({
+                'words': '模拟',
+                'location': {'left': left, 'top': top, 'width': box_width, 'height': line_height - 8},
+                'probability': {'average': rng.uniform(0.6, 1.0)}
+            })
+    return words
+
+
+def synthetic_worksheet(rng, width=1654, height=2339):
+    """A4 150dpi 大小的白底图片：黑色印刷文字 + 蓝色手写笔画"""
+    img = np.full((height, width, 3), 255, np.uint8)
+    for top in range(60, height - 40, 40):
+        cv2.putText(img, 'Solve x^2 - %d x + %d = 0' % (rng.randint(1, 9), rng.randint(1, 20)),
+                    (40, top), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 0), 2)
+        if rng.random() < 0.4:
+            x = rng.randint(width // 2, width - 260)
+            points = np.array([(x + i * 12, top - rng.randint(0, 20)) for i in range(20)], np.int32)
+            cv2.polylines(img, [points], False, (200, 60, 20), 3)  # BGR 蓝色笔迹
+    return encode_image(img, '.png')
+
+
+def load_corpus(directory, rng):
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        base, ext = os.path.splitext(name)
+        if ext.lower() not in IMAGE_EXTS:
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            data = f.read()
+        sidecar = os.path.join(directory, base + '.json')
+        if os.path.exists(sidecar):
+            with open(sidecar, encoding='utf-8') as f:
+                words = json.load(f)['words_result']
+        else:
+            height, width = decode_image(data).shape[:2]
+            words = fake_words_result(width, height, rng)
+        samples.append((name, data, words))
+    return samples
+
+
+def pil_loop(data, words_result, threshold=0.85):
+    """原来 upload_image / recognize_image 里的实现"""
+    img = Image.open(io.BytesIO(data)).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for word_info in words_result:
+        if float(word_info['probability']['average']) < threshold:
+            location = word_info['location']
+            draw.rectangle([
+                location['left'], location['top'],
+                location['left'] + location['width'],
+                location['top'] + location['height']
+            ], fill='white')
+    output = io.BytesIO()
+    img.save(output, format='PNG')
+    return output.getvalue()
+
+
+def vectorized(data, words_result, mode):
+    img, _ = remove_handwriting(decode_image(data), words_result, mode=mode)
+    return encode_image(img, '.png')
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', help='样例作业图片目录')
+    parser.add_argument('--samples', type=int, default=5, help='不指定 --corpus 时生成的图片数量')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--stages', default=','.join(STAGES), help='预处理阶段，逗号分隔')
+    parser.add_argument('--format', default='jpeg', choices=['jpeg', 'webp', 'png'])
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    if args.corpus:
+        samples = load_corpus(args.corpus, rng)
+    else:
+        samples = []
+        for i in range(args.samples):
+            data = synthetic_worksheet(rng)
+            height, width = decode_image(data).shape[:2]
+            samples.append((f'synthetic-{i}', data, fake_words_result(width, height, rng)))
+    if not samples:
+        parser.error('样例目录中没有图片')
+
+    # 只比较掩码本身，不含 PNG 编码
+    print(f"{'图片':<20}{'文字框':>8}{'PIL 循环(ms)':>14}{'confidence(ms)':>16}{'ink(ms)':>10}{'both(ms)':>10}")
+    for name, data, words in samples:
+        pil = Image.open(io.BytesIO(data)).convert('RGB')
+        img = decode_image(data)
+
+        def draw_loop():
+            draw = ImageDraw.Draw(pil.copy())
+            for word_info in words:
+                if float(word_info['probability']['average']) < 0.85:
+                    location = word_info['location']
+                    draw.rectangle([location['left'], location['top'],
+                                    location['left'] + location['width'],
+                                    location['top'] + location['height']], fill='white')
+
+        row = [timed(draw_loop, args.repeat)]
+        for mode in ('confidence', 'ink', 'both'):
+            row.append(timed(lambda: remove_handwriting(img, words, mode=mode), args.repeat))
+        print(f"{name[:19]:<20}{len(words):>8}{row[0]:>14.2f}{row[1]:>16.2f}{row[2]:>10.2f}{row[3]:>10.2f}")
+
+    # 端到端：解码 + 擦除 + PNG 编码
+    name, data, words = samples[0]
+    print(f"\n端到端（{name}，含解码和 PNG 编码）")
+    print(f"  PIL 循环:   {timed(lambda: pil_loop(data, words), args.repeat):.1f} ms")
+    print(f"  confidence: {timed(lambda: vectorized(data, words, 'confidence'), args.repeat):.1f} ms")
+
+
+    # 预处理流水线：各阶段耗时取中位数
+    pipeline = ImagePipeline(stages=[stage for stage in args.stages.split(',') if stage])
+    print(f"\n预处理流水线（{args.stages or '不处理'}，输出 {args.format}）")
+    for name, data, _ in samples:
+        reports = []
+        for _ in range(args.repeat):
+            report = PipelineReport()
+            img, _, _ = pipeline.prepare(data, report)
+            pipeline.encode(img, args.format, report)
+            reports.append(report)
+        stages = ', '.join(f'{stage}={statistics.median(r.to_dict()["timings"][stage] for r in reports):.1f}ms'
+                           for stage, _ in reports[0].timings)
+        sizes = reports[0].sizes
+        print(f"  {name}: {stages}")
+        print(f"    字节数 {reports[0].byte_summary()}，OCR 上传减少 {1 - sizes['ocr'] / sizes['input']:.0%}，"
+              f"返回减少 {1 - sizes['output'] / sizes['input']:.0%}")
+
+
+if __name__ == '__main__':
+    main()
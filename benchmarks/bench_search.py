@@ -0,0 +1,79 @@
+"""全文检索基准测试：在 N 道错题上测量 /api/mistakes/search 的延迟
+
+默认使用临时 SQLite 数据库（FTS5）；设置 DATABASE_URL 可以指向一个用于测试的 MySQL 库。
+注意：会清空目标库中的 mistake 表。
+
+用法：python -m benchmarks.bench_search --rows 100000 --repeat 50
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+SUBJECTS = ['二次函数', '三角函数', '一元二次方程', '等差数列', '等比数列', '平面向量', '立体几何',
+            '概率统计', '导数', '不等式', '圆锥曲线', '复数', '对数函数', '指数函数', '集合']
+TEMPLATES = [
+    '已知{s}的相关条件，其中参数 a={a}，求其最小值并说明理由。',
+    '下列关于{s}的说法中，正确的是（ ）A. 第{a}项 B. 单调递增 C. 有界 D. 以上都不对',
+    '在{s}中，若 x={a}，试判断其性质，并写出详细的推导过程。',
+    '某同学在学习{s}时遇到如下问题：当 n={a} 时，结果是多少？'
+]
+QUERIES = ['二次函数', '函数', '最小值', '等比数列 性质', '推导过程', '圆锥曲线 参数', '求']
+
+
+def seed(db, Mistake, mistake_search, rows, batch_size=5000):
+    db.session.execute(Mistake.__table__.delete())
+    rng = random.Random(42)
+    for start in range(0, rows, batch_size):
+        batch = [{
+            'id': i + 1,
+            'content': rng.choice(TEMPLATES).format(s=rng.choice(SUBJECTS), a=rng.randint(1, 100)),
+            'analysis': f'本题考查{rng.choice(SUBJECTS)}与{rng.choice(SUBJECTS)}的综合运用。'
+        } for i in range(start, min(start + batch_size, rows))]
+        db.session.execute(Mistake.__table__.insert(), batch)
+    db.session.commit()
+    mistake_search.setup()
+    mistake_search.rebuild()
+    db.session.commit()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50, help='每个查询重复的次数')
+    args = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        path = os.path.join(tempfile.mkdtemp(), 'bench_search.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+
+    from app import app, db, Mistake, mistake_search
+
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        seed(db, Mistake, mistake_search, args.rows)
+        print(f"写入并索引 {args.rows} 道错题耗时 {time.perf_counter() - start:.1f}s")
+
+    client = app.test_client()
+    print(f"{'查询':<12}{'命中':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'max(ms)':>10}")
+    for q in QUERIES:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            response = client.get('/api/mistakes/search', query_string={'q': q})
+            timings.append((time.perf_counter() - start) * 1000)
+        total = response.get_json()['total']
+        print(f"{q:<12}{total:>8}{statistics.median(timings):>10.1f}"
+              f"{percentile(timings, 0.95):>10.1f}{max(timings):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
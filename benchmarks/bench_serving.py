@@ -0,0 +1,47 @@
+"""对比同步 worker 和 gevent worker 能承载的并发用户数
+
+每种 worker 启动一次应用（同样的 worker 数、桩服务延迟和数据），按 --levels 逐级增加并发用户，
+记录各场景的吞吐、p95 和失败数。等待上游的请求（analyze、upload）在同步 worker 下吞吐封顶在
+worker 数 / 单次耗时，gevent 下随并发用户增加，直到受限于 ANALYZE_MAX_IN_FLIGHT、上游配额、CPU
+（upload 的图片处理）或数据库连接池。
+
+用法：python -m benchmarks.bench_serving --workers 4 --levels 8,32,128 --duration 10
+"""
+import argparse
+
+from benchmarks.loadtest import app_server, run_scenario, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--levels', default='8,32,128', help='并发用户数，逗号分隔')
+    parser.add_argument('--scenarios', default='analyze,upload,list')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--ocr-latency', type=float, default=0.3)
+    parser.add_argument('--llm-latency', type=float, default=1.0)
+    parser.add_argument('--in-flight', type=int, default=16,
+                        help='每个进程同时在途的模型请求数（ANALYZE_MAX_IN_FLIGHT），两种 worker 相同')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(',')]
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    rows = []
+    for worker_class in ('sync', 'gevent'):
+        with app_server(args.rows, args.ocr_latency, args.llm_latency,
+                        workers=args.workers, worker_class=worker_class,
+                        extra_env={'ANALYZE_MAX_IN_FLIGHT': str(args.in_flight)}) as suite:
+            for name in scenarios:
+                for level in levels:
+                    result = summarize(*run_scenario(getattr(suite, name), level, args.duration))
+                    rows.append((worker_class, name, level, result))
+                    print(f"{worker_class} {name} x{level}: {result['rps']} req/s")
+
+    print(f"\n{'worker':<8}{'场景':<10}{'并发':>6}{'吞吐(req/s)':>14}{'p50(ms)':>10}{'p95(ms)':>10}{'失败':>6}")
+    for worker_class, name, level, r in rows:
+        print(f"{worker_class:<8}{name:<10}{level:>6}{r['rps']:>14.2f}{r['p50']:>10.1f}{r['p95']:>10.1f}{r['errors']:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""相似题检索基准测试：在 N 道错题上测量向量计算、首次同步、查询延迟和重复题召回
+
+题目由 bench_search 的模板生成（同一模板只差学科和数字，比真实题目更难区分）。
+另取 --probes 道题做轻度改动（加空格、全角半角互换、改掉一个字，模拟重新拍照识别）作为重复题，
+检查原题是否排在第一位、相似度是否超过 DUPLICATE_THRESHOLD。
+
+默认使用临时 SQLite 数据库；设置 DATABASE_URL 可以指向一个用于测试的 MySQL 库（会清空其中的数据）。
+
+用法：python -m benchmarks.bench_similarity --rows 100000 --repeat 200
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.loadtest import seed_lines
+
+
+def perturb(text, rng):
+    chars = list(text.replace('，', ', ').replace('：', ': '))
+    position = rng.randrange(len(chars))
+    chars[position] = rng.choice('的了是在有')
+    return ' '.join([''.join(chars[:len(chars) // 2]), ''.join(chars[len(chars) // 2:])])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=200, help='查询次数')
+    parser.add_argument('--probes', type=int, default=200, help='检查召回的重复题数')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cuotiji-similarity-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    from app import app, db, mistake_index, mistake_search, mistake_transfer, Mistake, MistakeEmbedding
+    from similarity import SimilarityIndex, embed
+
+    rng = random.Random(7)
+    with app.app_context():
+        mistake_search.drop()
+        db.drop_all()
+        db.create_all()
+        mistake_search.setup()
+        start = time.perf_counter()
+        mistake_transfer.load(seed_lines(args.rows, random.Random(42)))
+        print(f"导入 {args.rows} 道错题（含全文索引和向量），耗时 {time.perf_counter() - start:.1f} 秒")
+
+        contents = dict(db.session.query(Mistake.id, Mistake.content))
+        sample = rng.sample(list(contents.values()), 2000)
+        start = time.perf_counter()
+        for text in sample:
+            embed(text, mistake_index.dim)
+        print(f"向量计算：每道题 {(time.perf_counter() - start) / len(sample) * 1e6:.0f} 微秒")
+
+        # 新进程第一次查询时的全量同步
+        index = SimilarityIndex(db, Mistake, MistakeEmbedding, dim=mistake_index.dim)
+        start = time.perf_counter()
+        index.refresh()
+        matrix_mb = index._matrix.nbytes / 1024 / 1024
+        print(f"首次同步 {index._count} 个向量：{time.perf_counter() - start:.2f} 秒，矩阵占用 {matrix_mb:.0f} MB")
+
+        timings = []
+        ids = list(contents)
+        for _ in range(args.repeat):
+            mistake_id = rng.choice(ids)
+            start = time.perf_counter()
+            index.similar_to(mistake_id, contents[mistake_id], limit=10)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print(f"相似题查询（含增量同步）：p50 {statistics.median(timings):.1f} ms，"
+              f"p95 {timings[int(len(timings) * 0.95)]:.1f} ms")
+
+        threshold = app.config['DUPLICATE_THRESHOLD']
+        probes = rng.sample(ids, args.probes)
+        texts = [perturb(contents[i], rng) for i in probes]
+        # 新建和整页拆题时的查重：按阈值过滤，一次批量查询
+        start = time.perf_counter()
+        flagged_hits = index.similar_to_texts(texts, limit=3, min_score=threshold)
+        elapsed = (time.perf_counter() - start) * 1000
+        hits = index.similar_to_texts(texts, limit=5)
+        # 模板生成的题目有完全相同的副本，只要排第一的内容与原题相同就算命中
+        top1 = sum(1 for i, found in zip(probes, hits) if found and contents[found[0][0]] == contents[i])
+        flagged = sum(1 for i, found in zip(probes, flagged_hits) if any(contents[j] == contents[i] for j, _ in found))
+        print(f"重复题 {args.probes} 道：原题排第一 {top1 / args.probes:.0%}，相似度超过 {threshold} 被提示 "
+              f"{flagged / args.probes:.0%}，批量查重耗时 {elapsed:.0f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""对外调用基准测试：用本地桩服务模拟百度 OCR 抖动、限流和故障，对比有无重试/限速/熔断时的表现
+
+场景：
+- flaky：上游按 --error-rate 随机返回 503，并且有 QPS 配额（超出返回 error_code 18）
+- outage：上游完全不可用，观察熔断后请求是否快速失败，而不是每个都耗尽重试
+
+用法：python -m benchmarks.bench_upstream --requests 200 --concurrency 8
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from baidu_ocr import BaiduOcrClient
+from benchmarks.stubs import StubOcrServer
+from http_client import HttpClient
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def run(client, requests, concurrency):
+    def call(_):
+        start = time.perf_counter()
+        try:
+            ok = 'error_code' not in client.accurate(b'stub image', {'probability': 'true'})
+        except Exception:
+            ok = False
+        return ok, (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, range(requests)))
+    timings = [ms for _, ms in results]
+    return sum(ok for ok, _ in results), timings
+
+
+def report(name, stub, http, requests, ok, timings, elapsed):
+    stats = http.stats()
+    print(f"{name:<22}{ok / requests:>8.1%}{statistics.median(timings):>10.0f}"
+          f"{percentile(timings, 0.95):>10.0f}{percentile(timings, 0.99):>10.0f}"
+          f"{stub.request_count:>8}{stub.qps_rejected:>8}{stats['rejected']:>8}{elapsed:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05, help='桩服务延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.2)
+    parser.add_argument('--quota', type=int, default=20, help='桩服务的 QPS 配额')
+    args = parser.parse_args()
+
+    configs = [
+        ('无重试/不限速', dict(max_retries=0, qps=0)),
+        ('重试', dict(max_retries=3, qps=0)),
+        ('重试 + 限速', dict(max_retries=3, qps=args.quota)),
+    ]
+    print(f"{'场景':<22}{'成功率':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+          f"{'上游请求':>8}{'限流':>8}{'熔断':>8}{'耗时(s)':>8}")
+
+    for name, options in configs:
+        with StubOcrServer(latency=args.latency, qps=args.quota, error_rate=args.error_rate) as stub:
+            # 熔断阈值调高，flaky 场景只比较重试和限速
+            http = HttpClient('baidu-ocr', pool_maxsize=args.concurrency, backoff_base=0.05,
+                              failure_threshold=10 ** 6, **options)
+            client = BaiduOcrClient('key', 'secret', http, base_url=stub.base_url)
+            start = time.perf_counter()
+            ok, timings = run(client, args.requests, args.concurrency)
+            report(f'flaky {name}', stub, http, args.requests, ok, timings, time.perf_counter() - start)
+
+    for name, threshold in (('无熔断', 10 ** 6), ('熔断', 5)):
+        with StubOcrServer(latency=args.latency, error_rate=1.0) as stub:
+            http = HttpClient('baidu-ocr', pool_maxsize=args.concurrency, max_retries=3, backoff_base=0.05,
+                              failure_threshold=threshold, reset_timeout=60)
+            client = BaiduOcrClient('key', 'secret', http, base_url=stub.base_url)
+            client._token, client._token_expires_at = 'stub-token', time.time() + 3600  # 故障前已拿到 token
+            start = time.perf_counter()
+            ok, timings = run(client, args.requests, args.concurrency)
+            report(f'outage {name}', stub, http, args.requests, ok, timings, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""检查对外 HTTP 调用层（http_client.py）的重试、退避、熔断和限速
+
+用本地桩服务逐项验证，任何一项不符合预期时以非零状态退出：
+- 退避：5xx 时按指数退避重试 max_retries 次，总等待时间在带抖动的范围内
+- Retry-After：429 响应带 Retry-After 时按它等待
+- 非幂等请求：POST 读取超时不重试（上游可能已经处理并计费），连接被拒绝时重试；幂等请求读取超时会重试
+- 熔断：连续失败达到阈值后直接拒绝，冷却结束后并发请求里只放行一个试探请求，试探成功后恢复
+- 限速：令牌桶按 QPS 放行，N 个请求的耗时不少于 (N - 桶容量) / QPS
+
+用法：python -m benchmarks.check_upstream
+"""
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stubs import StubLLMServer, StubOcrServer
+from http_client import CircuitOpenError, HttpClient, UpstreamError
+
+
+def timed(func):
+    start = time.perf_counter()
+    try:
+        result = func()
+    except UpstreamError as e:
+        result = e
+    return result, time.perf_counter() - start
+
+
+def check_backoff():
+    with StubOcrServer(latency=0, error_rate=1.0, error_status=503) as stub:
+        http = HttpClient('check', max_retries=3, backoff_base=0.1, backoff_max=10, failure_threshold=100)
+        response, elapsed = timed(lambda: http.post(stub.base_url + '/rest/2.0/ocr/v1/accurate', idempotent=True))
+        # 等待 0.1、0.2、0.4 秒，各乘以 0.5~1 的抖动
+        return [
+            ('503 返回最后一次响应', getattr(response, 'status_code', None) == 503),
+            ('重试 3 次，共请求 4 次', stub.request_count == 4),
+            (f'退避总时长 {elapsed:.2f}s 在 0.35~0.8s 之间', 0.35 <= elapsed <= 0.8),
+        ]
+
+
+def check_retry_after():
+    with StubOcrServer(latency=0, error_rate=1.0, error_status=429, retry_after=1) as stub:
+        http = HttpClient('check', max_retries=1, backoff_base=0.01, failure_threshold=100)
+        # POST 默认非幂等，429 表示上游没有处理，也会重试
+        response, elapsed = timed(lambda: http.post(stub.base_url + '/v1/chat/completions'))
+        return [
+            ('429 非幂等请求也重试', stub.request_count == 2),
+            (f'按 Retry-After 等待 1 秒（实际 {elapsed:.2f}s）', 1.0 <= elapsed <= 1.3),
+        ]
+
+
+def check_read_timeout():
+    checks = []
+    for idempotent, expected in ((None, 1), (True, 3)):
+        with StubLLMServer(latency=0.5) as stub:
+            http = HttpClient('check', timeout=(1, 0.2), max_retries=2, backoff_base=0.01, failure_threshold=100)
+            result, _ = timed(lambda: http.post(stub.url, json={'messages': [{'content': '题目'}]},
+                                                idempotent=idempotent))
+            label = 'POST' if idempotent is None else '幂等请求'
+            checks.append((f'{label}读取超时请求 {expected} 次（实际 {stub.request_count}）',
+                           isinstance(result, UpstreamError) and stub.request_count == expected))
+    return checks
+
+
+def check_connect_refused():
+    # 取一个空闲端口后关闭，连接会被拒绝
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    http = HttpClient('check', timeout=(1, 1), max_retries=2, backoff_base=0.01, failure_threshold=100)
+    result, _ = timed(lambda: http.post(f'http://127.0.0.1:{port}/v1/chat/completions', json={}))
+    return [('POST 连接被拒绝时重试', isinstance(result, UpstreamError) and http.stats()['retries'] == 2)]
+
+
+def check_half_open():
+    with StubOcrServer(latency=0.2, error_rate=1.0) as stub:
+        http = HttpClient('check', max_retries=0, failure_threshold=2, reset_timeout=0.5)
+        url = stub.base_url + '/rest/2.0/ocr/v1/accurate'
+        for _ in range(2):
+            timed(lambda: http.post(url, idempotent=True))
+        opened = http.breaker.state == 'open'
+        result, elapsed = timed(lambda: http.post(url, idempotent=True))
+        rejected = isinstance(result, CircuitOpenError) and stub.request_count == 2 and elapsed < 0.05
+
+        time.sleep(0.55)
+        stub.error_rate = 0.0
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(executor.map(lambda _: timed(lambda: http.post(url, idempotent=True))[0], range(5)))
+        probes = stub.request_count - 2
+        closed = http.breaker.state == 'closed'
+        return [
+            ('连续失败 2 次后熔断', opened),
+            ('熔断中直接拒绝，不请求上游', rejected),
+            (f'冷却后 5 个并发请求只放行 1 个试探（实际 {probes}）',
+             probes == 1 and sum(isinstance(r, CircuitOpenError) for r in results) == 4),
+            ('试探成功后恢复', closed),
+        ]
+
+
+def check_pacing():
+    with StubOcrServer(latency=0) as stub:
+        http = HttpClient('check', qps=10, burst=1, max_retries=0)
+        url = stub.base_url + '/oauth/2.0/token'
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: http.post(url, idempotent=True), range(11)))
+        elapsed = time.perf_counter() - start
+        return [(f'QPS 10 发 11 个请求耗时 {elapsed:.2f}s（应为 1.0~1.3s）', 1.0 <= elapsed <= 1.3)]
+
+
+CHECKS = [check_backoff, check_retry_after, check_read_timeout, check_connect_refused, check_half_open, check_pacing]
+
+
+def main():
+    failed = 0
+    for check in CHECKS:
+        for label, ok in check():
+            print(f"{'通过' if ok else '失败'}  {check.__name__[6:]:<16}{label}")
+            failed += not ok
+    if failed:
+        print(f'\n{failed} 项检查失败')
+        sys.exit(1)
+    print('\n全部检查通过')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""端到端负载测试：用 gunicorn.conf.py 启动应用，本地桩服务代替百度 OCR 和 DeepSeek
+
+- 临时 SQLite 库预先写入 --rows 道错题（带标签和分析结果），设置 DATABASE_URL 可以指向测试用的 MySQL 库，
+  注意会清空其中的数据
+- 桩服务的延迟和错误率可调（--ocr-latency、--llm-latency、--error-rate）；OCR 缓存关闭，每次上传都会调用桩服务
+- 场景：upload（上传图片识别）、list（分页列表）、search（全文检索）、analyze（刷新 5 道题的分析）、
+  export（导出 20 道题的 PDF，需要 wkhtmltopdf），每个场景用 --concurrency 个线程持续请求 --duration 秒
+- 输出吞吐量和 p50/p95/p99 延迟；--save 把结果保存到 benchmarks/baselines/<名称>.json，
+  --compare 与保存的基线对比，吞吐下降或 p95 上升超过 --tolerance 时以非零状态退出
+
+用法：
+  python -m benchmarks.loadtest --rows 10000 --duration 20 --concurrency 16 --save default
+  python -m benchmarks.loadtest --compare default
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import requests
+
+from benchmarks.bench_imaging import synthetic_worksheet
+from benchmarks.bench_search import QUERIES, SUBJECTS, TEMPLATES
+from benchmarks.stubs import StubLLMServer, StubOcrServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(ROOT, 'benchmarks', 'baselines')
+SCENARIOS = ('upload', 'list', 'search', 'analyze', 'export')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def seed_lines(rows, rng):
+    for i in range(rows):
+        subject = rng.choice(SUBJECTS)
+        yield json.dumps({
+            'content': rng.choice(TEMPLATES).format(s=subject, a=rng.randint(1, 100)),
+            'tags': [subject, rng.choice(SUBJECTS)],
+            'analysis': f'本题考查{subject}与{rng.choice(SUBJECTS)}的综合运用。'
+        }, ensure_ascii=False)
+
+
+def seed(env, rows):
+    """在子进程里建表并用批量导入写入错题，和被测的应用使用同一份配置"""
+    script = (
+        'import json, random, sys\n'
+        'from app import app, db, mistake_search, mistake_transfer\n'
+        'from benchmarks.loadtest import seed_lines\n'
+        'with app.app_context():\n'
+        '    mistake_search.drop(); db.drop_all(); db.create_all(); mistake_search.setup()\n'
+        f'    mistake_transfer.load(seed_lines({rows}, random.Random(42)))\n'
+    )
+    subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, check=True)
+
+
+def start_gunicorn(env, port, workdir, extra_args):
+    command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+               '-b', f'127.0.0.1:{port}', '--chdir', workdir, '--pythonpath', ROOT] + extra_args + ['app:app']
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn 启动失败，退出码 {process.returncode}')
+        try:
+            requests.get(base_url + '/api/tags', timeout=5)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('等待 gunicorn 启动超时')
+
+
+@contextmanager
+def app_server(rows, ocr_latency, llm_latency, error_rate=0.0, workers=None, worker_class=None, extra_args=(),
+               extra_env=None):
+    """启动桩服务、写入测试数据并用 gunicorn 启动应用，产出绑定到该实例的 Scenarios，退出时全部清理
+
+    extra_env 里的环境变量会覆盖应用的配置（如 ANALYZE_MAX_IN_FLIGHT）
+    """
+    workdir = tempfile.mkdtemp(prefix='cuotiji-loadtest-')
+    ocr = StubOcrServer(latency=ocr_latency, error_rate=error_rate).start()
+    llm = StubLLMServer(latency=llm_latency, error_rate=error_rate).start()
+    env = dict(os.environ,
+               DATABASE_URL=os.getenv('DATABASE_URL') or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+               BAIDU_OCR_BASE_URL=ocr.base_url, BAIDU_API_KEY='bench', BAIDU_SECRET_KEY='bench',
+               DEEPSEEK_API_URL=llm.url, DEEPSEEK_API_KEY='bench',
+               OCR_CACHE_FOLDER=os.path.join(workdir, 'ocr_cache'), OCR_CACHE_TTL='0',
+               PYTHONPATH=ROOT, **(extra_env or {}))
+    if workers:
+        env['GUNICORN_WORKERS'] = str(workers)
+    if worker_class:
+        env['GUNICORN_WORKER_CLASS'] = worker_class
+
+    process = None
+    try:
+        start = time.perf_counter()
+        seed(env, rows)
+        print(f"写入 {rows} 道错题，耗时 {time.perf_counter() - start:.1f} 秒")
+        process, base_url = start_gunicorn(env, free_port(), workdir, list(extra_args))
+
+        rng = random.Random(42)
+        images = [synthetic_worksheet(rng, width=1240, height=1754) for _ in range(8)]
+        yield Scenarios(base_url, rows, images)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        ocr.stop()
+        llm.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class Scenarios:
+    def __init__(self, base_url, rows, images):
+        self.base_url = base_url
+        self.rows = rows
+        self.images = images
+
+    def upload(self, session, rng):
+        image = rng.choice(self.images)
+        return session.post(self.base_url + '/api/upload', files={'image': ('page.png', image, 'image/png')})
+
+    def list(self, session, rng):
+        params = {'limit': 20, 'fields': 'id,content,tags,created_at'}
+        if rng.random() < 0.3:
+            params['tag'] = rng.choice(SUBJECTS)
+        return session.get(self.base_url + '/api/mistakes', params=params)
+
+    def search(self, session, rng):
+        return session.get(self.base_url + '/api/mistakes/search', params={'q': rng.choice(QUERIES)})
+
+    def analyze(self, session, rng):
+        ids = rng.sample(range(1, self.rows + 1), 5)
+        return session.post(self.base_url + '/api/mistakes/analyze', json={'mistake_ids': ids, 'refresh': True})
+
+    def export(self, session, rng):
+        ids = rng.sample(range(1, self.rows + 1), 20)
+        return session.post(self.base_url + '/api/mistakes/export',
+                            json={'mistake_ids': ids, 'export_type': 'full'})
+
+
+def run_scenario(func, concurrency, duration):
+    """concurrency 个线程各自循环请求 duration 秒，返回 (成功请求的延迟列表, 失败数, 实际耗时)"""
+    timings = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(index)
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = func(session, rng).status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if ok:
+                    timings.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, errors[0], time.perf_counter() - start
+
+
+def summarize(timings, errors, elapsed):
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'rps': round(len(timings) / elapsed, 2),
+        'p50': round(percentile(timings, 0.5), 1),
+        'p95': round(percentile(timings, 0.95), 1),
+        'p99': round(percentile(timings, 0.99), 1)
+    }
+
+
+def print_results(results, baseline=None):
+    print(f"{'场景':<10}{'请求':>8}{'失败':>6}{'吞吐(req/s)':>14}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for name, r in results.items():
+        line = (f"{name:<10}{r['requests']:>8}{r['errors']:>6}{r['rps']:>14.2f}"
+                f"{r['p50']:>10.1f}{r['p95']:>10.1f}{r['p99']:>10.1f}")
+        base = (baseline or {}).get(name)
+        if base and base['rps']:
+            line += f"   吞吐 {r['rps'] / base['rps'] - 1:+.0%}  p95 {r['p95'] / max(base['p95'], 0.1) - 1:+.0%}"
+        print(line)
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if r['rps'] < base['rps'] * (1 - tolerance):
+            found.append(f"{name}: 吞吐 {base['rps']} -> {r['rps']} req/s")
+        if r['p95'] > base['p95'] * (1 + tolerance):
+            found.append(f"{name}: p95 {base['p95']} -> {r['p95']} ms")
+        if r['errors'] > base['errors']:
+            found.append(f"{name}: 失败 {base['errors']} -> {r['errors']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000, help='预先写入的错题数')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='逗号分隔')
+    parser.add_argument('--duration', type=float, default=20, help='每个场景持续的秒数')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发用户数')
+    parser.add_argument('--workers', type=int, help='gunicorn worker 数，默认按 gunicorn.conf.py')
+    parser.add_argument('--worker-class', choices=['sync', 'gevent'], help='默认按 gunicorn.conf.py')
+    parser.add_argument('--gunicorn-args', default='', help='额外的 gunicorn 参数，如 "--threads 4"')
+    parser.add_argument('--ocr-latency', type=float, default=0.3)
+    parser.add_argument('--llm-latency', type=float, default=1.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='桩服务返回 503 的概率')
+    parser.add_argument('--save', metavar='NAME', help='把结果保存为基线')
+    parser.add_argument('--compare', metavar='NAME', help='与保存的基线对比')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='允许的性能下降比例')
+    args = parser.parse_args()
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    if 'export' in scenarios and not shutil.which('wkhtmltopdf'):
+        print('没有安装 wkhtmltopdf，跳过 export 场景')
+        scenarios.remove('export')
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f'{args.compare}.json'), encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    with app_server(args.rows, args.ocr_latency, args.llm_latency, args.error_rate, workers=args.workers,
+                    worker_class=args.worker_class, extra_args=args.gunicorn_args.split()) as suite:
+        results = {}
+        for name in scenarios:
+            timings, errors, elapsed = run_scenario(getattr(suite, name), args.concurrency, args.duration)
+            results[name] = summarize(timings, errors, elapsed)
+            print(f"{name} 完成：{results[name]['rps']} req/s")
+
+    print()
+    print_results(results, baseline)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f'{args.save}.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'machine': {'python': platform.python_version(), 'cpus': os.cpu_count(),
+                            'platform': platform.platform()},
+                # scenarios 记录实际运行的场景（没有 wkhtmltopdf 时不含 export）
+                'options': {**{k: v for k, v in vars(args).items() if k not in ('save', 'compare')},
+                            'scenarios': ','.join(scenarios)},
+                'results': results
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n基线已保存到 benchmarks/baselines/{args.save}.json")
+
+    if baseline is not None:
+        missing = [name for name in results if name not in baseline]
+        if missing:
+            print(f"\n基线里没有这些场景的数据，无法对比：{', '.join(missing)}")
+        found = regressions(results, baseline, args.tolerance)
+        if found:
+            print('\n性能下降超过 {:.0%}：'.format(args.tolerance))
+            for item in found:
+                print(f'  {item}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
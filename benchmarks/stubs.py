@@ -0,0 +1,189 @@
+"""本地桩服务：在不访问外网的情况下模拟上游接口
+
+- latency：每个请求的固定延迟（秒）
+- error_rate：按概率返回 error_status（默认 503），用来模拟上游抖动；设为 1 即完全不可用
+- retry_after：设置后错误响应带 Retry-After 头（秒）
+- handle() 返回字符串列表时按 SSE（text/event-stream，分块传输）逐条发送
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_BATCH_ID_RE = re.compile(r'【题目 id=(\d+)】')
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive
+    stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self._read_body()
+        stub = self.stub
+        with stub._lock:
+            stub.request_count += 1
+            failed = stub._random.random() < stub.error_rate
+        time.sleep(stub.latency)
+        if failed:
+            with stub._lock:
+                stub.error_count += 1
+            headers = {'Retry-After': str(stub.retry_after)} if stub.retry_after is not None else None
+            self._send_json(stub.error_status, {'error': {'message': 'stub error'}}, headers)
+            return
+        status, payload = stub.handle(urlparse(self.path), self.headers, body)
+        if isinstance(payload, list):
+            self._send_events(status, payload)
+        else:
+            self._send_json(status, payload)
+
+    def _send_events(self, status, events):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event in events:
+            data = f'data: {event}\n\n'.encode('utf-8')
+            self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+            self.wfile.flush()
+            time.sleep(self.stub.token_latency)
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class _StubServer:
+    def __init__(self, latency=0.5, error_rate=0.0, error_status=503, retry_after=None, seed=42,
+                 host='127.0.0.1', port=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.token_latency = 0.0  # 流式响应中每条事件之间的间隔（秒）
+        self.request_count = 0
+        self.error_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        handler = type('Handler', (_StubHandler,), {'stub': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        # 客户端读取超时后断开，写响应时的 BrokenPipeError 不打印
+        self.server.handle_error = lambda request, client_address: None
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def handle(self, url, headers, body):
+        raise NotImplementedError
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class StubLLMServer(_StubServer):
+    """模拟 DeepSeek chat/completions 接口，固定延迟后返回合法的分析 JSON
+
+    请求带 stream=true 时把内容切成 chunk_size 个字符一段，按 SSE 逐段返回
+    """
+
+    def __init__(self, latency=0.5, token_latency=0.0, chunk_size=8, **kwargs):
+        super().__init__(latency=latency, **kwargs)
+        self.token_latency = token_latency
+        self.chunk_size = chunk_size
+
+    @property
+    def url(self):
+        return f'{self.base_url}/v1/chat/completions'
+
+    def handle(self, url, headers, body):
+        payload = json.loads(body or b'{}')
+        completion = self.completion(payload['messages'][-1]['content'])
+        if not payload.get('stream'):
+            return 200, completion
+        content = completion['choices'][0]['message']['content']
+        events = [json.dumps({'choices': [{'delta': {'content': content[i:i + self.chunk_size]}}]},
+                             ensure_ascii=False)
+                  for i in range(0, len(content), self.chunk_size)]
+        return 200, events + ['[DONE]']
+
+    @staticmethod
+    def completion(user_content):
+        ids = _BATCH_ID_RE.findall(user_content)
+        if ids:
+            content = {'results': [{'id': int(i), 'tags': ['桩标签'], 'analysis': f'题目 {i} 的分析'}
+                                   for i in ids]}
+        else:
+            content = {'tags': ['桩标签'], 'analysis': '桩分析结果'}
+        return {'choices': [{'message': {'role': 'assistant',
+                                         'content': json.dumps(content, ensure_ascii=False)}}]}
+
+
+class StubOcrServer(_StubServer):
+    """模拟百度 OCR 的 access_token 和高精度含位置版接口
+
+    qps 大于 0 时，超过配额的请求按百度的方式返回 HTTP 200 + error_code 18
+    """
+
+    def __init__(self, latency=0.2, qps=0, lines=20, **kwargs):
+        super().__init__(latency=latency, **kwargs)
+        self.qps = qps
+        self.lines = lines
+        self.qps_rejected = 0
+        self._window = []  # 最近一秒内的请求时间
+
+    def handle(self, url, headers, body):
+        if url.path == '/oauth/2.0/token':
+            return 200, {'access_token': 'stub-token', 'expires_in': 2592000}
+        if url.path != '/rest/2.0/ocr/v1/accurate':
+            return 404, {'error_code': 3, 'error_msg': 'Unsupported openapi method'}
+        if parse_qs(url.query).get('access_token') != ['stub-token']:
+            return 200, {'error_code': 110, 'error_msg': 'Access token invalid or no longer valid'}
+        if self.qps:
+            with self._lock:
+                now = time.monotonic()
+                self._window = [t for t in self._window if now - t < 1]
+                if len(self._window) >= self.qps:
+                    self.qps_rejected += 1
+                    return 200, {'error_code': 18, 'error_msg': 'Open api qps request limit reached'}
+                self._window.append(now)
+        return 200, self.result()
+
+    def result(self):
+        words = [{
+            'words': f'第 {i + 1} 行识别结果',
+            'location': {'left': 20, 'top': 20 + i * 40, 'width': 300, 'height': 32},
+            'probability': {'average': 0.95 if i % 4 else 0.6, 'min': 0.5, 'variance': 0.01}
+        } for i in range(self.lines)]
+        return {'log_id': 1, 'words_result_num': len(words), 'words_result': words}
@@ -0,0 +1,119 @@
+"""错题批量导入导出（NDJSON，每行一道错题的 JSON）
+
+- 导出：单独的数据库连接 + stream_results（MySQL 用服务端游标），按 batch_size 分批取行，
+  逐批生成 NDJSON，不经过 ORM，内存占用与总行数无关
+- 导入：按行读取，每 batch_size 行用一次 executemany 插入，同时写标签索引、SQLite 全文索引和相似题向量，
+  每批单独提交。中途出错时已提交的批次保留，错误里带有出错的行号（写入失败时是这一批的最后一行）和已导入的行数
+
+导入默认分配新的 id（取当前最大 id 往后排），keep_ids 为真时沿用文件里的 id，用于恢复备份。
+分配 id 时如果有其他请求同时新建错题，可能主键冲突，这一批会回滚并报错。
+"""
+import json
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+FIELDS = ('id', 'content', 'image_path', 'created_at', 'updated_at', 'tags', 'analysis')
+
+
+class LoadError(Exception):
+    def __init__(self, message, line, loaded):
+        super().__init__(f'第 {line} 行: {message}')
+        self.line = line
+        self.loaded = loaded
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else datetime.now()
+
+
+class MistakeTransfer:
+    def __init__(self, db, model, write_tag_index, indexes, normalize_tags):
+        """indexes 为需要同步的索引（全文索引、相似题向量），各自提供 index_rows([(id, content, analysis), ...])"""
+        self.db = db
+        self.model = model
+        self.write_tag_index = write_tag_index
+        self.indexes = indexes
+        self.normalize_tags = normalize_tags
+
+    def dump(self, batch_size=1000):
+        """按 id 顺序逐批产出 NDJSON 文本，每批一个字符串"""
+        table = self.model.__table__
+        with self.db.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(
+                select(*[table.c[name] for name in FIELDS]).order_by(table.c.id)
+            )
+            for rows in result.partitions(batch_size):
+                yield ''.join(self._dump_row(row) for row in rows)
+
+    @staticmethod
+    def _dump_row(row):
+        data = dict(row._mapping)
+        for name in ('created_at', 'updated_at'):
+            if data[name] is not None:
+                data[name] = data[name].isoformat()
+        try:
+            data['tags'] = json.loads(data['tags']) if data['tags'] else []
+        except ValueError:
+            data['tags'] = []
+        return json.dumps(data, ensure_ascii=False) + '\n'
+
+    def load(self, lines, batch_size=5000, keep_ids=False):
+        """从可迭代的 NDJSON 行（str 或 bytes）导入错题，返回导入的行数"""
+        loaded = 0
+        batch = []
+        number = 0
+        for number, line in enumerate(lines, 1):
+            try:
+                # 不是合法 UTF-8 时 UnicodeDecodeError（ValueError 的子类）也按这一行的错误报告
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if not data.get('content'):
+                    raise ValueError('content 不能为空')
+                batch.append(self._load_row(data, keep_ids))
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                raise LoadError(str(e), number, loaded)
+            if len(batch) >= batch_size:
+                loaded += self._insert(batch, keep_ids, number, loaded)
+                batch = []
+        if batch:
+            loaded += self._insert(batch, keep_ids, number, loaded)
+        return loaded
+
+    def _load_row(self, data, keep_ids):
+        row = {
+            'content': data['content'],
+            'image_path': data.get('image_path'),
+            'created_at': _parse_time(data.get('created_at')),
+            'updated_at': _parse_time(data.get('updated_at')),
+            'tags': self.normalize_tags(data.get('tags')),
+            'analysis': data.get('analysis')
+        }
+        if keep_ids:
+            row['id'] = int(data['id'])
+        return row
+
+    def _insert(self, batch, keep_ids, line, loaded):
+        table = self.model.__table__
+        session = self.db.session
+        try:
+            if not keep_ids:
+                next_id = (session.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+                for i, row in enumerate(batch):
+                    row['id'] = next_id + i
+            names_by_id = {row['id']: row['tags'] for row in batch}
+            for row in batch:
+                row['tags'] = json.dumps(row['tags'], ensure_ascii=False)
+            session.execute(table.insert(), batch)
+            self.write_tag_index(names_by_id, replace=False)
+            for index in self.indexes:
+                index.index_rows([(row['id'], row['content'], row['analysis']) for row in batch])
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            # 只保留数据库驱动的错误信息，不带整批参数
+            raise LoadError(f'写入失败: {getattr(e, "orig", None) or e}', line, loaded)
+        return len(batch)
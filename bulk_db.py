@@ -0,0 +1,44 @@
+import argparse
+import sys
+import time
+
+from app import app, mistake_transfer
+from bulk import LoadError
+
+def dump(path, batch_size):
+    """导出全部错题到 NDJSON 文件，path 为 - 时写到标准输出"""
+    output = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8')
+    try:
+        for chunk in mistake_transfer.dump(batch_size):
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+def load(path, batch_size, keep_ids):
+    """从 NDJSON 文件导入错题，path 为 - 时从标准输入读取"""
+    start = time.perf_counter()
+    source = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    try:
+        loaded = mistake_transfer.load(source, batch_size, keep_ids=keep_ids)
+    except LoadError as e:
+        print(f"导入失败: {e}（已导入 {e.loaded} 行）", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    print(f"导入完成，共 {loaded} 道错题，耗时 {time.perf_counter() - start:.1f} 秒", file=sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='错题批量导入导出（NDJSON）')
+    parser.add_argument('command', choices=['dump', 'load'])
+    parser.add_argument('path', nargs='?', default='-', help='NDJSON 文件，默认标准输入/输出')
+    parser.add_argument('--batch-size', type=int, default=app.config['BULK_BATCH_SIZE'])
+    parser.add_argument('--keep-ids', action='store_true', help='沿用文件里的 id（恢复备份）')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.command == 'dump':
+            dump(args.path, args.batch_size)
+        else:
+            load(args.path, args.batch_size, args.keep_ids)
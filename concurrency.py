@@ -0,0 +1,28 @@
+"""gevent worker 下的并发辅助
+
+gunicorn 使用 gevent worker（GUNICORN_WORKER_CLASS=gevent）时，worker 进程启动时先给标准库打补丁：
+socket、threading、queue、time.sleep、subprocess 都会在等待时让出，所以 requests（百度 OCR、DeepSeek）、
+PyMySQL、分析引擎的线程池、SSE 的心跳和 wkhtmltopdf 子进程都不需要改写。
+Flask-SQLAlchemy 的会话按 greenlet 隔离，每个请求仍然有自己的会话。
+
+不会让出的是 OpenCV/NumPy 的计算：一张图片几百毫秒的解码、纠偏和擦除会卡住同一进程里的所有请求。
+这些步骤通过 run_blocking() 交给 gevent 的原生线程池执行（OpenCV 计算时释放 GIL，可以并行）。
+交给线程池的函数里不要访问数据库，也不要使用被打过补丁的锁。同步 worker 下 run_blocking() 直接调用。
+"""
+import sys
+
+
+def gevent_active():
+    """当前进程是否已被 gevent 打补丁"""
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+
+def run_blocking(func, *args, **kwargs):
+    """执行 CPU 密集的函数；gevent 下在原生线程池里执行，当前 greenlet 等待期间其他请求照常处理"""
+    if not gevent_active():
+        return func(*args, **kwargs)
+    import gevent
+    return gevent.get_hub().threadpool.apply(func, args, kwargs)
@@ -11,24 +11,132 @@ class Config:
     MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', 'Cuotiji@2024')
     MYSQL_DB = os.getenv('MYSQL_DB', 'cuotiji')
     
-    # URL 编码处理特殊字符
-    SQLALCHEMY_DATABASE_URI = 'mysql+pymysql://{user}:{password}@{host}:{port}/{db}'.format(
+    # MySQL 驱动：pymysql（纯 Python，gevent 下可以让出）或 mysqldb（mysqlclient，C 扩展，
+    # 解析结果集快得多，但在 gevent worker 下会阻塞整个进程，只配合同步 worker 使用）
+    MYSQL_DRIVER = os.getenv('MYSQL_DRIVER', 'pymysql')
+    
+    # URL 编码处理特殊字符；设置 DATABASE_URL 时直接使用（如本地/测试用 sqlite:///cuotiji.db）
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL') or 'mysql+{driver}://{user}:{password}@{host}:{port}/{db}'.format(
+        driver=MYSQL_DRIVER,
         user=MYSQL_USER,
         password=MYSQL_PASSWORD.replace('@', '%40'),  # URL 编码 @ 符号
         host=MYSQL_HOST,
         port=MYSQL_PORT,
         db=MYSQL_DB
     )
+    
+    # 连接池（每个 worker 进程一个）。连接数上限 = pool_size + max_overflow，乘以进程数不能超过 MySQL 的 max_connections；
+    # gevent worker 下一个请求从第一条查询到提交都占着一个连接，连接池比同步 worker 大
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))  # 等待空闲连接的秒数，超时报错而不是一直排队
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # 秒，要小于 MySQL 的 wait_timeout，避免拿到被服务端断开的连接
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes')  # 取出连接时先检查，断开的自动重连
+    # SQLite 没有连接池参数，只有 MySQL 时设置
+    SQLALCHEMY_ENGINE_OPTIONS = {} if SQLALCHEMY_DATABASE_URI.startswith('sqlite') else {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
     # 百度OCR配置
     BAIDU_APP_ID = os.getenv('BAIDU_APP_ID', '')
     BAIDU_API_KEY = os.getenv('BAIDU_API_KEY', '')
     BAIDU_SECRET_KEY = os.getenv('BAIDU_SECRET_KEY', '')
+    BAIDU_OCR_BASE_URL = os.getenv('BAIDU_OCR_BASE_URL', 'https://aip.baidubce.com')
+    BAIDU_OCR_QPS = float(os.getenv('BAIDU_OCR_QPS', 2))  # 每个进程的 QPS，配额按 worker 进程数分摊
+    BAIDU_OCR_CONNECT_TIMEOUT = float(os.getenv('BAIDU_OCR_CONNECT_TIMEOUT', 5))
+    BAIDU_OCR_READ_TIMEOUT = float(os.getenv('BAIDU_OCR_READ_TIMEOUT', 30))
+    
+    # OCR 结果缓存（按图片内容寻址）
+    OCR_CACHE_FOLDER = os.getenv('OCR_CACHE_FOLDER', os.path.join('uploads', 'ocr_cache'))
+    OCR_CACHE_MAX_ENTRIES = int(os.getenv('OCR_CACHE_MAX_ENTRIES', 256))  # 每个进程内存中缓存的条数
+    OCR_CACHE_TTL = int(os.getenv('OCR_CACHE_TTL', 30 * 24 * 3600))  # 秒
+    OCR_CACHE_MAX_FILES = int(os.getenv('OCR_CACHE_MAX_FILES', 20000))  # 磁盘上最多保留的条数，超过时删除最早写入的
+    
+    # 手写擦除：confidence 按 OCR 置信度，ink 按蓝/红色笔迹，both 两者都用
+    HANDWRITING_MODE = os.getenv('HANDWRITING_MODE', 'confidence')
+    HANDWRITING_CONFIDENCE_THRESHOLD = float(os.getenv('HANDWRITING_CONFIDENCE_THRESHOLD', 0.85))
+    
+    # 整页拆题：按题号或空白行把一页拆成多道错题
+    SEGMENT_MAX_WORKERS = int(os.getenv('SEGMENT_MAX_WORKERS', 4))  # 同时识别的页数
+    # 一次上传的最多图片数和请求体上限：手机照片一张 3~5 MB，12 张约 60 MB；
+    # 图片会全部读进内存，前面有 Nginx 时 client_max_body_size 也要相应调大
+    SEGMENT_MAX_PAGES = int(os.getenv('SEGMENT_MAX_PAGES', 12))
+    SEGMENT_MAX_CONTENT_LENGTH = int(os.getenv('SEGMENT_MAX_CONTENT_LENGTH', 64 * 1024 * 1024))
+    SEGMENT_GAP_FACTOR = float(os.getenv('SEGMENT_GAP_FACTOR', 2.5))  # 没有题号时，行间距超过几倍行高才切分
+    
+    # OCR 前的图片预处理，阶段用逗号分隔：exif,downscale,deskew,grayscale，留空则不处理
+    IMAGE_PIPELINE = [stage for stage in os.getenv('IMAGE_PIPELINE', 'exif,downscale,deskew,grayscale').split(',') if stage]
+    IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 2048))  # 长边像素，百度 OCR 上限 4096
+    IMAGE_MAX_SKEW = float(os.getenv('IMAGE_MAX_SKEW', 10))  # 纠偏时搜索的最大角度
+    OCR_JPEG_QUALITY = int(os.getenv('OCR_JPEG_QUALITY', 90))  # 送给 OCR 的图片
+    IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 80))  # 返回给前端的图片
+    IMAGE_WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', 75))
+    IMAGE_OUTPUT_FORMAT = os.getenv('IMAGE_OUTPUT_FORMAT', 'jpeg')  # 请求的 Accept 没有指定时使用：jpeg/webp/png
+    
+    # 性能分析：开启后请求带 X-Profile 头时返回 cProfile 摘要（有开销且会暴露代码结构，只在排查问题时打开）
+    PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', '').lower() in ('1', 'true', 'yes')
+    PROFILE_LIMIT = int(os.getenv('PROFILE_LIMIT', 30))  # 摘要里列出的函数数
+    # 响应头带上本次请求的查询数、查询耗时和提交数（X-Query-Count / X-Query-Time / X-Commit-Count），用于检查 N+1 查询
+    QUERY_STATS_HEADERS = os.getenv('QUERY_STATS_HEADERS', '').lower() in ('1', 'true', 'yes')
     
     # 上传文件配置
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max-limit
+    IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', 365 * 24 * 3600))  # /images/ 下按内容哈希寻址的图片的缓存秒数
+    
+    # 响应压缩：JSON 和文本响应按 Accept-Encoding 用 brotli 或 gzip 压缩（前面的 Nginx 已经压缩时关闭）
+    COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))  # 字节，更小的响应压缩后省不了多少
+    COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))  # 0-11，4 以上 CPU 开销增长很快
+    
+    # PDF 导出配置
+    EXPORT_FOLDER = os.path.join(UPLOAD_FOLDER, 'exports')  # 同步导出时的临时文件
+    EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 50))  # 每次交给 wkhtmltopdf 渲染的错题数
+    EXPORT_FRAGMENT_CACHE_SIZE = int(os.getenv('EXPORT_FRAGMENT_CACHE_SIZE', 2000))  # 缓存的错题 HTML 片段数
+    
+    # 相似题检索：向量维数（改动后需要重新计算向量）、新建时提示可能重复的相似度（错一个字约 0.9）、相似题接口默认的最低相似度
+    SIMILARITY_DIM = int(os.getenv('SIMILARITY_DIM', 128))
+    DUPLICATE_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', 0.9))
+    SIMILAR_MIN_SCORE = float(os.getenv('SIMILAR_MIN_SCORE', 0.3))
+    
+    # 知识点统计：/api/stats/tags 默认比较最近几天和之前同样天数新增的错题
+    TAG_STATS_WINDOW_DAYS = int(os.getenv('TAG_STATS_WINDOW_DAYS', 7))
+    
+    # 批量导入导出（NDJSON）
+    BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', 5000))  # 每批读取/插入的行数
+    
+    # 后台任务配置
+    JOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'jobs')  # 任务的输入图片和生成的文件
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+    JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', 600))  # 超时未完成的任务会被重新领取
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+    JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', 60))  # 秒，排队超过这个时间没有被领取时提示 worker 可能没有运行
+    JOB_RETENTION = int(os.getenv('JOB_RETENTION', 24 * 3600))  # 秒，完成的任务记录和 JOB_FOLDER 里的文件保留多久，由 worker 定期清理
+    JOB_INLINE_WORKER = os.getenv('JOB_INLINE_WORKER', '').lower() in ('1', 'true', 'yes')  # 在 Web 进程内执行任务（开发用）
     
     # 添加 Deepseek 配置
-    DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY', '') 
\ No newline at end of file
+    DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY', '')
+    DEEPSEEK_API_URL = os.getenv('DEEPSEEK_API_URL', 'https://api.deepseek.com/v1/chat/completions')
+    DEEPSEEK_MODEL = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
+    DEEPSEEK_CONNECT_TIMEOUT = float(os.getenv('DEEPSEEK_CONNECT_TIMEOUT', 5))
+    DEEPSEEK_READ_TIMEOUT = float(os.getenv('DEEPSEEK_READ_TIMEOUT', 120))
+    DEEPSEEK_QPS = float(os.getenv('DEEPSEEK_QPS', 10))  # 0 表示不限速
+    
+    # 对外 HTTP 调用的重试和熔断（百度 OCR、DeepSeek 共用）
+    HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 3))  # 429/5xx/网络错误的重试次数
+    HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', 0.5))  # 第 n 次重试等待 base * 2^(n-1) 秒
+    HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', 8))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))  # 连续失败多少次后熔断
+    CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))  # 熔断多少秒后试探恢复
+    
+    # 错题分析并发配置
+    ANALYZE_MAX_IN_FLIGHT = int(os.getenv('ANALYZE_MAX_IN_FLIGHT', 4))  # 每个进程同时在途的模型请求数
+    ANALYZE_BATCH_TOKEN_BUDGET = int(os.getenv('ANALYZE_BATCH_TOKEN_BUDGET', 1500))  # 打包到同一请求的题目 token 上限
+    ANALYZE_BATCH_MAX_ITEMS = int(os.getenv('ANALYZE_BATCH_MAX_ITEMS', 4))
+    ANALYZE_STREAM_HEARTBEAT = float(os.getenv('ANALYZE_STREAM_HEARTBEAT', 15))  # SSE 空闲多少秒发一次心跳，防止代理断开 
\ No newline at end of file
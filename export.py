@@ -0,0 +1,144 @@
+"""错题 PDF 导出
+
+- 模板在模块加载时编译一次
+- 每道错题渲染出的 HTML 片段按 (id, updated_at, 导出类型) 缓存，内容没变就不重新渲染
+- 大批量导出由调用方分块（EXPORT_CHUNK_SIZE）逐块交给 wkhtmltopdf，生成的 PDF 再合并成一个文件，
+  避免一次把几千道题加载进内存、塞进同一个 HTML
+- 结果写到文件里，由调用方流式返回，不在内存里保存整个 PDF
+"""
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pdfkit
+from jinja2 import Environment
+from markupsafe import Markup
+from pypdf import PdfWriter
+
+from metrics import stage_timer
+
+_env = Environment(autoescape=True)
+
+FRAGMENT_TEMPLATE = _env.from_string("""
+<div class="content">{{ mistake.content }}</div>
+{% if export_type == 'full' and mistake.analysis %}
+<div class="analysis">
+    <h4>分析结果：</h4>
+    <div>{{ mistake.analysis }}</div>
+    {% if tags %}
+    <div class="tags">
+        <h4>知识点标签：</h4>
+        {% for tag in tags %}
+        <span class="tag">{{ tag }}</span>
+        {% endfor %}
+    </div>
+    {% endif %}
+</div>
+{% endif %}
+""")
+
+PAGE_TEMPLATE = _env.from_string("""
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body { font-family: Arial, sans-serif; }
+        .mistake { margin-bottom: 30px; page-break-inside: avoid; }
+        .content { white-space: pre-wrap; margin: 10px 0; }
+        .analysis { margin-top: 10px; background: #f5f5f5; padding: 10px; }
+        .tags { margin-top: 10px; }
+        .tag { display: inline-block; margin: 2px; padding: 2px 8px; background: #eee; border-radius: 12px; }
+    </style>
+</head>
+<body>
+    {% if export_time %}
+    <h1>错题集</h1>
+    <p>导出时间：{{ export_time }}</p>
+    {% endif %}
+    {% for number, fragment in fragments %}
+    <div class="mistake">
+        <h3>错题 {{ number }}</h3>
+        {{ fragment }}
+    </div>
+    {% endfor %}
+</body>
+</html>
+""")
+
+
+class PdfExporter:
+    def __init__(self, cache_size=2000):
+        self.cache_size = cache_size
+        self._fragments = OrderedDict()  # (id, updated_at, export_type) -> Markup
+        self._lock = threading.Lock()
+
+    def render_fragment(self, mistake, tags, export_type):
+        key = (mistake.id, mistake.updated_at, export_type)
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                return fragment
+
+        # 渲染结果是已转义的 Markup，嵌入页面模板时不会被再次转义
+        fragment = Markup(FRAGMENT_TEMPLATE.render(mistake=mistake, tags=tags, export_type=export_type))
+        with self._lock:
+            self._fragments[key] = fragment
+            while len(self._fragments) > self.cache_size:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def render_html(self, mistakes, tags, export_type, start_number=1, export_time=None):
+        fragments = [(start_number + i, self.render_fragment(m, t, export_type))
+                     for i, (m, t) in enumerate(zip(mistakes, tags))]
+        return PAGE_TEMPLATE.render(fragments=fragments, export_time=export_time)
+
+    def export(self, chunks, export_type, output_path, export_time):
+        """chunks 逐块产出 (错题列表, 标签列表)；每块单独生成 PDF，最后合并写入 output_path"""
+        parts = []
+        number = 1
+        try:
+            for mistakes, tags in chunks:
+                with stage_timer('pdf_html'):
+                    html_content = self.render_html(mistakes, tags, export_type, start_number=number,
+                                                    export_time=export_time if number == 1 else None)
+                # 分块文件和输出文件放在同一目录，单块时可以直接重命名
+                fd, part_path = tempfile.mkstemp(suffix='.part.pdf', dir=os.path.dirname(output_path) or None)
+                os.close(fd)
+                parts.append(part_path)
+                with stage_timer('pdf_render'):
+                    pdfkit.from_string(html_content, part_path)
+                number += len(mistakes)
+
+            if not parts:
+                raise ValueError('没有可导出的错题')
+            if len(parts) == 1:
+                os.replace(parts.pop(), output_path)
+                return
+
+            with stage_timer('pdf_merge'):
+                writer = PdfWriter()
+                for part_path in parts:
+                    writer.append(part_path)
+                with open(output_path, 'wb') as f:
+                    writer.write(f)
+        finally:
+            for part_path in parts:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+
+
+def stream_file(path, chunk_size=64 * 1024, remove=True):
+    """按块读取文件返回给客户端，读完后删除临时文件"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if remove and os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,14 @@
+"""gunicorn 配置，supervisor 和负载测试（benchmarks/loadtest.py）都使用这份配置
+
+环境变量可以覆盖默认值，命令行参数（如 -b）优先于这里的设置。
+
+GUNICORN_WORKER_CLASS=gevent 时每个 worker 用 greenlet 同时处理多个请求：请求的大部分时间在等百度 OCR、
+DeepSeek 和 wkhtmltopdf，同步 worker 下并发数等于 worker 数。gevent 模式下图片计算交给原生线程池
+（见 concurrency.py）；数据库需要用纯 Python 的 PyMySQL，SQLite 的锁等待不会让出，只适合开发环境。
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')  # sync / gevent
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 200))  # gevent 下每个 worker 同时处理的请求数
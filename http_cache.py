@@ -0,0 +1,88 @@
+"""HTTP 缓存：按数据版本号做条件请求，JSON 响应压缩
+
+- 版本号：data_version 表一行一个计数器。提交的事务里改动过错题（ORM 新建、修改、删除，
+  或者通过 mark() 标记的批量写入）时，在提交前把计数器加一，和改动一起提交
+- 条件请求：读接口先查一次版本号（主键查询），ETag 由版本号生成；
+  浏览器带 If-None-Match / If-Modified-Since 且数据没有变化时直接返回 304，不再查询和序列化列表。
+  MySQL 可重复读隔离级别下版本号和随后读到的数据来自同一个快照，ETag 不会对应到更新之前的内容
+- 压缩：JSON 和文本响应按 Accept-Encoding 用 brotli 或 gzip 压缩；图片、流式响应和 send_file 不压缩
+
+计数器是单行热点，并发写入在提交前的一小段时间里按这一行排队；写请求本身已经很少并发，可以接受。
+"""
+import gzip
+from datetime import datetime
+
+import brotli
+from sqlalchemy import event, select
+
+# 按服务端偏好排列，客户端对两者的 q 值相同时优先 brotli（JSON 上比 gzip 小 15% 左右，压缩速度相近）
+ENCODINGS = ('br', 'gzip')
+COMPRESSIBLE = {'application/json', 'application/x-ndjson', 'text/html', 'text/plain', 'text/css',
+                'application/javascript', 'text/javascript'}
+
+
+class VersionTracker:
+    def __init__(self, db, model, name='mistakes'):
+        self.db = db
+        self.table = model.__table__
+        self.name = name
+
+    def register_events(self, models):
+        """flush 时记录 models 里的对象是否有改动，提交前加一次版本号，回滚时丢弃标记"""
+        @event.listens_for(self.db.session, 'after_flush')
+        def mark_changes(session, flush_context):
+            if any(isinstance(target, models) for target in (*session.new, *session.dirty, *session.deleted)):
+                session.info['data_changed'] = True
+
+        @event.listens_for(self.db.session, 'before_commit')
+        def bump_version(session):
+            # 提交时的最后一次 flush 在 before_commit 之后，先 flush 才能看到这次提交的全部改动
+            session.flush()
+            if session.info.pop('data_changed', False):
+                self._bump(session)
+
+        @event.listens_for(self.db.session, 'after_rollback')
+        def discard_mark(session):
+            session.info.pop('data_changed', None)
+
+    def mark(self):
+        """不经过 ORM 的批量写入（executemany、Core 语句）调用，提交时加版本号"""
+        self.db.session.info['data_changed'] = True
+
+    def _bump(self, session):
+        values = {'version': self.table.c.version + 1, 'updated_at': datetime.utcnow()}
+        result = session.execute(self.table.update().where(self.table.c.name == self.name).values(**values))
+        if result.rowcount == 0:
+            # 第一次写入时还没有这一行；多个进程同时插入时忽略冲突后再加一次
+            insert = self.table.insert() \
+                .prefix_with('IGNORE', dialect='mysql') \
+                .prefix_with('OR IGNORE', dialect='sqlite')
+            session.execute(insert, {'name': self.name, 'version': 0, 'updated_at': values['updated_at']})
+            session.execute(self.table.update().where(self.table.c.name == self.name).values(**values))
+
+    def current(self):
+        """返回 (版本号, 最后修改时间 UTC)，还没有写入过时为 (0, None)"""
+        row = self.db.session.execute(
+            select(self.table.c.version, self.table.c.updated_at).where(self.table.c.name == self.name)
+        ).first()
+        return (row[0], row[1]) if row else (0, None)
+
+
+def compress_response(response, accept_encodings, min_size=1024, gzip_level=6, brotli_quality=4):
+    """按客户端的 Accept-Encoding 压缩响应体，不适合压缩的响应原样返回"""
+    if (response.mimetype not in COMPRESSIBLE or response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accept_encodings.best_match(ENCODINGS)
+    data = response.get_data()
+    if encoding is None or len(data) < min_size:
+        return response
+    if encoding == 'br':
+        body = brotli.compress(data, quality=brotli_quality)
+    else:
+        body = gzip.compress(data, compresslevel=gzip_level, mtime=0)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
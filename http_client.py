@@ -0,0 +1,253 @@
+"""对外 HTTP 调用的公共层（百度 OCR、DeepSeek）
+
+- 每个上游一个 requests.Session，按主机复用连接（keep-alive）
+- 连接超时和读取超时分开设置
+- 429/5xx 和网络错误按指数退避重试，带随机抖动，响应里有 Retry-After 时按它等待
+- 非幂等请求（POST，如 DeepSeek 的对话接口，按次计费）只在确定上游没有处理时重试：
+  连接没有建立（连接超时、连接被拒绝）或上游返回 429/503；读取超时和其他 5xx 不重试，避免重复调用和重复计费
+- 熔断：连续失败达到阈值后直接拒绝请求，冷却一段时间后放行一个试探请求
+- 令牌桶限速：每次请求（包括重试）都先取令牌，不超过上游的 QPS 配额
+
+限速和熔断的状态都在进程内，多个 worker 进程时 QPS 配额需要按进程数分摊。
+"""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from metrics import UPSTREAM_RETRIES, UPSTREAM_SECONDS
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# 上游明确表示没有处理请求的状态码，非幂等请求也可以重试
+UNPROCESSED_STATUSES = frozenset({429, 503})
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+def _not_sent(error):
+    """网络错误发生在建立连接时，请求确定没有发到上游"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class UpstreamError(Exception):
+    """上游不可用：网络错误重试耗尽、熔断中或限速等待超时"""
+
+
+class CircuitOpenError(UpstreamError):
+    """熔断器打开，请求没有发出"""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate  # 每秒补充的令牌数
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """取一个令牌，不够时预支并等待；需要等待超过 timeout 秒时不取令牌，返回 False
+
+        预支让等待的线程按到达顺序依次放行，不会在锁上反复争抢
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0
+            if timeout is not None and wait > timeout:
+                return False
+            self._tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行请求；打开状态冷却结束后只放行一个试探请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def cancel(self):
+        """放行后请求没有发出（例如限速排队超时），让出试探名额"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"熔断器打开：连续失败 {self.failures} 次", flush=True)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+
+class HttpClient:
+    def __init__(self, name, qps=0, burst=None, pool_maxsize=10, timeout=(5, 30), max_retries=3,
+                 backoff_base=0.5, backoff_max=8, failure_threshold=5, reset_timeout=30, acquire_timeout=30):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.acquire_timeout = acquire_timeout
+        self.bucket = TokenBucket(qps, burst) if qps else None
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        # 重试由 request() 自己处理，每次重试都要经过限速
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _acquire(self):
+        if self.bucket and not self.bucket.acquire(self.acquire_timeout):
+            self._count('rejected')
+            raise UpstreamError(f'{self.name} 请求排队超过 {self.acquire_timeout} 秒（QPS 限制）')
+
+    def _backoff(self, attempt, response):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+
+    def request(self, method, url, retry_if=None, idempotent=None, **kwargs):
+        """发送请求，429/5xx、网络错误以及 retry_if(response) 为真时重试
+
+        idempotent 默认按请求方法判断；为假时只重试确定没有被处理的请求（见模块说明），retry_if 仍然生效。
+        重试耗尽后返回最后一次的响应，由调用方按原来的方式处理错误；网络错误不再重试时抛出 UpstreamError
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = self._request(method, url, retry_if, idempotent, **kwargs)
+            if response.status_code < 400:
+                outcome = 'ok'
+            return response
+        except CircuitOpenError:
+            outcome = 'rejected'
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, upstream=self.name, outcome=outcome)
+
+    def _request(self, method, url, retry_if, idempotent, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise CircuitOpenError(f'{self.name} 连续失败，暂停调用 {self.breaker.reset_timeout} 秒')
+        try:
+            self._acquire()
+        except UpstreamError:
+            self.breaker.cancel()
+            raise
+
+        attempt = 0
+        while True:
+            self._count('requests')
+            error = response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except requests.RequestException as e:
+                # URL 错误等不可重试的异常，也要结束熔断器的试探状态
+                self.breaker.record_failure()
+                raise UpstreamError(f'{self.name} 请求失败: {e}') from e
+            else:
+                if response.status_code not in RETRY_STATUSES and not (retry_if and retry_if(response)):
+                    # 4xx 说明上游正常，只是请求本身有问题，不计入熔断
+                    self.breaker.record_success()
+                    return response
+
+            if idempotent:
+                retryable = True
+            elif response is not None:
+                retryable = response.status_code in UNPROCESSED_STATUSES or bool(retry_if and retry_if(response))
+            else:
+                retryable = _not_sent(error)
+            attempt += 1
+            if attempt > self.max_retries or not retryable:
+                self._count('failures')
+                self.breaker.record_failure()
+                if response is not None:
+                    return response
+                if not retryable:
+                    raise UpstreamError(f'{self.name} 请求失败（上游可能已处理，不重试）: {error}') from error
+                raise UpstreamError(f'{self.name} 请求失败（已重试 {self.max_retries} 次）: {error}') from error
+
+            delay = self._backoff(attempt, response)
+            reason = response.status_code if response is not None else type(error).__name__
+            print(f"{self.name} 请求失败（{reason}），{delay:.1f} 秒后第 {attempt} 次重试", flush=True)
+            self._count('retries')
+            UPSTREAM_RETRIES.inc(upstream=self.name)
+            time.sleep(delay)
+            try:
+                self._acquire()
+            except UpstreamError:
+                self.breaker.record_failure()
+                raise
+
+    def post(self, url, **kwargs):
+        """POST 默认按非幂等处理，只读的接口（如 OCR 识别）传 idempotent=True"""
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'name': self.name,
+                'circuit': self.breaker.state,
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'rejected': self.rejected
+            }
@@ -0,0 +1,441 @@
+"""图片处理：OCR 前的预处理流水线和手写擦除
+
+预处理（ImagePipeline，各阶段可以在配置里开关）：
+- exif：按 EXIF 方向旋转，手机竖拍的照片不再横着送去识别
+- downscale：长边缩到 OCR 合适的分辨率，手机原图动辄几千万像素，对识别没有帮助
+- deskew：估计整页的倾斜角度并转正
+- grayscale：转成灰度，送给 OCR 和返回给前端的图片都更小
+最后按质量参数重新编码成 JPEG/WebP。每个阶段的耗时和前后字节数记录在 PipelineReport 里。
+
+手写擦除有两种检测方式，可以单独使用也可以合并：
+- confidence：OCR 置信度低于阈值的文字区域（通常是手写），掩码用差分数组一次性生成，
+  不再逐个矩形绘制
+- ink：按墨水颜色（蓝色、红色笔迹）检测，不依赖 OCR 结果
+
+拆题（segment_questions）：按 OCR 返回的文字行位置把一页拆成多道题，
+有题号时按题号切分，没有题号时在行间较大且图片上确实是空白的位置切分。
+"""
+import io
+import re
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+import pillow_heif
+from PIL import Image
+
+MODES = ('confidence', 'ink', 'both')
+STAGES = ('exif', 'downscale', 'deskew', 'grayscale')
+
+# ISO BMFF 的 ftyp 品牌，iPhone 拍的 HEIC 一般是 heic / mif1
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1', b'avif'}
+
+# 输出格式 -> (扩展名, MIME 类型)
+FORMATS = {
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+    'png': ('.png', 'image/png')
+}
+
+# OpenCV 的 HSV 取值范围：H 0-180，S/V 0-255
+BLUE_INK = ((90, 60, 40), (130, 255, 255))
+RED_INK_LOW = ((0, 70, 50), (10, 255, 255))
+RED_INK_HIGH = ((160, 70, 50), (180, 255, 255))
+
+
+# 题号："3." "3、" "3．" "第3题"，后面紧跟数字的（如 2.5）不算
+QUESTION_START_RE = re.compile(r'^\s*(?:第\s*(\d{1,3})\s*题|(\d{1,3})\s*[.．、](?!\d))')
+# 大题标题："一、选择题"，不属于任何一道题
+SECTION_RE = re.compile(r'^\s*[一二三四五六七八九十]+\s*[、.．]')
+
+
+_REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                  4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def is_heif(data):
+    return data[4:8] == b'ftyp' and data[8:12] in HEIF_BRANDS
+
+
+def decode_heif(data):
+    """直接从内存解码 HEIC/HEIF，libheif 已经按容器里的旋转信息转正
+
+    bgr_mode 让 libheif 直接输出 OpenCV 的通道顺序，省掉一次颜色转换。
+    heif.data 只是指向 libheif 缓冲区的裸指针，HeifFile 回收后就失效，所以这里复制一次（memcpy）
+    """
+    heif = pillow_heif.open_heif(data, convert_hdr_to_8bit=True, bgr_mode=True)
+    width, height = heif.size
+    channels = len(heif.mode)
+    rows = np.frombuffer(heif.data, np.uint8).reshape(height, heif.stride)
+    if heif.stride == width * channels:
+        img = rows.reshape(height, width, channels)  # 仍然指向 libheif 的缓冲区
+        owned = False
+    else:
+        img = np.ascontiguousarray(rows[:, :width * channels]).reshape(height, width, channels)  # 去掉行尾填充时已复制
+        owned = True
+    if channels == 4:
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    return img if owned else img.copy()
+
+
+def decode_image(data, reduce=1):
+    """把图片字节解码为 BGR 数组；忽略 EXIF 方向，需要时由预处理的 exif 阶段旋转
+
+    reduce 为 2/4/8 时按比例缩小解码，JPEG 可以直接在解码时降采样，比解码原图再缩放快得多。
+    HEIC/HEIF 用 pillow_heif 解码，不支持 reduce。
+    """
+    if is_heif(data):
+        return decode_heif(data)
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), _REDUCED_FLAGS[reduce] | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        raise ValueError('无法解码图片')
+    return img
+
+
+def sniff_format(data):
+    """根据文件内容判断格式（小写扩展名，不含点），不信任客户端的文件名"""
+    if is_heif(data):
+        return 'heic'
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return {'JPEG': 'jpg'}.get(img.format, img.format.lower())
+    except Exception:
+        return 'bin'
+
+
+def probe_image(data):
+    """只读取图片头，返回 (宽, 高, EXIF 方向)，不解码像素；HEIC 等 PIL 打不开的格式返回 (None, None, 1)"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.size[0], img.size[1], exif_orientation(img)
+    except Exception:
+        return None, None, 1
+
+
+def encode_image(img, ext='.png', params=None):
+    ok, buf = cv2.imencode(ext, img, params or [])
+    if not ok:
+        raise ValueError(f'图片编码失败: {ext}')
+    return buf.tobytes()
+
+
+def exif_orientation(img):
+    """EXIF 里的方向；不用 getexif()，PNG 等格式下它会先解码整张图片"""
+    raw = img.info.get('exif')
+    if not raw:
+        return 1
+    exif = Image.Exif()
+    exif.load(raw)
+    return exif.get(0x0112, 1)
+
+
+def apply_orientation(img, orientation):
+    """和 PIL.ImageOps.exif_transpose 的结果一致"""
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(img), -1)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+
+def downscale(img, max_side):
+    height, width = img.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return img
+    return cv2.resize(img, (max(int(width * scale), 1), max(int(height * scale), 1)), interpolation=cv2.INTER_AREA)
+
+
+def _rotate(img, angle, border, interpolation=cv2.INTER_LINEAR):
+    height, width = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (width, height), flags=interpolation,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=border)
+
+
+def estimate_skew(img, max_angle=10, sample_width=400):
+    """估计把文字行转正需要旋转的角度（度，逆时针为正）
+
+    在缩小的二值图上尝试不同角度，文字行水平时逐行像素和的方差最大；先粗搜再在最优角度附近细搜。
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    if gray.shape[1] > sample_width:
+        gray = cv2.resize(gray, (sample_width, max(int(gray.shape[0] * sample_width / gray.shape[1]), 1)),
+                          interpolation=cv2.INTER_AREA)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+
+    def score(angle):
+        rotated = _rotate(binary, angle, 0, cv2.INTER_NEAREST)
+        return float(np.var(cv2.reduce(rotated, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32F)))
+
+    best = max(np.arange(-max_angle, max_angle + 1e-6, 1.0), key=score)
+    return float(max(np.arange(best - 1, best + 1 + 1e-6, 0.2), key=score))
+
+
+def deskew(img, max_angle=10, min_angle=0.2):
+    angle = estimate_skew(img, max_angle)
+    if abs(angle) < min_angle:
+        return img, 0.0
+    border = (255, 255, 255) if img.ndim == 3 else 255
+    return _rotate(img, angle, border), angle
+
+
+def to_grayscale(img):
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+
+class PipelineReport:
+    """记录每个阶段的耗时和图片字节数"""
+
+    def __init__(self):
+        self.timings = []  # [(阶段, 毫秒)]
+        self.sizes = {}  # input / ocr / output -> 字节数
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, (time.perf_counter() - start) * 1000))
+
+    def server_timing(self):
+        """Server-Timing 响应头，浏览器开发者工具的 Timing 面板里可以直接看到"""
+        return ', '.join(f'{name};dur={ms:.1f}' for name, ms in self.timings)
+
+    def byte_summary(self):
+        return ', '.join(f'{name}={size}' for name, size in self.sizes.items())
+
+    def to_dict(self):
+        return {
+            'timings': {name: round(ms, 1) for name, ms in self.timings},
+            'sizes': dict(self.sizes)
+        }
+
+
+class ImagePipeline:
+    def __init__(self, stages=STAGES, max_side=2048, max_skew=10, ocr_quality=90,
+                 jpeg_quality=80, webp_quality=75):
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise ValueError(f'未知的预处理阶段: {", ".join(sorted(unknown))}')
+        self.stages = tuple(stages)
+        self.max_side = max_side
+        self.max_skew = max_skew
+        self.ocr_quality = ocr_quality
+        self.jpeg_quality = jpeg_quality
+        self.webp_quality = webp_quality
+
+    def prepare(self, data, report):
+        """预处理上传的图片，返回 (彩色图片数组, 送给 OCR 的字节, 送给 OCR 的图片数组)
+
+        返回的图片和送给 OCR 的图片几何上一致（方向、尺寸、角度相同），OCR 的坐标可以直接用于擦除；
+        保留彩色是为了按墨水颜色检测手写。图片没有任何变化时直接把原始字节送给 OCR，
+        HEIC 百度 OCR 不支持，总是重新编码。整个过程只解码一次，调用方不需要再打开图片。
+        """
+        report.sizes['input'] = len(data)
+        width, height, orientation = probe_image(data)
+        reduce = 1
+        if 'downscale' in self.stages and width:
+            while reduce < 8 and max(width, height) / (reduce * 2) >= self.max_side:
+                reduce *= 2
+        with report.stage('decode'):
+            img = decode_image(data, reduce)
+        changed = reduce > 1 or is_heif(data)
+        # 先缩小再旋转，旋转的像素更少
+        if 'downscale' in self.stages:
+            with report.stage('downscale'):
+                scaled = downscale(img, self.max_side)
+                changed |= scaled is not img
+                img = scaled
+        if 'exif' in self.stages and orientation not in (None, 1):
+            with report.stage('exif'):
+                img = apply_orientation(img, orientation)
+                changed = True
+        if 'deskew' in self.stages:
+            with report.stage('deskew'):
+                img, angle = deskew(img, self.max_skew)
+                changed |= angle != 0
+        ocr_img = img
+        if 'grayscale' in self.stages:
+            with report.stage('grayscale'):
+                ocr_img = to_grayscale(img)
+                changed = True
+
+        if changed:
+            with report.stage('encode_ocr'):
+                ocr_data = encode_image(ocr_img, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, self.ocr_quality])
+        else:
+            ocr_data = data
+        report.sizes['ocr'] = len(ocr_data)
+        return img, ocr_data, ocr_img
+
+    def encode(self, img, image_format, report):
+        """按输出格式重新编码（开启 grayscale 时先转灰度），返回 (字节, MIME 类型)"""
+        ext, mimetype = FORMATS[image_format]
+        with report.stage('encode'):
+            if 'grayscale' in self.stages:
+                img = to_grayscale(img)
+            if image_format == 'jpeg':
+                params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+            elif image_format == 'webp':
+                params = [cv2.IMWRITE_WEBP_QUALITY, self.webp_quality]
+            else:
+                params = []
+            data = encode_image(img, ext, params)
+        report.sizes['output'] = len(data)
+        return data, mimetype
+
+
+def low_confidence_mask(shape, words_result, threshold=0.85):
+    """OCR 置信度低于 threshold 的文字区域掩码（bool 数组）
+
+    在压缩坐标上用二维差分数组：只保留所有矩形的边界作为网格线，每个矩形在四个角上加减 1，
+    两次累加后大于 0 的格子即被覆盖，最后按格子宽高展开成整幅图的掩码。
+    计算量只和矩形数量有关，不随图片分辨率增长，也不用逐个矩形绘制。
+    """
+    height, width = shape[:2]
+    boxes = np.array([
+        (float(w['probability']['average']), w['location']['left'], w['location']['top'],
+         w['location']['width'], w['location']['height'])
+        for w in (words_result or []) if 'probability' in w and 'location' in w
+    ], dtype=np.float64).reshape(-1, 5)
+    boxes = boxes[boxes[:, 0] < threshold]
+    if not len(boxes):
+        return np.zeros((height, width), dtype=bool)
+
+    # 与 ImageDraw.rectangle 一致，右、下边界包含在内
+    left = np.clip(boxes[:, 1], 0, width).astype(np.intp)
+    top = np.clip(boxes[:, 2], 0, height).astype(np.intp)
+    right = np.clip(boxes[:, 1] + boxes[:, 3] + 1, 0, width).astype(np.intp)
+    bottom = np.clip(boxes[:, 2] + boxes[:, 4] + 1, 0, height).astype(np.intp)
+
+    xs = np.unique(np.concatenate(([0, width], left, right)))
+    ys = np.unique(np.concatenate(([0, height], top, bottom)))
+    x0, x1 = np.searchsorted(xs, left), np.searchsorted(xs, right)
+    y0, y1 = np.searchsorted(ys, top), np.searchsorted(ys, bottom)
+
+    diff = np.zeros((len(ys), len(xs)), dtype=np.int32)
+    np.add.at(diff, (y0, x0), 1)
+    np.add.at(diff, (y0, x1), -1)
+    np.add.at(diff, (y1, x0), -1)
+    np.add.at(diff, (y1, x1), 1)
+    covered = diff.cumsum(axis=0).cumsum(axis=1)[:-1, :-1] > 0
+    return np.repeat(np.repeat(covered, np.diff(ys), axis=0), np.diff(xs), axis=1)
+
+
+def ink_mask(img, dilate=1):
+    """按颜色检测蓝色、红色笔迹（bool 数组），稍微膨胀以覆盖笔画边缘"""
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, *BLUE_INK)
+    mask |= cv2.inRange(hsv, *RED_INK_LOW)
+    mask |= cv2.inRange(hsv, *RED_INK_HIGH)
+    if dilate:
+        mask = cv2.dilate(mask, np.ones((3, 3), np.uint8), iterations=dilate)
+    return mask > 0
+
+
+def handwriting_mask(img, words_result=None, mode='confidence', threshold=0.85):
+    if mode not in MODES:
+        raise ValueError(f'未知的手写检测方式: {mode}')
+    mask = np.zeros(img.shape[:2], dtype=bool)
+    if mode in ('confidence', 'both'):
+        mask |= low_confidence_mask(img.shape, words_result, threshold)
+    if mode in ('ink', 'both'):
+        mask |= ink_mask(img)
+    return mask
+
+
+def remove_handwriting(img, words_result=None, mode='confidence', threshold=0.85):
+    """把检测到的手写区域涂白，返回新的图片数组和被擦除的像素数"""
+    mask = handwriting_mask(img, words_result, mode, threshold).astype(np.uint8)
+    result = img.copy()
+    cv2.copyTo(np.full_like(img, 255), mask, result)
+    return result, int(cv2.countNonZero(mask))
+
+
+def blank_rows(img, ink_ratio=0.002):
+    """每一行是否为空白（bool 数组）：Otsu 二值化后深色像素占比低于 ink_ratio"""
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return ink.sum(axis=1) <= ink.shape[1] * ink_ratio
+
+
+def _split_by_gaps(img, lines, gap_factor):
+    """没有题号时，在行间距超过 gap_factor 倍行高、且中间至少有一行高的空白时切分"""
+    line_height = float(np.median([line['location']['height'] for line in lines]))
+    blank = blank_rows(img)
+    groups = [[lines[0]]]
+    for prev, line in zip(lines, lines[1:]):
+        gap_top = prev['location']['top'] + prev['location']['height']
+        gap_bottom = line['location']['top']
+        split = False
+        if gap_bottom - gap_top >= gap_factor * line_height:
+            # 空白行的最长连续段，图形、公式等非文字内容所在的间隙不会被切开
+            run = longest = 0
+            for is_blank in blank[max(gap_top, 0):max(gap_bottom, 0)]:
+                run = run + 1 if is_blank else 0
+                longest = max(longest, run)
+            split = longest >= line_height
+        if split:
+            groups.append([line])
+        else:
+            groups[-1].append(line)
+    return [(None, group) for group in groups]
+
+
+def segment_questions(img, words_result, gap_factor=2.5, pad=8):
+    """把一页按题目拆成多个区域，返回 [{'number': 题号, 'text': 文字, 'box': (x0, y0, x1, y1)}]
+
+    题号之前的内容（试卷标题等）和大题标题不归入任何一道题。每道题的区域从第一行开始，
+    到下一行（下一题或大题标题）为止，题目里没有文字的图形也包含在内；最后一道题到它最后一行为止。
+    """
+    lines = sorted((w for w in (words_result or []) if 'location' in w and w.get('words', '').strip()),
+                   key=lambda w: (w['location']['top'], w['location']['left']))
+    if not lines:
+        return []
+    height, width = img.shape[:2]
+
+    if any(QUESTION_START_RE.match(line['words']) for line in lines):
+        groups = []
+        current = None
+        for line in lines:
+            match = QUESTION_START_RE.match(line['words'])
+            if match:
+                current = [line]
+                groups.append((match.group(1) or match.group(2), current))
+            elif SECTION_RE.match(line['words']):
+                current = None
+            elif current is not None:
+                current.append(line)
+    else:
+        groups = _split_by_gaps(img, lines, gap_factor)
+
+    # 所有题目的区域取相同的左右边界（整页文字的范围），选项排在右侧的也不会被截掉
+    x0 = max(min(line['location']['left'] for line in lines) - pad, 0)
+    x1 = min(max(line['location']['left'] + line['location']['width'] for line in lines) + pad, width)
+    order = {id(line): i for i, line in enumerate(lines)}
+    regions = []
+    for number, group in groups:
+        top = max(group[0]['location']['top'] - pad, 0)
+        bottom = max(line['location']['top'] + line['location']['height'] for line in group) + pad
+        following = order[id(group[-1])] + 1
+        if following < len(lines):
+            bottom = max(bottom, lines[following]['location']['top'] - pad)
+        regions.append({
+            'number': number,
+            'text': '\n'.join(line['words'] for line in group),
+            'box': (int(x0), int(top), int(x1), int(min(bottom, height)))
+        })
+    return regions
@@ -1,13 +1,96 @@
-from app import db
+import json
+import sys
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from app import app, db, Mistake, set_mistake_tags, data_version, mistake_index, mistake_search, tag_stats
 
 def init_db():
     # 删除所有表
+    mistake_search.drop()
     db.drop_all()
-    
+
     # 创建所有表
     db.create_all()
-    
+    mistake_search.setup()
+
     print("数据库初始化完成")
 
+def upgrade_db():
+    """在不删除数据的前提下，补建缺少的表和索引"""
+    # 创建缺少的表（已存在的表不会改动）
+    db.create_all()
+
+    # 已存在的表上补建模型里新增的列和索引
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+                db.session.commit()
+                print(f"添加列 {table.name}.{column.name}")
+
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                print(f"创建索引 {table.name}.{index.name}")
+
+    # 标签名改为二进制排序规则（只有大小写不同的标签各自一行），MySQL 上旧表需要修改列定义
+    if db.engine.dialect.name == 'mysql':
+        column = next(column for column in inspector.get_columns('tag') if column['name'] == 'name')
+        if getattr(column['type'], 'collation', None) != 'utf8mb4_bin':
+            db.session.execute(text('ALTER TABLE tag MODIFY name VARCHAR(100) NOT NULL COLLATE utf8mb4_bin'))
+            db.session.commit()
+            print("标签名改为区分大小写")
+
+    # 创建全文索引（MySQL 建 FULLTEXT 索引，SQLite 建 FTS 表并导入现有数据）
+    mistake_search.setup()
+    # SQLite 的 FTS 表按当前的分词方式重建（MySQL 下什么也不做）
+    mistake_search.rebuild()
+    db.session.commit()
+
+    backfill_tag_index()
+
+    # 按标签索引重算知识点统计（新增统计列时已有的关联还没有计入）
+    tag_stats.rebuild()
+    data_version.mark()  # 浏览器缓存的列表和统计在升级后重新获取
+    db.session.commit()
+    print("知识点统计重算完成")
+
+    # 给已有的错题补算相似题向量
+    print(f"相似题向量回填完成，共 {mistake_index.index_missing()} 道错题")
+
+    print("数据库升级完成")
+
+def backfill_tag_index(batch_size=1000):
+    """根据 Mistake.tags 中的 JSON 重建标签索引，可以重复执行"""
+    total = 0
+    last_id = 0
+    while True:
+        mistakes = Mistake.query.filter(Mistake.id > last_id, Mistake.tags.isnot(None)) \
+            .order_by(Mistake.id).limit(batch_size).all()
+        if not mistakes:
+            break
+        tag_map = {}
+        for mistake in mistakes:
+            try:
+                tag_map[mistake] = json.loads(mistake.tags)
+            except ValueError:
+                print(f"错题 {mistake.id} 的标签不是合法 JSON，跳过")
+        set_mistake_tags(tag_map)
+        db.session.commit()
+        total += len(mistakes)
+        last_id = mistakes[-1].id
+        db.session.expunge_all()  # 释放已处理的对象，内存占用不随数据量增长
+    print(f"标签索引回填完成，共处理 {total} 道错题")
+
 if __name__ == '__main__':
-    init_db() 
\ No newline at end of file
+    with app.app_context():
+        if len(sys.argv) > 1 and sys.argv[1] == 'upgrade':
+            upgrade_db()
+        else:
+            init_db()
@@ -0,0 +1,168 @@
+"""后台任务队列
+
+任务存放在数据库的 job 表里，不依赖外部消息中间件：
+- Web 进程只负责写入任务（status=pending），立即返回任务 id
+- worker 进程（python worker.py）轮询领取任务并执行，结果写回 job 表
+- 开发和测试时可以用 run_pending() 在当前进程里同步执行，或者 start_inline_worker() 起一个后台线程
+- worker 每隔一段时间清理超过 retention 秒的已完成/失败任务，以及任务目录里对应的输入和结果文件
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    def __init__(self, db, job_model, timeout=600, max_attempts=3, folder=None, retention=None,
+                 cleanup_interval=600):
+        self.db = db
+        self.Job = job_model
+        self.timeout = timeout  # running 超过这个秒数视为 worker 已崩溃，允许重新领取
+        self.max_attempts = max_attempts
+        self.folder = folder  # 任务的输入和结果文件，文件名以任务 id 开头
+        self.retention = retention  # 秒，为 None 时不清理
+        self.cleanup_interval = cleanup_interval
+        self.handlers = {}
+
+    def handler(self, kind):
+        """注册任务处理函数：handler(job_id, payload) -> 可 JSON 序列化的结果"""
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def submit(self, kind, payload=None, job_id=None):
+        if kind not in self.handlers:
+            raise ValueError(f'未知的任务类型: {kind}')
+        job = self.Job(kind=kind, status=PENDING,
+                       payload=json.dumps(payload or {}, ensure_ascii=False))
+        if job_id:
+            job.id = job_id
+        self.db.session.add(job)
+        self.db.session.commit()
+        return job
+
+    def claim(self):
+        """领取一个待执行的任务；多个 worker 并发领取时靠条件 UPDATE 保证只有一个成功"""
+        Job = self.Job
+        now = datetime.now()
+        claimable = or_(
+            Job.status == PENDING,
+            and_(Job.status == RUNNING, Job.updated_at < now - timedelta(seconds=self.timeout))
+        )
+        candidates = self.db.session.query(Job.id).filter(claimable) \
+            .order_by(Job.created_at).limit(5).all()
+        for (job_id,) in candidates:
+            claimed = Job.query.filter(Job.id == job_id, claimable).update({
+                'status': RUNNING,
+                'attempts': Job.attempts + 1,
+                'updated_at': now
+            }, synchronize_session=False)
+            self.db.session.commit()
+            if claimed:
+                return Job.query.get(job_id)
+        return None
+
+    def execute(self, job):
+        try:
+            if job.attempts > self.max_attempts:
+                raise RuntimeError(f'任务已重试 {job.attempts - 1} 次，放弃执行')
+            result = self.handlers[job.kind](job.id, json.loads(job.payload or '{}'))
+            job.result = json.dumps(result, ensure_ascii=False)
+            job.status = DONE
+        except Exception as e:
+            print(f"任务 {job.id} ({job.kind}) 执行失败: {traceback.format_exc()}", flush=True)
+            self.db.session.rollback()
+            job.status = FAILED
+            job.error = str(e)
+        job.updated_at = datetime.now()
+        self.db.session.commit()
+        return job
+
+    def cleanup(self, batch_size=1000):
+        """删除超过 retention 秒的已完成/失败任务，以及任务目录里不属于未完成任务的过期文件
+
+        返回 (删除的任务数, 删除的文件数)
+        """
+        if self.retention is None:
+            return 0, 0
+        Job = self.Job
+        cutoff = datetime.now() - timedelta(seconds=self.retention)
+        jobs = 0
+        while True:
+            expired = [job_id for (job_id,) in self.db.session.query(Job.id).filter(
+                Job.status.in_((DONE, FAILED)), Job.updated_at < cutoff).limit(batch_size)]
+            if not expired:
+                break
+            Job.query.filter(Job.id.in_(expired)).delete(synchronize_session=False)
+            self.db.session.commit()
+            jobs += len(expired)
+
+        files = 0
+        if self.folder and os.path.isdir(self.folder):
+            active = {job_id for (job_id,) in self.db.session.query(Job.id).filter(Job.status.in_((PENDING, RUNNING)))}
+            self.db.session.rollback()
+            oldest = time.time() - self.retention
+            for entry in os.scandir(self.folder):
+                if entry.is_file() and entry.name.split('.')[0] not in active and entry.stat().st_mtime < oldest:
+                    os.remove(entry.path)
+                    files += 1
+        return jobs, files
+
+    def run_next(self):
+        """执行一个任务，没有待执行的任务时返回 None"""
+        try:
+            job = self.claim()
+            if job is None:
+                return None
+            return self.execute(job)
+        finally:
+            self.db.session.remove()
+
+    def run_pending(self):
+        """在当前进程里把所有待执行的任务跑完，返回执行的任务数"""
+        count = 0
+        while self.run_next() is not None:
+            count += 1
+        return count
+
+    def run_worker(self, app, poll_interval=1.0, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        print(f"任务 worker 启动，支持的任务类型: {', '.join(self.handlers)}", flush=True)
+        last_cleanup = 0
+        with app.app_context():
+            while not stop_event.is_set():
+                if time.monotonic() - last_cleanup >= self.cleanup_interval:
+                    last_cleanup = time.monotonic()
+                    try:
+                        jobs, files = self.cleanup()
+                        if jobs or files:
+                            print(f"清理过期任务 {jobs} 个，文件 {files} 个", flush=True)
+                    except Exception:
+                        print(f"清理过期任务失败: {traceback.format_exc()}", flush=True)
+                    finally:
+                        self.db.session.remove()
+                try:
+                    job = self.run_next()
+                except Exception:
+                    print(f"领取任务失败: {traceback.format_exc()}", flush=True)
+                    job = None
+                if job is None:
+                    stop_event.wait(poll_interval)
+
+    def start_inline_worker(self, app, poll_interval=1.0):
+        """在 Web 进程内起一个后台线程执行任务，仅用于开发和测试"""
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self.run_worker, args=(app, poll_interval, stop_event),
+                                  name='job-worker', daemon=True)
+        thread.start()
+        return stop_event
@@ -0,0 +1,198 @@
+"""进程内指标：计数器和直方图，按 Prometheus 文本格式输出给 /metrics
+
+- 请求耗时按路由、方法、状态码统计
+- 各阶段耗时（图片预处理、OCR、擦除、LLM、PDF 渲染）统一记到 stage_seconds，按 stage 区分
+- 数据库语句按类型统计，每个请求的语句数按路由统计（数量随数据量增长说明有 N+1 查询），对外 HTTP 调用按上游和结果统计
+- start_profile()/profile_summary() 用 cProfile 记录单个请求，返回按累计耗时排序的摘要
+
+指标保存在进程内，gunicorn 多个 worker 时每次抓取只能看到其中一个进程，
+Prometheus 按实例抓取或在前面做汇总；worker.py 执行的后台任务不在 Web 进程的指标里。
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# 秒；覆盖从几毫秒的数据库查询到几十秒的 LLM 调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # 标签值元组 -> 计数或直方图状态
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self, items):
+        return [f'{self.name}_total{_format_labels(self.labelnames, key)} {value}' for key, value in items]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]  # 各桶计数、总数、总和
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'cuotiji_request_seconds', '请求处理耗时（秒）', ('endpoint', 'method', 'status'))
+STAGE_SECONDS = REGISTRY.histogram(
+    'cuotiji_stage_seconds', '各处理阶段耗时（秒）', ('stage',))
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    'cuotiji_upstream_request_seconds', '对外 HTTP 请求耗时（秒），包括重试和退避', ('upstream', 'outcome'))
+UPSTREAM_RETRIES = REGISTRY.counter(
+    'cuotiji_upstream_retries', '对外 HTTP 请求的重试次数', ('upstream',))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'cuotiji_db_query_seconds', '数据库语句耗时（秒）', ('statement',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+REQUEST_QUERIES = REGISTRY.histogram(
+    'cuotiji_request_queries', '每个请求执行的数据库语句数', ('endpoint', 'method'),
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128))
+
+
+def observe_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+
+
+@contextmanager
+def stage_timer(name):
+    with STAGE_SECONDS.time(stage=name):
+        yield
+
+
+def track_queries(engine, on_query=None, on_commit=None):
+    """在 SQLAlchemy 引擎上统计每条语句的耗时，按语句类型（SELECT/INSERT/...）分组
+
+    on_query(语句类型, 耗时) 在每条语句执行完后调用，on_commit() 在每次提交后调用，
+    用于按请求统计查询数和提交数
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+        DB_QUERY_SECONDS.observe(elapsed, statement=verb)
+        if on_query is not None:
+            on_query(verb, elapsed)
+
+    if on_commit is not None:
+        @event.listens_for(engine, 'commit')
+        def commit(conn):
+            on_commit()
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # 出错的语句不会触发 after_cursor_execute，丢掉对应的开始时间
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+def start_profile():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def profile_summary(profiler, limit=30, sort='cumulative'):
+    """停止记录，返回 pstats 文本摘要"""
+    profiler.disable()
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
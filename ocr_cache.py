@@ -0,0 +1,196 @@
+"""OCR 结果缓存
+
+按图片内容寻址：键是「规范化后的像素数据 + OCR 参数」的 SHA-256，
+同一张照片重新上传（即使文件名或 EXIF 元数据不同）也能命中缓存，不再调用百度 OCR。
+
+两级存储：
+- 进程内 LRU，容量由 max_entries 限制
+- 磁盘目录（所有 worker 进程共享），每个键一个 JSON 文件
+两级都按 ttl 过期。读到过期的文件时直接删除；写入时每隔 prune_interval 秒扫描一次目录，
+删除过期文件，文件数超过 max_files 时按写入时间从旧到新删除多出的部分。
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+import pillow_heif
+
+pillow_heif.register_heif_opener()
+
+
+def image_digest(image):
+    """规范化图片后计算摘要：应用 EXIF 旋转、统一为 RGB，只对像素和尺寸取哈希；无法解码时退化为原始字节
+
+    传入已经解码的像素数组（numpy）时直接对它取哈希，不再重复解码
+    """
+    digest = hashlib.sha256()
+    if hasattr(image, '__array_interface__'):
+        digest.update(f'pixels:{image.shape}:'.encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+    try:
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(image))).convert('RGB')
+        digest.update(f'{img.width}x{img.height}:'.encode())
+        digest.update(img.tobytes())
+    except Exception:
+        digest.update(b'raw:')
+        digest.update(image)
+    return digest.hexdigest()
+
+
+class OcrCache:
+    def __init__(self, directory, max_entries=256, ttl=30 * 24 * 3600, max_files=20000, prune_interval=600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_files = max_files
+        self.prune_interval = prune_interval
+        self._last_prune = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._memory = OrderedDict()  # key -> (stored_at, result)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(image, options, pixels=None):
+        options_json = json.dumps(options or {}, sort_keys=True)
+        digest = image_digest(pixels if pixels is not None else image)
+        return hashlib.sha256(f'{digest}:{options_json}'.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.json')
+
+    def _expired(self, stored_at):
+        return time.time() - stored_at > self.ttl
+
+    def _remember(self, key, stored_at, result):
+        with self._lock:
+            self._memory[key] = (stored_at, result)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = None
+
+        if stored is None or self._expired(stored['stored_at']):
+            if stored is not None:
+                self._unlink(path)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        self._remember(key, stored['stored_at'], stored['result'])
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+        return stored['result']
+
+    def set(self, key, result):
+        stored_at = time.time()
+        self._remember(key, stored_at, result)
+
+        # 先写临时文件再替换，避免其他进程读到写了一半的文件
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'stored_at': stored_at, 'result': result}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._maybe_prune()
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # 其他进程已经删除
+
+    def _maybe_prune(self):
+        with self._lock:
+            if time.monotonic() - self._last_prune < self.prune_interval:
+                return
+            self._last_prune = time.monotonic()
+        try:
+            removed = self.prune()
+            if removed:
+                print(f"OCR 缓存清理 {removed} 个文件", flush=True)
+        except OSError as e:
+            print(f"OCR 缓存清理失败: {e}", flush=True)
+
+    def prune(self):
+        """删除磁盘上过期的文件（含写了一半的临时文件），超过 max_files 时再删除最早写入的，返回删除的文件数"""
+        oldest = time.time() - self.ttl
+        entries = []
+        removed = 0
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                # 文件的修改时间就是写入时间（stored_at）
+                if mtime < oldest or (entry.name.endswith('.tmp') and mtime < time.time() - 3600):
+                    self._unlink(entry.path)
+                    removed += 1
+                elif entry.name.endswith('.json'):
+                    entries.append((mtime, entry.path))
+        if self.max_files is not None and len(entries) > self.max_files:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_files]:
+                self._unlink(path)
+                removed += 1
+        return removed
+
+    def get_or_recognize(self, image, options, recognize, pixels=None):
+        """命中缓存直接返回；否则调用 recognize(image, options)，只缓存成功的结果
+
+        pixels 是 image 解码后的像素数组，调用方已经解码过时传入，计算缓存键时不再解码 image
+        """
+        key = self.make_key(image, options, pixels)
+        result = self.get(key)
+        if result is not None:
+            print(f"OCR 缓存命中: {key[:12]}", flush=True)
+            return result
+
+        result = recognize(image, options)
+        if 'error_code' not in result:
+            self.set(key, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'memory_entries': len(self._memory),
+                'max_entries': self.max_entries,
+                'max_files': self.max_files,
+                'ttl': self.ttl
+            }
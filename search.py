@@ -0,0 +1,227 @@
+"""错题全文检索
+
+- MySQL：content、analysis 上建 FULLTEXT 索引，使用 ngram 分词器（默认两字一切，适合中文）。
+  单个汉字按前缀查询（+字*），能找到以它开头的两字 token；只出现在一段中文末尾的字（如"顶点"的"点"）
+  没有以它开头的 token，MySQL 自带的分词器下搜不到，除非把 ngram_token_size 设为 1（索引会大很多）
+- SQLite（本地开发和测试）：FTS5 表 mistake_fts，rowid 与 mistake.id 一致。
+  写入前在 Python 里把连续的中文切成两字一组的 token，每段末尾再加一个单字 token，
+  这样每个汉字都是某个 token 的开头，单字查询按前缀匹配能找到任何位置的字；
+  索引通过 Mistake 的 ORM 事件同步，批量写入/删除时由调用方调用 index_rows()/remove()。
+  分词方式改动后运行 python init_db.py upgrade 重建 FTS 表
+
+两种后端都按相关度排序，摘要和高亮统一在 Python 里生成。
+"""
+import html
+import re
+
+from sqlalchemy import event, inspect, select, text
+
+FULLTEXT_INDEX = 'ft_mistake_content_analysis'
+FTS_TABLE = 'mistake_fts'
+MAX_RANKED_CANDIDATES = 2000  # SQLite 下参与相关度排序和分页的最多命中数
+
+_CJK_RUN_RE = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+')
+
+
+def ngram_text(value):
+    """把连续的中文切成重叠的两字 token，末尾的字再单独作为一个 token，其他字符保持不变"""
+    def split(match):
+        run = match.group(0)
+        if len(run) == 1:
+            return f' {run} '
+        return ' ' + ' '.join([run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]) + ' '
+    return _CJK_RUN_RE.sub(split, value or '')
+
+
+def fts_phrase(term):
+    """把一个查询词转成 FTS5 的短语查询，与 ngram_text 的切分方式对应
+
+    词末尾的中文在文档里可能还没有结束，不能要求紧跟着单字 token：去掉最后一段的单字 token；
+    最后一段只有一个字时改为前缀匹配（"点"* 能匹配文档里的 点x 和末尾的单字 点）
+    """
+    tokens = ngram_text(term).split()
+    runs = _CJK_RUN_RE.findall(term)
+    prefix = False
+    if runs and term.endswith(runs[-1]):
+        if len(runs[-1]) > 1:
+            tokens.pop()
+        else:
+            prefix = True
+    return '"{}"{}'.format(' '.join(tokens).replace('"', '""'), '*' if prefix else '')
+
+
+def query_terms(q):
+    return [term for term in q.replace('"', ' ').split() if term]
+
+
+def make_snippet(value, terms, width=40):
+    """截取第一个命中词附近的文字，HTML 转义后用 <mark> 高亮所有命中词"""
+    if not value:
+        return None
+    lowered = value.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [p for p in positions if p >= 0]
+    if not positions:
+        return None
+
+    start = max(min(positions) - width // 2, 0)
+    end = min(start + width * 2, len(value))
+    snippet = html.escape(value[start:end])
+    for term in sorted(terms, key=len, reverse=True):
+        snippet = re.sub(re.escape(html.escape(term)), lambda m: f'<mark>{m.group(0)}</mark>',
+                         snippet, flags=re.IGNORECASE)
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(value) else '')
+
+
+class MistakeSearch:
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    @property
+    def dialect(self):
+        return self.db.engine.dialect.name
+
+    def register_events(self):
+        """增删改错题时同步 SQLite 的 FTS 表；MySQL 的 FULLTEXT 索引由数据库自己维护
+
+        每次 flush 改动的错题合并成一次删除和一次批量插入，语句数不随错题数增长
+        """
+        @event.listens_for(self.db.session, 'after_flush')
+        def sync_index(session, flush_context):
+            # after_flush 时 new/dirty/deleted 和属性的修改历史还是 flush 之前的状态
+            created = [target for target in session.new if isinstance(target, self.model)]
+            updated = []
+            for target in session.dirty:
+                if not isinstance(target, self.model):
+                    continue
+                state = inspect(target)
+                # 只改了标签等其他字段时不需要重建索引
+                if state.attrs.content.history.has_changes() or state.attrs.analysis.history.has_changes():
+                    updated.append(target)
+            removed = [target.id for target in session.deleted if isinstance(target, self.model)]
+            if not (created or updated or removed):
+                return
+            connection = session.connection()
+            if connection.dialect.name != 'sqlite':
+                return
+            self._sqlite_remove(connection, removed + [target.id for target in updated])
+            if created or updated:
+                self._sqlite_index(connection, [(target.id, target.content, target.analysis)
+                                                for target in created + updated], replace=False)
+
+    def setup(self):
+        """创建全文索引（已存在则跳过）"""
+        if self.dialect == 'mysql':
+            exists = self.db.session.execute(text(
+                'SELECT COUNT(*) FROM information_schema.statistics '
+                'WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :index'
+            ), {'table': self.model.__tablename__, 'index': FULLTEXT_INDEX}).scalar()
+            if not exists:
+                self.db.session.execute(text(
+                    f'ALTER TABLE {self.model.__tablename__} '
+                    f'ADD FULLTEXT INDEX {FULLTEXT_INDEX} (content, analysis) WITH PARSER ngram'
+                ))
+        elif self.dialect == 'sqlite':
+            exists = self.db.session.execute(text(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = :name"
+            ), {'name': FTS_TABLE}).scalar()
+            if not exists:
+                self.db.session.execute(text(f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(content, analysis)'))
+                self.rebuild()
+        self.db.session.commit()
+
+    def drop(self):
+        if self.dialect == 'sqlite':
+            self.db.session.execute(text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
+            self.db.session.commit()
+
+    def rebuild(self, batch_size=5000):
+        """根据 mistake 表重建 SQLite 的 FTS 表"""
+        if self.dialect != 'sqlite':
+            return
+        connection = self.db.session.connection()
+        connection.execute(text(f'DELETE FROM {FTS_TABLE}'))
+        table = self.model.__table__
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                select(table.c.id, table.c.content, table.c.analysis)
+                .where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            self._sqlite_index(connection, rows, replace=False)
+            last_id = rows[-1][0]
+
+    def index_rows(self, rows):
+        """批量写入后同步索引，rows 为 (id, content, analysis) 列表"""
+        if self.dialect == 'sqlite' and rows:
+            self._sqlite_index(self.db.session.connection(), rows)
+
+    def remove(self, mistake_ids):
+        if self.dialect == 'sqlite' and mistake_ids:
+            self._sqlite_remove(self.db.session.connection(), mistake_ids)
+
+    def _sqlite_index(self, connection, rows, replace=True):
+        if replace:
+            self._sqlite_remove(connection, [row[0] for row in rows])
+        connection.execute(
+            text(f'INSERT INTO {FTS_TABLE} (rowid, content, analysis) VALUES (:id, :content, :analysis)'),
+            [{'id': row[0], 'content': ngram_text(row[1]), 'analysis': ngram_text(row[2])} for row in rows]
+        )
+
+    def _sqlite_remove(self, connection, mistake_ids):
+        if not mistake_ids:
+            return
+        connection.execute(
+            text(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({",".join(str(int(i)) for i in mistake_ids)})')
+        )
+
+    def search(self, q, limit=20, offset=0):
+        """返回 (命中总数, [(mistake_id, score), ...], 是否截断)，按相关度倒序
+
+        SQLite 下命中数超过 MAX_RANKED_CANDIDATES 时只返回最新的这部分，命中总数也随之截断
+        """
+        terms = query_terms(q)
+        if not terms:
+            return 0, [], False
+        if self.dialect == 'mysql':
+            return self._search_mysql(terms, limit, offset)
+        if self.dialect == 'sqlite':
+            return self._search_sqlite(terms, limit, offset)
+        raise RuntimeError(f'不支持全文检索的数据库: {self.dialect}')
+
+    def _search_mysql(self, terms, limit, offset):
+        # 布尔模式下每个词都必须出现；ngram 分词器会把加引号的词当作相邻 token 序列匹配，
+        # 比 token 短的单个汉字用前缀查询
+        against = ' '.join(f'+{term}*' if _CJK_RUN_RE.fullmatch(term) and len(term) == 1 else f'+"{term}"'
+                           for term in terms)
+        match = 'MATCH(content, analysis) AGAINST(:q IN BOOLEAN MODE)'
+        table = self.model.__tablename__
+        total = self.db.session.execute(
+            text(f'SELECT COUNT(*) FROM {table} WHERE {match}'), {'q': against}
+        ).scalar()
+        rows = self.db.session.execute(text(
+            f'SELECT id, {match} AS score FROM {table} WHERE {match} '
+            f'ORDER BY score DESC, id DESC LIMIT :limit OFFSET :offset'
+        ), {'q': against, 'limit': limit, 'offset': offset}).fetchall()
+        return total, [(row[0], float(row[1])) for row in rows], False
+
+    def _search_sqlite(self, terms, limit, offset):
+        match = ' AND '.join(fts_phrase(term) for term in terms)
+        # 只在最新的 MAX_RANKED_CANDIDATES 条命中里计算 bm25 和分页，宽泛的词也能快速返回；
+        # 按 rowid 倒序截取候选集只需要遍历倒排表，不用计算相关度
+        total, min_rowid = self.db.session.execute(text(
+            f'SELECT COUNT(*), MIN(rowid) FROM ('
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :q ORDER BY rowid DESC LIMIT :cap)'
+        ), {'q': match, 'cap': MAX_RANKED_CANDIDATES}).one()
+        if not total:
+            return 0, [], False
+        # bm25 越小越相关，取负数作为分数
+        rows = self.db.session.execute(text(
+            f'SELECT rowid, -bm25({FTS_TABLE}) AS score FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH :q AND rowid >= :min_rowid '
+            f'ORDER BY bm25({FTS_TABLE}), rowid DESC LIMIT :limit OFFSET :offset'
+        ), {'q': match, 'min_rowid': min_rowid, 'limit': limit, 'offset': offset}).fetchall()
+        return total, [(row[0], float(row[1])) for row in rows], total >= MAX_RANKED_CANDIDATES
@@ -0,0 +1,222 @@
+"""相似题检索和重复题检测
+
+- 向量：题目内容规范化（同分析缓存的 normalize_content）后取 2、3 字的 n-gram，用 crc32 哈希到 dim 维并带符号累加，
+  计数开平方后归一化。不依赖模型和 GPU，几十微秒算一道题；余弦相似度接近 1 的基本是同一道题
+- 存储：mistake_embedding 表每道题一行（float16），写入随调用方的事务提交。seq 自增，
+  删除和修改都写一行新的，每个进程按 seq 增量同步到内存里的 float32 矩阵（128 维时 10 万道题约 64 MB）
+- 查询：矩阵和查询向量相乘，10 万道题几毫秒，argpartition 取前 k 个
+
+新建、修改、删除错题时由 register_events() 在 flush 时同步，批量导入和批量删除显式调用 index_rows()/remove()。
+seq 在插入时分配，MySQL 上并发事务的提交顺序可能和 seq 的顺序不同：同步时跳过的 seq（最近 gap_window 个以内）
+记下来，之后每次同步再查一遍，提交了就补上，gap_timeout 秒后还没有的（回滚或已被删除）不再查。
+同一道题的新旧两行不会乱序：写新行前要删除旧行，会等旧行所在的事务提交。SQLite 写入串行，不会乱序提交。
+修改 SIMILARITY_DIM 后清空 mistake_embedding 表，再运行 python init_db.py upgrade 重新计算。
+"""
+import threading
+import time
+import zlib
+
+import numpy as np
+from sqlalchemy import event, inspect, select
+
+from analyzer import normalize_content
+
+NGRAM_SIZES = (2, 3)
+
+
+def embed(text, dim=128):
+    """把题目内容转成 dim 维的单位向量（float32）"""
+    text = normalize_content(text or '')
+    grams = [text[i:i + n] for n in NGRAM_SIZES for i in range(len(text) - n + 1)] or list(text)
+    vector = np.zeros(dim, dtype=np.float32)
+    if not grams:
+        return vector
+    hashes = np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams), dtype=np.uint32, count=len(grams))
+    # 最高位决定符号，哈希冲突的特征互相抵消而不是累加
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, hashes % dim, signs)
+    # 开平方压低重复片段（如多次出现的"已知"）的权重
+    vector = np.sign(vector) * np.sqrt(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SimilarityIndex:
+    def __init__(self, db, model, vector_model, dim=128, gap_window=1000, gap_timeout=60):
+        self.db = db
+        self.model = model
+        self.table = vector_model.__table__
+        self.dim = dim
+        self.gap_window = gap_window
+        self.gap_timeout = gap_timeout
+        self._track_gaps = None  # 第一次同步时按数据库类型决定
+        self._gaps = {}  # 跳过的 seq -> 发现的时间
+        self._lock = threading.Lock()
+        self._ids = np.full(0, -1, dtype=np.int64)  # 行号 -> mistake_id，已删除的为 -1
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._count = 0
+        self._positions = {}  # mistake_id -> 行号
+        self._last_seq = 0
+
+    def register_events(self):
+        """新建、修改（内容变化）、删除错题时在同一个事务里写入向量表"""
+        @event.listens_for(self.db.session, 'after_flush')
+        def sync_vectors(session, flush_context):
+            created = [target for target in session.new if isinstance(target, self.model)]
+            updated = [target for target in session.dirty
+                       if isinstance(target, self.model) and inspect(target).attrs.content.history.has_changes()]
+            removed = [target.id for target in session.deleted if isinstance(target, self.model)]
+            if not (created or updated or removed):
+                return
+            connection = session.connection()
+            # 新建的题也要清理：SQLite 会复用已删除的最大 id，旧的删除标记还占着 mistake_id 的唯一索引
+            self._clear(connection, removed + [target.id for target in created + updated])
+            rows = [{'mistake_id': target.id, 'vector': self._encode(target.content)} for target in created + updated]
+            rows += [{'mistake_id': mistake_id, 'vector': None} for mistake_id in removed]
+            connection.execute(self.table.insert(), rows)
+
+    def _encode(self, content):
+        return embed(content, self.dim).astype(np.float16).tobytes()
+
+    def _clear(self, connection, mistake_ids):
+        if mistake_ids:
+            connection.execute(self.table.delete().where(self.table.c.mistake_id.in_(mistake_ids)))
+
+    def index_rows(self, rows, replace=True):
+        """批量写入后同步向量，rows 为 (id, content, ...) 列表，不提交"""
+        if not rows:
+            return
+        connection = self.db.session.connection()
+        if replace:
+            self._clear(connection, [row[0] for row in rows])
+        connection.execute(self.table.insert(), [{'mistake_id': row[0], 'vector': self._encode(row[1])}
+                                                 for row in rows])
+
+    def remove(self, mistake_ids):
+        """批量删除错题时写入删除标记，其他进程同步时从内存中移除，不提交"""
+        if not mistake_ids:
+            return
+        connection = self.db.session.connection()
+        self._clear(connection, mistake_ids)
+        connection.execute(self.table.insert(), [{'mistake_id': mistake_id, 'vector': None}
+                                                 for mistake_id in mistake_ids])
+
+    def index_missing(self, batch_size=2000):
+        """给还没有向量的错题补算向量（升级时回填），每批提交一次，返回补算的题数"""
+        mistakes = self.model.__table__
+        total = 0
+        last_id = 0
+        while True:
+            rows = self.db.session.execute(
+                select(mistakes.c.id, mistakes.c.content)
+                .select_from(mistakes.outerjoin(self.table, self.table.c.mistake_id == mistakes.c.id))
+                .where(mistakes.c.id > last_id, self.table.c.mistake_id.is_(None))
+                .order_by(mistakes.c.id).limit(batch_size)
+            ).fetchall()
+            if not rows:
+                return total
+            self.index_rows(rows, replace=False)
+            self.db.session.commit()
+            total += len(rows)
+            last_id = rows[-1][0]
+
+    def refresh(self):
+        """把其他进程（和本进程已提交）的改动同步到内存，读取 seq 更大的行和之前跳过的行"""
+        columns = (self.table.c.seq, self.table.c.mistake_id, self.table.c.vector)
+        with self._lock:
+            if self._track_gaps is None:
+                self._track_gaps = self.db.engine.dialect.name != 'sqlite'
+            with self.db.engine.connect() as connection:
+                now = time.monotonic()
+                self._gaps = {seq: found for seq, found in self._gaps.items() if now - found < self.gap_timeout}
+                if self._gaps:
+                    for seq, mistake_id, vector in connection.execute(
+                            select(*columns).where(self.table.c.seq.in_(list(self._gaps))).order_by(self.table.c.seq)):
+                        self._apply(mistake_id, vector)
+                        del self._gaps[seq]
+                
+                result = connection.execution_options(stream_results=True).execute(
+                    select(*columns).where(self.table.c.seq > self._last_seq).order_by(self.table.c.seq)
+                )
+                skipped = []  # 跳过的 seq 区间 [start, end)
+                for rows in result.partitions(5000):
+                    for seq, mistake_id, vector in rows:
+                        self._apply(mistake_id, vector)
+                        if seq > self._last_seq + 1:
+                            skipped.append((self._last_seq + 1, seq))
+                        self._last_seq = seq
+                if self._track_gaps:
+                    # 更早的空缺是已经删除的旧行，不会再出现，不用记
+                    oldest = self._last_seq - self.gap_window
+                    for start, end in skipped:
+                        for seq in range(max(start, oldest + 1), end):
+                            self._gaps[seq] = now
+
+    def _apply(self, mistake_id, vector):
+        position = self._positions.get(mistake_id)
+        if vector is None or len(vector) != self.dim * 2:
+            # 删除标记，或者 dim 改过之后的旧向量（需要重新计算）
+            if position is not None:
+                self._ids[position] = -1
+                self._matrix[position] = 0
+                del self._positions[mistake_id]
+            return
+        if position is None:
+            if self._count == len(self._ids):
+                self._grow()
+            position = self._count
+            self._count += 1
+            self._positions[mistake_id] = position
+            self._ids[position] = mistake_id
+        self._matrix[position] = np.frombuffer(vector, dtype=np.float16)
+
+    def _grow(self):
+        capacity = max(1024, len(self._ids) * 2)
+        ids = np.full(capacity, -1, dtype=np.int64)
+        ids[:self._count] = self._ids[:self._count]
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:self._count] = self._matrix[:self._count]
+        self._ids, self._matrix = ids, matrix
+
+    def vector_of(self, mistake_id):
+        """内存中某道题的向量，没有时返回 None"""
+        position = self._positions.get(mistake_id)
+        return None if position is None else self._matrix[position].copy()
+
+    def search(self, vectors, limit=10, min_score=0.0, exclude=()):
+        """对每个查询向量返回 [(mistake_id, 相似度), ...]，按相似度倒序；调用前先 refresh()"""
+        with self._lock:
+            ids, matrix, count = self._ids, self._matrix, self._count
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if not count:
+            return [[] for _ in queries]
+        scores = queries @ matrix[:count].T
+        scores[:, np.flatnonzero(ids[:count] < 0)] = -2  # 已删除的行
+        excluded = {int(mistake_id) for mistake_id in exclude}
+        k = limit + len(excluded)
+        results = []
+        for row in scores:
+            # 先按最低相似度过滤（查重复题时只剩几个），剩下的多于 k 个时再用 argpartition 取前 k 个
+            candidates = np.flatnonzero(row >= max(min_score, -1))
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-row[candidates], k - 1)[:k]]
+            candidates = candidates[np.argsort(-row[candidates])]
+            # 向量按 float16 保存，相同内容的相似度可能略大于 1
+            hits = [(int(ids[i]), min(float(row[i]), 1.0)) for i in candidates if int(ids[i]) not in excluded]
+            results.append(hits[:limit])
+        return results
+
+    def similar_to_texts(self, texts, limit=5, min_score=0.0):
+        """对还没保存的题目内容查找相似的已有错题（新建时检测重复）"""
+        if not texts:
+            return []
+        self.refresh()
+        return self.search([embed(text, self.dim) for text in texts], limit=limit, min_score=min_score)
+
+    def similar_to(self, mistake_id, content, limit=10, min_score=0.0):
+        """与某道已有错题相似的其他错题，内存里还没有这道题的向量时按 content 现算"""
+        self.refresh()
+        vector = self.vector_of(mistake_id)
+        if vector is None:
+            vector = embed(content, self.dim)
+        return self.search([vector], limit=limit, min_score=min_score, exclude=[mistake_id])[0]
@@ -0,0 +1,133 @@
+"""知识点统计：增量维护的每个标签的错题数、最近出现日期和按天计数
+
+- tag.mistake_count：关联的错题数
+- tag.last_seen：关联的错题里最近的记录日期（按错题的 created_at）
+- tag_daily：(标签, 日期) -> 当天记录的错题里带这个标签的数量，用来算最近几天的趋势
+
+标签索引（mistake_tags）每次增删关联时，在同一个事务里按差量更新上面三处，语句数固定，
+不随错题总数增长。读取统计只看 tag 表和窗口内的 tag_daily 行，与历史数据量无关。
+并发修改同一道题的标签时计数可能有偏差，rebuild() 按标签索引全量重算。
+"""
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, bindparam, case, func, select
+from sqlalchemy.dialects import mysql, sqlite
+
+
+class TagStats:
+    def __init__(self, db, tag_model, daily_model, mistake_model, links):
+        self.db = db
+        self.tag = tag_model.__table__
+        self.daily = daily_model.__table__
+        self.mistake = mistake_model.__table__
+        self.links = links
+
+    def current(self, mistake_ids):
+        """读取错题现有的标签关联和记录日期，返回 ({(mistake_id, tag_id), ...}, {mistake_id: 日期})"""
+        if not mistake_ids:
+            return set(), {}
+        rows = self.db.session.execute(
+            select(self.mistake.c.id, self.mistake.c.created_at, self.links.c.tag_id)
+            .select_from(self.mistake.outerjoin(self.links, self.links.c.mistake_id == self.mistake.c.id))
+            .where(self.mistake.c.id.in_(list(mistake_ids)))
+        ).fetchall()
+        links, days = set(), {}
+        for mistake_id, created_at, tag_id in rows:
+            days[mistake_id] = (created_at or datetime.now()).date()
+            if tag_id is not None:
+                links.add((mistake_id, tag_id))
+        return links, days
+
+    def apply(self, added, removed, days):
+        """按新增和删除的 (mistake_id, tag_id) 关联更新统计，days 为 current() 返回的日期，不提交"""
+        daily = Counter()
+        totals = Counter()
+        for delta, links in ((1, added), (-1, removed)):
+            for mistake_id, tag_id in links:
+                daily[(tag_id, days[mistake_id])] += delta
+                totals[tag_id] += delta
+        daily = {key: delta for key, delta in daily.items() if delta}
+        if daily:
+            self.db.session.execute(self._upsert_daily(), [
+                {'tag_id': tag_id, 'day': day, 'mistake_count': delta}
+                for (tag_id, day), delta in daily.items()
+            ])
+        totals = {tag_id: delta for tag_id, delta in totals.items() if delta}
+        if totals:
+            self.db.session.execute(
+                self.tag.update().where(self.tag.c.id == bindparam('tag_id_'))
+                .values(mistake_count=self.tag.c.mistake_count + bindparam('delta')),
+                [{'tag_id_': tag_id, 'delta': delta} for tag_id, delta in totals.items()]
+            )
+        touched = {tag_id for tag_id, _ in daily}
+        if touched:
+            # 最近出现日期从 tag_daily 按 (tag_id, day) 主键取最大值，删除错题后也能回退
+            latest = select(func.max(self.daily.c.day)).where(
+                and_(self.daily.c.tag_id == self.tag.c.id, self.daily.c.mistake_count > 0)
+            ).scalar_subquery()
+            self.db.session.execute(
+                self.tag.update().where(self.tag.c.id.in_(touched)).values(last_seen=latest)
+            )
+
+    def _upsert_daily(self):
+        """INSERT ... 已存在时累加计数（MySQL ON DUPLICATE KEY UPDATE / SQLite ON CONFLICT）"""
+        if self.db.engine.dialect.name == 'mysql':
+            insert = mysql.insert(self.daily)
+            return insert.on_duplicate_key_update(
+                mistake_count=self.daily.c.mistake_count + insert.inserted.mistake_count)
+        insert = sqlite.insert(self.daily)
+        return insert.on_conflict_do_update(
+            index_elements=['tag_id', 'day'],
+            set_={'mistake_count': self.daily.c.mistake_count + insert.excluded.mistake_count})
+
+    def rebuild(self):
+        """根据标签索引全量重算统计，可以重复执行"""
+        session = self.db.session
+        session.execute(self.daily.delete())
+        day = func.date(self.mistake.c.created_at)
+        session.execute(self.daily.insert().from_select(
+            ['tag_id', 'day', 'mistake_count'],
+            select(self.links.c.tag_id, day, func.count())
+            .select_from(self.links.join(self.mistake, self.mistake.c.id == self.links.c.mistake_id))
+            .group_by(self.links.c.tag_id, day)
+        ))
+        for_tag = and_(self.daily.c.tag_id == self.tag.c.id, self.daily.c.mistake_count > 0)
+        session.execute(self.tag.update().values(
+            mistake_count=select(func.coalesce(func.sum(self.daily.c.mistake_count), 0))
+            .where(for_tag).scalar_subquery(),
+            last_seen=select(func.max(self.daily.c.day)).where(for_tag).scalar_subquery()
+        ))
+
+    def summary(self, window_days=7, today=None):
+        """各标签的错题数、最近出现日期，以及最近 window_days 天和之前 window_days 天新增的错题数
+
+        返回 [{'name', 'count', 'last_seen', 'recent', 'previous', 'change'}]，只包含有错题的标签
+        """
+        today = today or date.today()
+        recent_start = today - timedelta(days=window_days - 1)
+        previous_start = recent_start - timedelta(days=window_days)
+        session = self.db.session
+        tags = session.execute(
+            select(self.tag.c.id, self.tag.c.name, self.tag.c.mistake_count, self.tag.c.last_seen)
+            .where(self.tag.c.mistake_count > 0)
+        ).fetchall()
+        windows = {tag_id: (recent or 0, previous or 0) for tag_id, recent, previous in session.execute(
+            select(self.daily.c.tag_id,
+                   func.sum(case((self.daily.c.day >= recent_start, self.daily.c.mistake_count), else_=0)),
+                   func.sum(case((self.daily.c.day < recent_start, self.daily.c.mistake_count), else_=0)))
+            .where(self.daily.c.day >= previous_start)
+            .group_by(self.daily.c.tag_id)
+        )}
+        stats = []
+        for tag_id, name, count, last_seen in tags:
+            recent, previous = windows.get(tag_id, (0, 0))
+            stats.append({
+                'name': name,
+                'count': count,
+                'last_seen': last_seen.isoformat() if last_seen else None,
+                'recent': int(recent),
+                'previous': int(previous),
+                'change': int(recent) - int(previous)
+            })
+        return stats
@@ -0,0 +1,8 @@
+from app import app, job_queue
+
+def run_worker():
+    # 轮询数据库中的待执行任务（OCR、分析、导出）
+    job_queue.run_worker(app, poll_interval=app.config['JOB_POLL_INTERVAL'])
+
+if __name__ == '__main__':
+    run_worker()